@@ -1,6 +1,6 @@
 # Pydantic Models for API
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 
 # ==================== AUTH MODELS ====================
 
@@ -31,10 +31,12 @@ class LessonCreate(BaseModel):
     memoryVerseText: str
     memoryVerseReference: str
     objectives: List[str]
-    sectionsJson: str
-    materialsJson: str
-    crossReferencesJson: Optional[str] = "[]"
-    configJson: Optional[str] = "{}"
+    # Accepted as JSON strings (legacy clients) or native lists/objects;
+    # always stored natively
+    sectionsJson: Union[str, List[Any]]
+    materialsJson: Union[str, List[Any]]
+    crossReferencesJson: Optional[Union[str, List[Any]]] = "[]"
+    configJson: Optional[Union[str, Dict[str, Any]]] = "{}"
     description: Optional[str] = None
 
 class GenerateLessonRequest(BaseModel):
@@ -15,6 +15,8 @@ from .user import router as user_router
 from .notifications import router as notifications_router
 from .series import router as series_router
 from .websocket import router as websocket_router
+from .revisions import router as revisions_router
+from .email import router as email_router
 
 __all__ = [
     "auth_router",
@@ -32,5 +34,7 @@ __all__ = [
     "user_router",
     "notifications_router",
     "series_router",
-    "websocket_router"
+    "websocket_router",
+    "revisions_router",
+    "email_router"
 ]
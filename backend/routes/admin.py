@@ -4,10 +4,36 @@ from datetime import datetime, timezone, timedelta
 from typing import Optional
 import logging
 
+from services.active_users import active_users, count_since, daily_counts
+from services.analytics_rollup import (
+    backfill_rollups,
+    daily_series,
+    day_key,
+    day_start,
+    get_daily_rows,
+    merge_maps,
+    record_subscription,
+    total,
+)
 from services.database import db
+from services.plan_breakdown import (
+    get_cached_plan_breakdown,
+    invalidate_plan_breakdown,
+    plan_breakdown_cache,
+)
+from services.cache import StaleWhileRevalidateCache
+from services.session_cache import invalidate_user
+from services.lesson_access import invalidate_lesson_access
 
 logger = logging.getLogger(__name__)
 
+# Dashboard reports change slowly: serve them from memory, refreshing in the
+# background once a minute old, so many admins refreshing cost one query set.
+# Periods are free-form, so the cache is bounded.
+admin_report_cache = StaleWhileRevalidateCache(
+    max_entries=64, fresh_for=60, max_age=15 * 60, name="admin-reports"
+)
+
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 async def get_current_admin_user(authorization: str = Header(None)) -> dict:
@@ -34,8 +60,14 @@ async def get_analytics(
     period: str = "7d",
     admin: dict = Depends(get_current_admin_user)
 ):
-    """Get site analytics for admin dashboard"""
-    
+    """
+    Get site analytics for admin dashboard. Counters come from daily rollups,
+    so a period covers whole UTC days: 24h is yesterday and today, 7d the
+    last seven days plus today.
+    """
+    return await admin_report_cache.get_or_load(("analytics", period), lambda: _analytics_report(period))
+
+async def _analytics_report(period: str) -> dict:
     # Calculate date range based on period
     now = datetime.now(timezone.utc)
     if period == "24h":
@@ -48,47 +80,32 @@ async def get_analytics(
         start_date = now - timedelta(days=90)
     else:
         start_date = now - timedelta(days=7)
+    # Rollups are per UTC day: start at midnight so every figure covers the same span
+    start_date = day_start(start_date)
     
     start_date_iso = start_date.isoformat()
+    start_day = day_key(start_date)
     
-    # Get new signups in period
-    new_signups_cursor = db.users.find({
-        "createdAt": {"$gte": start_date_iso}
-    }, {"_id": 0, "id": 1, "name": 1, "email": 1, "createdAt": 1})
-    new_signups = await new_signups_cursor.to_list(1000)
+    # Daily counters come from the rollups (one row per day)
+    rows = await get_daily_rows(start_day)
     
-    # Get total users
-    total_users = await db.users.count_documents({})
+    # Distinct active users from the day sketches; MAU needs at least 30 days
+    month_start = day_key(now - timedelta(days=29))
+    sketches = await active_users.get_sketches(min(start_day, month_start))
     
-    # Get lessons created in period
-    lessons_created_cursor = db.lessons.find({
-        "createdAt": {"$gte": start_date_iso}
-    }, {"_id": 0, "id": 1, "title": 1, "ageGroup": 1, "createdAt": 1})
-    lessons_created = await lessons_created_cursor.to_list(1000)
-    
-    # Get total lessons
+    # Get total users and lessons
+    total_users = await db.users.count_documents({})
     total_lessons = await db.lessons.count_documents({})
     
-    # Get active sessions in period (unique users)
-    active_sessions_cursor = db.sessions.find({
-        "createdAt": {"$gte": start_date_iso}
-    }, {"_id": 0, "userId": 1})
-    active_sessions = await active_sessions_cursor.to_list(10000)
-    unique_active_users = len(set(s.get("userId") for s in active_sessions if s.get("userId")))
-    
-    # Calculate daily signups for chart
-    daily_signups = {}
-    for signup in new_signups:
-        date_str = signup.get("createdAt", "")[:10]  # Get YYYY-MM-DD
-        if date_str:
-            daily_signups[date_str] = daily_signups.get(date_str, 0) + 1
-    
-    # Calculate daily lessons for chart
-    daily_lessons = {}
-    for lesson in lessons_created:
-        date_str = lesson.get("createdAt", "")[:10]
-        if date_str:
-            daily_lessons[date_str] = daily_lessons.get(date_str, 0) + 1
+    # Most recent signups/lessons for the tables
+    recent_signups = await db.users.find(
+        {"createdAt": {"$gte": start_date_iso}},
+        {"_id": 0, "id": 1, "name": 1, "email": 1, "createdAt": 1}
+    ).sort("createdAt", -1).limit(10).to_list(10)
+    recent_lessons = await db.lessons.find(
+        {"createdAt": {"$gte": start_date_iso}},
+        {"_id": 0, "id": 1, "title": 1, "ageGroup": 1, "createdAt": 1}
+    ).sort("createdAt", -1).limit(10).to_list(10)
     
     # Get age group distribution
     age_group_cursor = db.lessons.aggregate([
@@ -101,21 +118,85 @@ async def get_analytics(
         "period": period,
         "startDate": start_date_iso,
         "metrics": {
-            "newSignups": len(new_signups),
+            "newSignups": total(rows, "signups"),
             "totalUsers": total_users,
-            "lessonsCreated": len(lessons_created),
+            "lessonsCreated": total(rows, "lessonsCreated"),
+            "lessonsEdited": total(rows, "lessonsEdited"),
             "totalLessons": total_lessons,
-            "activeUsers": unique_active_users,
+            "activeUsers": count_since(sketches, start_day),
+            "dau": count_since(sketches, day_key(now)),
+            "wau": count_since(sketches, day_key(now - timedelta(days=6))),
+            "mau": count_since(sketches, month_start),
         },
         "charts": {
-            "dailySignups": daily_signups,
-            "dailyLessons": daily_lessons,
+            "dailySignups": daily_series(rows, "signups"),
+            "dailyLessons": daily_series(rows, "lessonsCreated"),
+            "dailyActiveUsers": {
+                day: n for day, n in daily_counts(sketches).items() if day >= start_day
+            },
             "ageGroupDistribution": age_group_distribution,
         },
-        "recentSignups": new_signups[:10],
-        "recentLessons": lessons_created[:10],
+        "recentSignups": recent_signups,
+        "recentLessons": recent_lessons,
+    }
+
+@router.post("/analytics/rollups/rebuild")
+async def rebuild_analytics_rollups(
+    days: Optional[int] = None,
+    admin: dict = Depends(get_current_admin_user)
+):
+    """Recompute daily analytics rollups from the source collections"""
+    result = await backfill_rollups(days)
+    admin_report_cache.clear()
+    logger.info(f"Admin {admin['email']} rebuilt analytics rollups: {result}")
+    return {"success": True, **result}
+
+@router.get("/analytics/cache")
+async def get_report_cache_stats(
+    admin: dict = Depends(get_current_admin_user)
+):
+    """Hit rates and sizes of the dashboard report caches"""
+    return {"caches": [admin_report_cache.stats(), plan_breakdown_cache.stats()]}
+
+@router.get("/job-runs")
+async def get_job_runs(
+    job: Optional[str] = None,
+    limit: int = 20,
+    admin: dict = Depends(get_current_admin_user)
+):
+    """Recent scheduled job runs with duration and outcome"""
+    query = {"job": job} if job else {}
+    runs = await db.job_runs.find(
+        query, {"_id": 0, "expiresAt": 0}
+    ).sort("startedAt", -1).limit(min(limit, 100)).to_list(100)
+    return {"runs": runs}
+
+@router.get("/scheduled-jobs")
+async def get_scheduled_jobs(
+    admin: dict = Depends(get_current_admin_user)
+):
+    """Scheduled job state (last/next run) and the worker currently running them"""
+    from services.scheduled_jobs import job_runner
+    
+    jobs = await db.scheduled_jobs.find({}).sort("_id", 1).to_list(100)
+    for job in jobs:
+        job["id"] = job.pop("_id")
+    lease = await job_runner.lease.current_holder()
+    return {
+        "jobs": jobs,
+        "leader": lease.get("holder") if lease else None,
+        "leaseExpiresAt": lease.get("expiresAt") if lease else None,
     }
 
+@router.get("/email-outbox")
+async def get_email_outbox(
+    admin: dict = Depends(get_current_admin_user)
+):
+    """Outbound email queue: messages per status and recent failures"""
+    from services.email_service import email_service
+    
+    return await email_service.stats()
+
 @router.get("/users")
 async def get_users(
     page: int = 1,
@@ -162,8 +243,10 @@ async def get_spending(
     period: str = "30d",
     admin: dict = Depends(get_current_admin_user)
 ):
-    """Get site spending/revenue metrics"""
-    
+    """Get site spending/revenue metrics (whole UTC days, like /analytics)"""
+    return await admin_report_cache.get_or_load(("spending", period), lambda: _spending_report(period))
+
+async def _spending_report(period: str) -> dict:
     # Calculate date range
     now = datetime.now(timezone.utc)
     if period == "7d":
@@ -174,57 +257,28 @@ async def get_spending(
         start_date = now - timedelta(days=90)
     else:
         start_date = now - timedelta(days=30)
+    start_date = day_start(start_date)
     
-    start_date_iso = start_date.isoformat()
-    
-    # Get subscriptions/payments in period
-    subscriptions_cursor = db.subscriptions.find({
-        "createdAt": {"$gte": start_date_iso}
-    }, {"_id": 0})
-    subscriptions = await subscriptions_cursor.to_list(1000)
-    
-    # Calculate revenue by plan
-    revenue_by_plan = {}
-    total_revenue = 0
-    
-    plan_prices = {
-        "starter": 0,
-        "pro": 9.99,
-        "team": 24.99
-    }
-    
-    for sub in subscriptions:
-        plan = sub.get("planId", "starter")
-        price = plan_prices.get(plan, 0)
-        revenue_by_plan[plan] = revenue_by_plan.get(plan, 0) + price
-        total_revenue += price
+    # Revenue and new subscriptions come from the daily rollups
+    rows = await get_daily_rows(day_key(start_date))
+    revenue_by_plan = merge_maps(rows, "revenueByPlan")
     
     # Get subscription counts
-    subscription_counts = {}
     all_subs_cursor = db.subscriptions.aggregate([
         {"$group": {"_id": "$planId", "count": {"$sum": 1}}}
     ])
     all_subs = await all_subs_cursor.to_list(100)
     subscription_counts = {s["_id"]: s["count"] for s in all_subs if s["_id"]}
     
-    # Daily revenue calculation
-    daily_revenue = {}
-    for sub in subscriptions:
-        date_str = sub.get("createdAt", "")[:10]
-        plan = sub.get("planId", "starter")
-        price = plan_prices.get(plan, 0)
-        if date_str:
-            daily_revenue[date_str] = daily_revenue.get(date_str, 0) + price
-    
     return {
         "period": period,
         "metrics": {
-            "totalRevenue": round(total_revenue, 2),
-            "newSubscriptions": len(subscriptions),
+            "totalRevenue": round(total(rows, "revenue"), 2),
+            "newSubscriptions": total(rows, "subscriptions"),
             "subscriptionCounts": subscription_counts,
         },
-        "revenueByPlan": revenue_by_plan,
-        "dailyRevenue": daily_revenue,
+        "revenueByPlan": {plan: round(amount, 2) for plan, amount in revenue_by_plan.items()},
+        "dailyRevenue": {day: round(amount, 2) for day, amount in daily_series(rows, "revenue").items()},
     }
 
 @router.get("/lessons-stats")
@@ -232,8 +286,10 @@ async def get_lessons_stats(
     period: str = "30d",
     admin: dict = Depends(get_current_admin_user)
 ):
-    """Get detailed lesson statistics"""
-    
+    """Get detailed lesson statistics (whole UTC days, like /analytics)"""
+    return await admin_report_cache.get_or_load(("lessons-stats", period), lambda: _lessons_stats_report(period))
+
+async def _lessons_stats_report(period: str) -> dict:
     now = datetime.now(timezone.utc)
     if period == "7d":
         start_date = now - timedelta(days=7)
@@ -241,26 +297,27 @@ async def get_lessons_stats(
         start_date = now - timedelta(days=30)
     else:
         start_date = now - timedelta(days=30)
+    start_date = day_start(start_date)
     
     start_date_iso = start_date.isoformat()
-    
-    # Get lessons created in period
-    lessons_cursor = db.lessons.find({
-        "createdAt": {"$gte": start_date_iso}
-    }, {"_id": 0, "id": 1, "title": 1, "ageGroup": 1, "theme": 1, "duration": 1, "createdAt": 1})
-    lessons = await lessons_cursor.to_list(1000)
-    
-    # Theme distribution
-    theme_distribution = {}
-    for lesson in lessons:
-        theme = lesson.get("theme", "Unknown")
-        theme_distribution[theme] = theme_distribution.get(theme, 0) + 1
-    
-    # Duration distribution
-    duration_distribution = {}
-    for lesson in lessons:
-        duration = lesson.get("duration", "Unknown")
-        duration_distribution[duration] = duration_distribution.get(duration, 0) + 1
+    rows = await get_daily_rows(day_key(start_date))
+    
+    # Theme and duration distributions are grouped in MongoDB
+    facets = await db.lessons.aggregate([
+        {"$match": {"createdAt": {"$gte": start_date_iso}}},
+        {"$facet": {
+            "themes": [{"$group": {"_id": {"$ifNull": ["$theme", "Unknown"]}, "count": {"$sum": 1}}}],
+            "durations": [{"$group": {"_id": {"$ifNull": ["$duration", "Unknown"]}, "count": {"$sum": 1}}}],
+            "recent": [
+                {"$sort": {"createdAt": -1}},
+                {"$limit": 20},
+                {"$project": {"_id": 0, "id": 1, "title": 1, "ageGroup": 1, "theme": 1, "duration": 1, "createdAt": 1}},
+            ],
+        }}
+    ]).to_list(1)
+    facets = facets[0] if facets else {"themes": [], "durations": [], "recent": []}
+    theme_distribution = {t["_id"]: t["count"] for t in facets["themes"]}
+    duration_distribution = {d["_id"]: d["count"] for d in facets["durations"]}
     
     # Get total lessons by age group
     age_group_cursor = db.lessons.aggregate([
@@ -271,11 +328,11 @@ async def get_lessons_stats(
     
     return {
         "period": period,
-        "totalCreated": len(lessons),
+        "totalCreated": total(rows, "lessonsCreated"),
         "themeDistribution": theme_distribution,
         "durationDistribution": duration_distribution,
         "ageGroupDistribution": age_group_distribution,
-        "recentLessons": lessons[:20],
+        "recentLessons": facets["recent"],
     }
 
 @router.get("/plan-breakdown")
@@ -283,80 +340,7 @@ async def get_plan_breakdown(
     admin: dict = Depends(get_current_admin_user)
 ):
     """Get breakdown of users by subscription plan"""
-    
-    # Define plan tiers
-    plan_info = {
-        "free": {"name": "Free", "price": 0, "color": "stone"},
-        "starter": {"name": "Starter", "price": 0, "color": "stone"},
-        "pro": {"name": "Pro", "price": 9.99, "color": "amber"},
-        "team": {"name": "Team", "price": 24.99, "color": "blue"},
-        "enterprise": {"name": "Enterprise", "price": 99.99, "color": "purple"},
-    }
-    
-    # Get all users with their subscription status
-    users_cursor = db.users.find({}, {"_id": 0, "id": 1, "name": 1, "email": 1, "createdAt": 1})
-    users = await users_cursor.to_list(10000)
-    
-    # Get all subscriptions
-    subs_cursor = db.subscriptions.find({"status": {"$in": ["active", "trialing"]}}, {"_id": 0})
-    subscriptions = await subs_cursor.to_list(10000)
-    
-    # Build user -> plan mapping
-    user_plans = {}
-    for sub in subscriptions:
-        user_id = sub.get("userId")
-        plan_id = sub.get("planId", "free")
-        if user_id:
-            user_plans[user_id] = plan_id
-    
-    # Count users by plan
-    plan_counts = {"free": 0, "starter": 0, "pro": 0, "team": 0, "enterprise": 0}
-    plan_users = {"free": [], "starter": [], "pro": [], "team": [], "enterprise": []}
-    
-    for user in users:
-        user_id = user.get("id")
-        plan = user_plans.get(user_id, "free")
-        if plan not in plan_counts:
-            plan = "free"
-        plan_counts[plan] += 1
-        # Store user details for the plan (limit to 10 per plan for UI)
-        if len(plan_users[plan]) < 10:
-            plan_users[plan].append({
-                "id": user.get("id"),
-                "name": user.get("name", "Unknown"),
-                "email": user.get("email"),
-                "createdAt": user.get("createdAt"),
-            })
-    
-    # Calculate totals and percentages
-    total_users = len(users)
-    plan_breakdown = []
-    
-    for plan_id, count in plan_counts.items():
-        info = plan_info.get(plan_id, plan_info["free"])
-        percentage = round((count / total_users * 100), 1) if total_users > 0 else 0
-        plan_breakdown.append({
-            "planId": plan_id,
-            "planName": info["name"],
-            "price": info["price"],
-            "color": info["color"],
-            "userCount": count,
-            "percentage": percentage,
-            "monthlyRevenue": round(count * info["price"], 2),
-            "recentUsers": plan_users[plan_id],
-        })
-    
-    # Sort by price (free first, then ascending)
-    plan_breakdown.sort(key=lambda x: (x["price"] == 0, x["price"]))
-    
-    # Calculate MRR (Monthly Recurring Revenue)
-    total_mrr = sum(p["monthlyRevenue"] for p in plan_breakdown)
-    
-    return {
-        "totalUsers": total_users,
-        "totalMRR": round(total_mrr, 2),
-        "breakdown": plan_breakdown,
-    }
+    return await get_cached_plan_breakdown()
 
 
 @router.post("/set-admin/{user_id}")
@@ -374,6 +358,8 @@ async def set_user_admin(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    invalidate_user(user_id)
+    invalidate_lesson_access(user_id=user_id)
     return {"success": True, "message": f"User {user_id} is now an admin"}
 
 @router.post("/remove-admin/{user_id}")
@@ -395,6 +381,8 @@ async def remove_user_admin(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    invalidate_user(user_id)
+    invalidate_lesson_access(user_id=user_id)
     return {"success": True, "message": f"Admin role removed from user {user_id}"}
 
 
@@ -475,6 +463,8 @@ async def create_custom_subscription(
         {"$set": subscription_data},
         upsert=True
     )
+    await record_subscription(custom_plan_id, subscription_data["createdAt"])
+    invalidate_plan_breakdown()
     
     logger.info(f"Admin {admin['email']} created custom subscription for user {user['email']}: {data.planName}")
     
@@ -572,6 +562,7 @@ async def cancel_subscription(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Subscription not found")
     
+    invalidate_plan_breakdown()
     return {"success": True, "message": "Subscription canceled"}
 
 @router.put("/subscriptions/{subscription_id}")
@@ -610,4 +601,5 @@ async def update_subscription(
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Subscription not found")
     
+    invalidate_plan_breakdown()
     return {"success": True, "message": "Subscription updated"}
@@ -0,0 +1,147 @@
+# Admin Data Export Routes
+# Streams whole collections as CSV or NDJSON straight from a Mongo cursor,
+# so large exports start downloading at once and use constant memory.
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+import csv
+import io
+import json
+import logging
+
+from routes.admin import get_current_admin_user
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin/export", tags=["Admin"])
+
+# Documents fetched per cursor round trip, and rows per chunk written out
+CURSOR_BATCH_SIZE = 1000
+ROWS_PER_CHUNK = 500
+
+# Exportable datasets: collection, columns (also the projection), the field
+# that `since` filters on, and an indexed sort (default _id). Secrets
+# (password hashes, OAuth tokens) are never in a column list.
+DATASETS = {
+    "users": {
+        "collection": "users",
+        "fields": ["id", "email", "name", "role", "createdAt"],
+        "dateField": "createdAt",
+    },
+    "subscriptions": {
+        "collection": "subscriptions",
+        "fields": [
+            "id", "userId", "planId", "planName", "status", "interval", "isCustomPlan",
+            "customPrice", "lessonsUsed", "lessonsLimit", "stripeSubscriptionId",
+            "currentPeriodStart", "currentPeriodEnd", "createdAt", "updatedAt", "canceledAt",
+        ],
+        "dateField": "createdAt",
+    },
+    "lessons": {
+        "collection": "lessons",
+        "fields": [
+            "id", "userId", "title", "ageGroup", "theme", "duration", "passage",
+            "memoryVerseReference", "createdAt", "updatedAt",
+        ],
+        "dateField": "createdAt",
+    },
+    "analytics": {
+        "collection": "analytics_daily",
+        "fields": [
+            "date", "signups", "lessonsCreated", "lessonsEdited", "subscriptions",
+            "revenue", "plans", "revenueByPlan", "ageGroups",
+        ],
+        "dateField": "date",
+        "sort": "date",
+    },
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+# Spreadsheet apps evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_value(value):
+    """
+    Flatten nested values so every CSV cell is a scalar, and quote text that
+    a spreadsheet would run as a formula (names, titles are user input)
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+async def _csv_rows(cursor, fields: List[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    rows = 0
+    async for doc in cursor:
+        writer.writerow([_csv_value(doc.get(f)) for f in fields])
+        rows += 1
+        if rows % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def _ndjson_rows(cursor) -> AsyncIterator[str]:
+    lines = []
+    async for doc in cursor:
+        lines.append(json.dumps(doc, default=str))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+@router.get("/{dataset}")
+async def export_dataset(
+    dataset: str,
+    format: str = "csv",
+    since: Optional[str] = None,
+    admin: dict = Depends(get_current_admin_user)
+):
+    """Stream a full dataset as CSV or NDJSON (optionally only records since a date)"""
+    spec = DATASETS.get(dataset)
+    if not spec:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset. Available: {', '.join(DATASETS)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'ndjson'")
+
+    query = {spec["dateField"]: {"$gte": since}} if since else {}
+    projection = {"_id": 0, **{f: 1 for f in spec["fields"]}}
+    # Index-backed order, so the export never needs an in-memory sort
+    cursor = (
+        db[spec["collection"]]
+        .find(query, projection)
+        .sort(spec.get("sort", "_id"), 1)
+        .batch_size(CURSOR_BATCH_SIZE)
+    )
+
+    if format == "csv":
+        body = _csv_rows(cursor, spec["fields"])
+    else:
+        body = _ndjson_rows(cursor)
+
+    logger.info(f"Admin {admin['email']} exported {dataset} as {format}" + (f" since {since}" if since else ""))
+
+    filename = f"{dataset}-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -9,6 +9,7 @@ import anthropic
 
 from models.schemas import GenerateLessonRequest, QuizGenerateRequest, SupplyListExtractRequest, BiblicalMapExtractRequest
 from services.database import db
+from services.lesson_storage import lesson_materials, lesson_sections
 
 router = APIRouter(prefix="/ai", tags=["AI Generation"])
 logger = logging.getLogger(__name__)
@@ -359,23 +360,8 @@ async def extract_supply_list(request: SupplyListExtractRequest, authorization:
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
     
-    materials_json = lesson.get("materialsJson", "[]")
-    if isinstance(materials_json, str):
-        try:
-            materials = json.loads(materials_json)
-        except:
-            materials = []
-    else:
-        materials = materials_json
-    
-    sections_json = lesson.get("sectionsJson", "[]")
-    if isinstance(sections_json, str):
-        try:
-            sections = json.loads(sections_json)
-        except:
-            sections = []
-    else:
-        sections = sections_json
+    materials = lesson_materials(lesson)
+    sections = lesson_sections(lesson)
     
     prompt = f"""Analyze this Bible lesson and extract a comprehensive supply list:
 
@@ -478,14 +464,7 @@ async def extract_biblical_locations(request: BiblicalMapExtractRequest, authori
         title = lesson.get("title", "Bible Lesson")
         passage = lesson.get("passage", "")
         
-        sections_json = lesson.get("sectionsJson", "[]")
-        if isinstance(sections_json, str):
-            try:
-                sections = json.loads(sections_json)
-            except:
-                sections = []
-        else:
-            sections = sections_json
+        sections = lesson_sections(lesson)
         
         lesson_content = "\n\n".join([
             f"{s.get('title', '')}: {s.get('content', '')}" 
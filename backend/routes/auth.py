@@ -1,22 +1,22 @@
 # Auth Routes
-from fastapi import APIRouter, HTTPException, Header, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Header
 from datetime import datetime, timezone
 import hashlib
 import secrets
 import uuid
-import os
-import requests
 import logging
 
 from models.schemas import UserCreate, UserLogin
+from services.active_users import active_users
+from services.analytics_rollup import record_signup
 from services.database import db
+from services.email_service import email_service
+from services.email_templates import render
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
-# Email configuration
-RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
 ADMIN_EMAIL = "hello@biblelessonplanner.com"
 
 def hash_password(password: str) -> str:
@@ -44,77 +44,24 @@ async def get_current_user(token: str = None) -> dict:
     user = await db.users.find_one({"id": session["userId"]})
     return serialize_doc(user)
 
-def send_new_user_notification_email(user_name: str, user_email: str):
-    """Send email notification to admin when a new user signs up"""
-    logger.info(f"[Auth] Attempting to send new user notification for {user_email}")
-    if not RESEND_API_KEY:
-        logger.warning(f"[Auth] Email skipped - RESEND_API_KEY not configured")
-        return False
+async def queue_new_user_notification_email(user_name: str, user_email: str):
+    """Queue an email notification to the admin when a new user signs up"""
+    html_content = render(
+        "new_user.html",
+        user_name=user_name,
+        user_email=user_email,
+        signed_up_at=datetime.now(timezone.utc).strftime('%B %d, %Y at %I:%M %p UTC'),
+    )
     
-    try:
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; background: #f9fafb; padding: 20px; }}
-                .container {{ max-width: 600px; margin: 0 auto; background: white; border-radius: 12px; overflow: hidden; box-shadow: 0 4px 6px rgba(0,0,0,0.1); }}
-                .header {{ background: linear-gradient(135deg, #f59e0b 0%, #d97706 100%); padding: 24px; text-align: center; }}
-                .header h1 {{ color: white; margin: 0; font-size: 24px; }}
-                .content {{ padding: 32px; }}
-                .user-info {{ background: #fef3c7; border-radius: 12px; padding: 20px; margin: 16px 0; }}
-                .footer {{ padding: 24px; text-align: center; color: #9ca3af; font-size: 12px; border-top: 1px solid #e5e7eb; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>New User Signup!</h1>
-                </div>
-                <div class="content">
-                    <h2 style="color: #1f2937; margin-top: 0;">A new user has joined Bible Lesson Planner</h2>
-                    <div class="user-info">
-                        <p style="margin: 0;"><strong>Name:</strong> {user_name}</p>
-                        <p style="margin: 8px 0 0 0;"><strong>Email:</strong> {user_email}</p>
-                        <p style="margin: 8px 0 0 0;"><strong>Signed up at:</strong> {datetime.now(timezone.utc).strftime('%B %d, %Y at %I:%M %p UTC')}</p>
-                    </div>
-                    <p style="color: #6b7280;">This notification was sent because a new user registered on your platform.</p>
-                </div>
-                <div class="footer">
-                    <p>Bible Lesson Planner - Rooted in Scripture</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        response = requests.post(
-            'https://api.resend.com/emails',
-            headers={
-                'Authorization': f'Bearer {RESEND_API_KEY}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'from': 'Bible Lesson Planner <onboarding@resend.dev>',
-                'to': [ADMIN_EMAIL],
-                'subject': f'New User Signup: {user_name}',
-                'html': html_content
-            }
-        )
-        
-        if response.status_code in [200, 201]:
-            logger.info(f"[Auth] New user notification sent to {ADMIN_EMAIL}")
-            return True
-        else:
-            logger.error(f"[Auth] Email failed: {response.text}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"[Auth] Email error: {e}")
-        return False
+    await email_service.enqueue(
+        ADMIN_EMAIL,
+        f'New User Signup: {user_name}',
+        html_content,
+        kind="new_user",
+    )
 
 @router.post("/signup")
-async def signup(data: UserCreate, background_tasks: BackgroundTasks):
+async def signup(data: UserCreate):
     # Check if user exists
     existing = await db.users.find_one({"email": data.email.lower()})
     if existing:
@@ -129,6 +76,7 @@ async def signup(data: UserCreate, background_tasks: BackgroundTasks):
         "createdAt": datetime.now(timezone.utc).isoformat(),
     }
     await db.users.insert_one(user)
+    await record_signup(user["createdAt"])
     
     # Create session
     token = generate_token()
@@ -137,6 +85,7 @@ async def signup(data: UserCreate, background_tasks: BackgroundTasks):
         "userId": user_id,
         "createdAt": datetime.now(timezone.utc).isoformat(),
     })
+    active_users.observe(user_id)
     
     # Create default preferences
     await db.preferences.insert_one({
@@ -146,8 +95,11 @@ async def signup(data: UserCreate, background_tasks: BackgroundTasks):
         "onboardingCompleted": False,
     })
     
-    # Send new user notification email in background
-    background_tasks.add_task(send_new_user_notification_email, data.name, data.email.lower())
+    # Queue the admin notification; delivery happens off the request path
+    try:
+        await queue_new_user_notification_email(data.name, data.email.lower())
+    except Exception as e:
+        logger.error(f"[Auth] Failed to queue new user notification: {e}")
     
     return {
         "token": token,
@@ -172,6 +124,7 @@ async def signin(data: UserLogin):
         "userId": user["id"],
         "createdAt": datetime.now(timezone.utc).isoformat(),
     })
+    active_users.observe(user["id"])
     
     return {
         "token": token,
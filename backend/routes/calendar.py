@@ -5,26 +5,16 @@ from datetime import datetime, timezone
 import uuid
 import os
 import json
-import requests
 
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request as GoogleRequest
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 
 from models.schemas import CalendarSyncRequest, CalendarEventCreate
+from services import google_calendar
 from services.database import db
+from services.google_calendar import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_SCOPES
 
 router = APIRouter(prefix="/calendar", tags=["Calendar Sync"])
 
-# Google OAuth Configuration
-GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CALENDAR_CLIENT_ID')
-GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CALENDAR_CLIENT_SECRET')
-GOOGLE_SCOPES = [
-    'https://www.googleapis.com/auth/calendar',
-    'https://www.googleapis.com/auth/userinfo.email'
-]
-
 # Calendar ID Configuration
 # - 'primary': Uses the user's main Google Calendar (default)
 # - Custom ID: e.g., 'abc123@group.calendar.google.com' for a specific calendar
@@ -96,43 +86,8 @@ def get_google_flow(redirect_uri: str):
     return flow
 
 async def get_google_credentials(user_id: str):
-    """Get Google credentials for a user, refreshing if needed"""
-    user = await db.users.find_one({"id": user_id})
-    if not user or 'google_calendar_tokens' not in user:
-        return None
-    
-    tokens = user['google_calendar_tokens']
-    
-    creds = Credentials(
-        token=tokens.get('access_token'),
-        refresh_token=tokens.get('refresh_token'),
-        token_uri='https://oauth2.googleapis.com/token',
-        client_id=GOOGLE_CLIENT_ID,
-        client_secret=GOOGLE_CLIENT_SECRET,
-        scopes=GOOGLE_SCOPES
-    )
-    
-    # Refresh if expired
-    if creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(GoogleRequest())
-            # Update stored tokens
-            await db.users.update_one(
-                {"id": user_id},
-                {"$set": {
-                    "google_calendar_tokens.access_token": creds.token
-                }}
-            )
-        except Exception as e:
-            print(f"Error refreshing credentials: {e}")
-            # Clear invalid tokens
-            await db.users.update_one(
-                {"id": user_id},
-                {"$unset": {"google_calendar_tokens": ""}}
-            )
-            return None
-    
-    return creds
+    """Get Google credentials for a user, refreshing if needed (cached in memory)"""
+    return await google_calendar.get_credentials(user_id)
 
 @router.get("/google/status")
 async def get_google_calendar_status(authorization: str = Header(None)):
@@ -231,33 +186,14 @@ async def google_oauth_callback(code: str = None, state: str = None, error: str
     try:
         # Exchange code for tokens directly (avoids scope mismatch issues)
         redirect_uri = f"{BACKEND_URL}/api/calendar/google/callback"
-        token_response = requests.post(
-            'https://oauth2.googleapis.com/token',
-            data={
-                'code': code,
-                'client_id': GOOGLE_CLIENT_ID,
-                'client_secret': GOOGLE_CLIENT_SECRET,
-                'redirect_uri': redirect_uri,
-                'grant_type': 'authorization_code'
-            }
-        )
-        
-        if token_response.status_code != 200:
-            error_data = token_response.json()
-            print(f"Token exchange error: {error_data}")
+        try:
+            tokens = await google_calendar.exchange_code(code, redirect_uri)
+        except ValueError as e:
+            print(f"Token exchange error: {e}")
             return RedirectResponse(f"{FRONTEND_URL}/lessons?calendar_error=token_exchange_failed")
         
-        tokens = token_response.json()
-        
         # Get user email
-        user_info_response = requests.get(
-            'https://www.googleapis.com/oauth2/v2/userinfo',
-            headers={'Authorization': f'Bearer {tokens["access_token"]}'}
-        )
-        
-        google_email = None
-        if user_info_response.status_code == 200:
-            google_email = user_info_response.json().get('email')
+        google_email = await google_calendar.fetch_account_email(tokens["access_token"])
         
         # Store tokens in user document
         await db.users.update_one(
@@ -268,6 +204,7 @@ async def google_oauth_callback(code: str = None, state: str = None, error: str
                 "google_calendar_connected_at": datetime.now(timezone.utc).isoformat()
             }}
         )
+        google_calendar.invalidate(user_id)
         
         return RedirectResponse(f"{FRONTEND_URL}/lessons?calendar_connected=true")
         
@@ -294,6 +231,7 @@ async def disconnect_google_calendar(authorization: str = Header(None)):
             "google_calendar_connected_at": ""
         }}
     )
+    google_calendar.invalidate(user['id'])
     
     return {"success": True, "message": "Google Calendar disconnected"}
 
@@ -323,9 +261,6 @@ async def create_google_calendar_event(data: CalendarEventCreate, authorization:
         )
     
     try:
-        # Build Calendar service
-        service = build('calendar', 'v3', credentials=creds)
-        
         # Get the appropriate calendar ID
         calendar_id = get_calendar_id(user)
         
@@ -346,16 +281,18 @@ async def create_google_calendar_event(data: CalendarEventCreate, authorization:
             },
         }
         
-        created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
+        created_event = await google_calendar.execute(
+            user['id'], creds, lambda service: service.events().insert(calendarId=calendar_id, body=event)
+        )
         
         # Also add to shared calendar if configured
         shared_event = None
         if GOOGLE_SHARED_CALENDAR_ID and calendar_id != GOOGLE_SHARED_CALENDAR_ID:
             try:
-                shared_event = service.events().insert(
-                    calendarId=GOOGLE_SHARED_CALENDAR_ID, 
-                    body=event
-                ).execute()
+                shared_event = await google_calendar.execute(
+                    user['id'], creds,
+                    lambda service: service.events().insert(calendarId=GOOGLE_SHARED_CALENDAR_ID, body=event)
+                )
             except Exception as shared_err:
                 print(f"Could not add to shared calendar: {shared_err}")
         
@@ -396,20 +333,18 @@ async def get_google_calendar_events(authorization: str = Header(None)):
         raise HTTPException(status_code=400, detail="Google Calendar not connected")
     
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        
         # Get the appropriate calendar ID
         calendar_id = get_calendar_id(user)
         
         # Get next 10 events
         now = datetime.now(timezone.utc).isoformat()
-        events_result = service.events().list(
+        events_result = await google_calendar.execute(user['id'], creds, lambda service: service.events().list(
             calendarId=calendar_id,
             timeMin=now,
             maxResults=10,
             singleEvents=True,
             orderBy='startTime'
-        ).execute()
+        ))
         
         events = events_result.get('items', [])
         
@@ -446,10 +381,10 @@ async def list_google_calendars(authorization: str = Header(None)):
         raise HTTPException(status_code=400, detail="Google Calendar not connected")
     
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        
         # List all calendars
-        calendar_list = service.calendarList().list().execute()
+        calendar_list = await google_calendar.execute(
+            user['id'], creds, lambda service: service.calendarList().list()
+        )
         calendars = calendar_list.get('items', [])
         
         return {
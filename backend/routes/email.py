@@ -0,0 +1,181 @@
+# Email Routes
+# Bulk lesson email: one request sends a lesson to a whole class (a list of
+# addresses and/or the sender's team). The lesson is rendered once, every
+# message goes into the outbox in one write, and the outbox worker delivers
+# them through the provider's batch API under its rate limits. Each send is
+# logged in email_logs under a batchId, so per-recipient delivery status
+# can be polled while the batch goes out.
+from fastapi import APIRouter, HTTPException, Header
+from pydantic import BaseModel, EmailStr
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from pymongo import ASCENDING
+import uuid
+import logging
+
+from services.database import db
+from services.email_service import email_service
+from services.email_templates import render_lesson_email
+from services.lesson_access import can_access_lesson
+from services.session_cache import get_user_for_token, parse_token
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/email", tags=["Email"])
+
+# How far ahead a lesson email can be scheduled
+MAX_SCHEDULE_AHEAD = timedelta(days=365)
+MAX_BULK_RECIPIENTS = 500
+
+
+class BulkLessonEmailRequest(BaseModel):
+    lessonId: str
+    recipients: List[EmailStr] = []
+    includeTeam: bool = False
+    scheduleFor: Optional[str] = None
+
+
+def parse_schedule_for(value: Optional[str]) -> Optional[datetime]:
+    """The requested delivery time in UTC, or None to send right away"""
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="scheduleFor must be an ISO 8601 datetime")
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    if when - now > MAX_SCHEDULE_AHEAD:
+        raise HTTPException(status_code=400, detail="Lessons can be scheduled at most a year ahead")
+    # A time that has already passed (or is this minute) means now
+    if when <= now + timedelta(minutes=1):
+        return None
+    return when.astimezone(timezone.utc).replace(second=0, microsecond=0)
+
+
+async def _require_user(authorization: Optional[str]) -> dict:
+    user = await get_user_for_token(parse_token(authorization))
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
+
+
+@router.post("/send-lesson/bulk")
+async def send_lesson_bulk(data: BulkLessonEmailRequest, authorization: str = Header(None)):
+    """Send one lesson to many recipients (addresses and/or the caller's team)"""
+    user = await _require_user(authorization)
+
+    access = await can_access_lesson(user, data.lessonId)
+    if access is None:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    if not access:
+        raise HTTPException(status_code=403, detail="Not authorized to send this lesson")
+
+    if not email_service.configured:
+        raise HTTPException(status_code=500, detail="Email service not configured")
+
+    addresses = [str(a) for a in data.recipients]
+    if data.includeTeam:
+        members = await db.team_members.find(
+            {"ownerId": user["id"]}, {"_id": 0, "email": 1}
+        ).to_list(MAX_BULK_RECIPIENTS)
+        addresses.extend(m["email"] for m in members if m.get("email"))
+
+    # One message per address, however often it was listed
+    recipients = list({a.strip().lower(): None for a in addresses if a.strip()})
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No recipients")
+    if len(recipients) > MAX_BULK_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_RECIPIENTS} recipients per request")
+
+    send_at = parse_schedule_for(data.scheduleFor)
+    lesson = await db.lessons.find_one({"id": data.lessonId}, {"_id": 0})
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    subject, html_content = render_lesson_email(lesson)
+
+    outbox_ids = await email_service.enqueue_many([
+        {"to": address, "subject": subject, "html": html_content, "kind": "lesson", "send_at": send_at}
+        for address in recipients
+    ])
+
+    batch_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    status = "scheduled" if send_at else "queued"
+    await db.email_logs.insert_many([
+        {
+            "batchId": batch_id,
+            "userId": user["id"],
+            "lessonId": data.lessonId,
+            "recipientEmail": address,
+            "status": status,
+            "outboxId": outbox_id,
+            "scheduledFor": send_at.isoformat() if send_at else None,
+            "createdAt": now,
+        }
+        for address, outbox_id in zip(recipients, outbox_ids)
+    ], ordered=False)
+
+    logger.info(f"[Email] {user['id']} queued lesson {data.lessonId} to {len(recipients)} recipients (batch {batch_id})")
+
+    return {
+        "batchId": batch_id,
+        "status": status,
+        "recipientCount": len(recipients),
+        "scheduledFor": send_at.isoformat() if send_at else None,
+    }
+
+
+@router.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str, authorization: str = Header(None)):
+    """Per-recipient delivery status of a bulk send"""
+    user = await _require_user(authorization)
+
+    logs = await db.email_logs.find(
+        {"batchId": batch_id, "userId": user["id"]},
+        {"_id": 0, "recipientEmail": 1, "outboxId": 1, "lessonId": 1, "scheduledFor": 1, "createdAt": 1}
+    ).to_list(MAX_BULK_RECIPIENTS)
+    if not logs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    # Delivery state lives on the outbox messages
+    messages = await db.email_outbox.find(
+        {"id": {"$in": [log["outboxId"] for log in logs]}},
+        {"_id": 0, "id": 1, "status": 1, "attempts": 1, "sentAt": 1, "lastError": 1}
+    ).to_list(len(logs))
+    by_id = {m["id"]: m for m in messages}
+
+    recipients = []
+    counts = {}
+    for log in logs:
+        message = by_id.get(log["outboxId"], {})
+        state = message.get("status", "unknown")
+        if state == "pending":
+            if message.get("attempts"):
+                state = "retrying"
+            elif log.get("scheduledFor"):
+                state = "scheduled"
+            else:
+                state = "queued"
+        counts[state] = counts.get(state, 0) + 1
+        recipients.append({
+            "email": log["recipientEmail"],
+            "status": state,
+            "sentAt": message["sentAt"].isoformat() if message.get("sentAt") else None,
+            "error": message.get("lastError") if state in ("failed", "retrying") else None,
+        })
+
+    return {
+        "batchId": batch_id,
+        "lessonId": logs[0]["lessonId"],
+        "createdAt": logs[0]["createdAt"],
+        "scheduledFor": logs[0].get("scheduledFor"),
+        "counts": counts,
+        "done": all(r["status"] in ("sent", "failed") for r in recipients),
+        "recipients": recipients,
+    }
+
+
+async def ensure_email_log_indexes():
+    await db.email_logs.create_index([("batchId", ASCENDING)], sparse=True)
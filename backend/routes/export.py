@@ -1,7 +1,6 @@
 # Export Routes
 from fastapi import APIRouter, HTTPException, Header
 from datetime import datetime, timezone
-import json
 import io
 import base64
 import logging
@@ -9,6 +8,7 @@ import re
 
 from models.schemas import ExportRequest
 from services.database import db
+from services.lesson_storage import load_json_field, lesson_materials, lesson_sections
 
 logger = logging.getLogger(__name__)
 
@@ -259,18 +259,8 @@ async def export_lesson(request: ExportRequest, authorization: str = Header(None
         raise HTTPException(status_code=404, detail="Lesson not found")
     
     try:
-        sections_raw = lesson.get("sectionsJson", "[]")
-        materials_raw = lesson.get("materialsJson", "[]")
-        
-        if isinstance(sections_raw, str):
-            sections = json.loads(sections_raw)
-        else:
-            sections = sections_raw
-            
-        if isinstance(materials_raw, str):
-            materials = json.loads(materials_raw)
-        else:
-            materials = materials_raw
+        sections = lesson_sections(lesson)
+        materials = lesson_materials(lesson)
         
         if request.format == "pdf":
             file_bytes = generate_pdf_bytes(lesson, sections, materials)
@@ -313,18 +303,8 @@ async def get_print_friendly_lesson(lesson_id: str):
         raise HTTPException(status_code=404, detail="Lesson not found")
     
     try:
-        sections_raw = lesson.get("sectionsJson", "[]")
-        materials_raw = lesson.get("materialsJson", "[]")
-        
-        if isinstance(sections_raw, str):
-            sections = json.loads(sections_raw)
-        else:
-            sections = sections_raw
-            
-        if isinstance(materials_raw, str):
-            materials = json.loads(materials_raw)
-        else:
-            materials = materials_raw
+        sections = lesson_sections(lesson)
+        materials = lesson_materials(lesson)
         
         # Generate sections HTML
         sections_html = ""
@@ -354,14 +334,7 @@ async def get_print_friendly_lesson(lesson_id: str):
             objectives_html += f"<li>{obj}</li>"
         
         # Cross references
-        cross_refs_json = lesson.get("crossReferencesJson", "[]")
-        if isinstance(cross_refs_json, str):
-            try:
-                cross_refs = json.loads(cross_refs_json)
-            except:
-                cross_refs = []
-        else:
-            cross_refs = cross_refs_json
+        cross_refs = load_json_field(lesson, "crossReferencesJson")
         
         cross_refs_html = ""
         for ref in cross_refs:
@@ -1,11 +1,21 @@
 # Lessons Routes
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Query, Request
 from datetime import datetime, timezone
 import uuid
 from typing import Optional
+from pymongo import ReturnDocument
 
 from models.schemas import LessonCreate
+from services.analytics_rollup import record_lesson_created, record_lesson_edited
 from services.database import db
+from services.lesson_access import invalidate_lesson_access
+from services.lesson_storage import normalize_lesson, to_native
+from services.recommendations import similar_lessons, similarity_index
+from services.revisions import delete_revisions, record_initial_revision, record_revision
+from services.scripture import format_range, overlap_query, parse_reference, passage_ranges
+from services.search_index import search_index, search_lessons as search_index_lessons
+from services.session_cache import get_user_for_token, parse_token
+from services.typeahead import suggest_lessons
 
 router = APIRouter(prefix="/lessons", tags=["Lessons"])
 
@@ -61,22 +71,76 @@ async def check_subscription_limit(user_id: str) -> dict:
     }
 
 @router.get("/search")
-async def search_lessons(q: str):
-    """Search lessons by title, passage, or topic"""
+async def search_lessons(
+    q: str,
+    ageGroup: Optional[str] = None,
+    userId: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Search lessons by title, passage, topic or theme (prefix and typo tolerant)"""
     if len(q) < 2:
         return []
     
-    cursor = db.lessons.find({
-        "$or": [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"passage": {"$regex": q, "$options": "i"}},
-            {"topic": {"$regex": q, "$options": "i"}},
-            {"theme": {"$regex": q, "$options": "i"}}
-        ]
-    }, {"_id": 0}).limit(10)
+    lessons = await search_index_lessons(q, limit, age_group=ageGroup, user_id=userId)
     
-    lessons = await cursor.to_list(length=10)
-    return lessons
+    # Queries that look like a reference ("jn 3", "Rom 8:28") also match
+    # lessons whose passage covers it, listed first
+    ranges = parse_reference(q) if any(ch.isdigit() for ch in q) else []
+    if ranges:
+        query = overlap_query(ranges)
+        if ageGroup:
+            query = {**query, "ageGroup": ageGroup}
+        if userId:
+            query = {**query, "userId": userId}
+        covering = await db.lessons.find(query, {"_id": 0}).limit(limit).to_list(limit)
+        seen = {lesson["id"] for lesson in covering}
+        lessons = (covering + [lesson for lesson in lessons if lesson["id"] not in seen])[:limit]
+    
+    return [normalize_lesson(lesson) for lesson in lessons]
+
+@router.get("/typeahead")
+async def lesson_typeahead(
+    request: Request,
+    q: str,
+    ageGroup: Optional[str] = None,
+    scope: str = Query("all", pattern="^(all|mine)$"),
+    limit: int = Query(8, ge=1, le=20),
+    authorization: str = Header(None)
+):
+    """Search-as-you-type suggestions (id, title, passage, ageGroup only)"""
+    user_id = None
+    if scope == "mine":
+        user = await get_user_for_token(parse_token(authorization))
+        if not user:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        user_id = user["id"]
+    
+    results = await suggest_lessons(
+        q, limit, age_group=ageGroup, user_id=user_id, is_disconnected=request.is_disconnected
+    )
+    # None means the client gave up on this keystroke; nobody reads the body
+    return results or []
+
+@router.get("/by-scripture")
+async def get_lessons_by_scripture(
+    ref: str,
+    ageGroup: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200)
+):
+    """Lessons whose passage overlaps a reference such as Romans 8:28 or Exodus 14-15"""
+    ranges = parse_reference(ref)
+    if not ranges:
+        raise HTTPException(status_code=400, detail="Could not understand that scripture reference")
+    
+    query = overlap_query(ranges)
+    if ageGroup:
+        query = {**query, "ageGroup": ageGroup}
+    lessons = await db.lessons.find(query, {"_id": 0}).sort("createdAt", -1).limit(limit).to_list(limit)
+    return {
+        "reference": ref,
+        "ranges": [format_range(start, end) for start, end in ranges],
+        "lessons": [normalize_lesson(lesson) for lesson in lessons]
+    }
 
 @router.get("")
 async def get_lessons(ageGroup: Optional[str] = None, favorite: Optional[str] = None):
@@ -87,14 +151,14 @@ async def get_lessons(ageGroup: Optional[str] = None, favorite: Optional[str] =
         query["favorite"] = True
     
     lessons = await db.lessons.find(query, {"_id": 0}).to_list(1000)
-    return lessons
+    return [normalize_lesson(lesson) for lesson in lessons]
 
 @router.get("/{lesson_id}")
 async def get_lesson(lesson_id: str):
     lesson = await db.lessons.find_one({"id": lesson_id}, {"_id": 0})
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
-    return lesson
+    return normalize_lesson(lesson)
 
 @router.post("")
 async def create_lesson(data: LessonCreate, authorization: str = Header(None)):
@@ -118,19 +182,55 @@ async def create_lesson(data: LessonCreate, authorization: str = Header(None)):
     lesson = {
         "id": lesson_id,
         "userId": user_id,
-        **data.model_dump(),
+        **to_native(data.model_dump()),
+        "scriptureRanges": passage_ranges(data.passage),
         "favorite": False,
         "createdAt": datetime.now(timezone.utc).isoformat(),
     }
     await db.lessons.insert_one(lesson)
+    await record_initial_revision(lesson, user_id)
+    await record_lesson_created(lesson)
+    search_index.upsert(lesson)
+    await similarity_index.update_lesson(lesson)
     return serialize_doc(lesson)
 
+@router.get("/{lesson_id}/similar")
+async def get_similar_lessons(
+    lesson_id: str,
+    limit: int = Query(5, ge=1, le=20),
+    ageGroup: Optional[str] = None
+):
+    """Lessons most like this one ("more like this")"""
+    similar = await similar_lessons(lesson_id, limit, age_group=ageGroup)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    return {"lessonId": lesson_id, "similar": similar}
+
 @router.put("/{lesson_id}")
-async def update_lesson(lesson_id: str, data: dict):
-    result = await db.lessons.update_one({"id": lesson_id}, {"$set": data})
-    if result.matched_count == 0:
+async def update_lesson(lesson_id: str, data: dict, authorization: str = Header(None)):
+    data = to_native(data)
+    data.pop("id", None)
+    data.pop("_id", None)
+    if "passage" in data:
+        data["scriptureRanges"] = passage_ranges(data["passage"])
+    data["updatedAt"] = datetime.now(timezone.utc).isoformat()
+    
+    # The pre-update document is needed to record the revision delta
+    before = await db.lessons.find_one_and_update(
+        {"id": lesson_id},
+        {"$set": data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not before:
         raise HTTPException(status_code=404, detail="Lesson not found")
-    lesson = await db.lessons.find_one({"id": lesson_id}, {"_id": 0})
+    lesson = normalize_lesson({**before, **data})
+    
+    user = await get_user_for_token(parse_token(authorization))
+    await record_revision(lesson_id, before, lesson, user["id"] if user else None)
+    await record_lesson_edited(lesson_id, data["updatedAt"])
+    search_index.upsert(lesson)
+    await similarity_index.update_lesson(lesson)
     return lesson
 
 @router.delete("/{lesson_id}")
@@ -138,6 +238,10 @@ async def delete_lesson(lesson_id: str):
     result = await db.lessons.delete_one({"id": lesson_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Lesson not found")
+    await delete_revisions(lesson_id)
+    invalidate_lesson_access(lesson_id=lesson_id)
+    search_index.remove(lesson_id)
+    await similarity_index.delete_lesson(lesson_id)
     return {"message": "Deleted"}
 
 @router.post("/{lesson_id}/favorite")
@@ -148,4 +252,4 @@ async def toggle_favorite(lesson_id: str):
     new_favorite = not lesson.get("favorite", False)
     await db.lessons.update_one({"id": lesson_id}, {"$set": {"favorite": new_favorite}})
     lesson = await db.lessons.find_one({"id": lesson_id}, {"_id": 0})
-    return lesson
+    return normalize_lesson(lesson)
@@ -1,17 +1,23 @@
 # Notification Routes for Bible Lesson Planner
-from fastapi import APIRouter, HTTPException, Header, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Literal
-from datetime import datetime, timezone
-import uuid
-import os
+from datetime import datetime
+import asyncio
+import json
 
+from services import notifications as notification_service
 from services.database import db
+from services.notification_bus import notification_bus
+from services.notifications import MAX_FAN_OUT, find_recipients, notify, team_member_ids, unread_count
+from services.session_cache import get_user_for_token, parse_token
 
-router = APIRouter(prefix="/notifications", tags=["Notifications"])
+# Idle streams get a comment line this often (keeps proxies from timing
+# them out) and resync their unread count from the database
+STREAM_HEARTBEAT = 25
 
-# Email configuration (using Resend if available)
-RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
+router = APIRouter(prefix="/notifications", tags=["Notifications"])
 
 class NotificationCreate(BaseModel):
     type: Literal['lesson_shared', 'team_invite', 'lesson_edited', 'reminder', 'success', 'info', 'warning']
@@ -23,6 +29,17 @@ class NotificationCreate(BaseModel):
     actionUrl: Optional[str] = None
     sendEmail: bool = True
 
+class NotificationFanOut(BaseModel):
+    type: Literal['lesson_shared', 'team_invite', 'lesson_edited', 'reminder', 'success', 'info', 'warning']
+    title: str
+    message: str
+    recipientIds: List[str] = []
+    recipientEmails: List[EmailStr] = []
+    team: bool = False
+    lessonId: Optional[str] = None
+    actionUrl: Optional[str] = None
+    sendEmail: bool = True
+
 class NotificationUpdate(BaseModel):
     read: Optional[bool] = None
 
@@ -31,6 +48,8 @@ class EmailPreferences(BaseModel):
     teamInvite: bool = True
     lessonEdited: bool = True
     reminders: bool = True
+    # 'instant' emails each notification; 'hourly'/'daily' send one summary
+    digestFrequency: Literal['instant', 'hourly', 'daily'] = 'instant'
 
 def serialize_doc(doc: dict) -> dict:
     if doc is None:
@@ -41,107 +60,12 @@ def serialize_doc(doc: dict) -> dict:
             result[key] = value.isoformat()
     return result
 
-async def get_current_user(token: str = None) -> dict:
-    if not token:
-        return None
-    session = await db.sessions.find_one({"token": token})
-    if not session:
-        return None
-    user = await db.users.find_one({"id": session["userId"]})
-    return serialize_doc(user)
-
-async def send_notification_email(notification: dict, recipient_email: str, recipient_name: str = ""):
-    """Send email notification using Resend API"""
-    if not RESEND_API_KEY:
-        print(f"[Notifications] Email skipped - RESEND_API_KEY not configured")
-        return False
-    
-    try:
-        import requests
-        
-        # Map notification types to email subjects
-        type_subjects = {
-            'lesson_shared': f"📚 {notification['title']}",
-            'team_invite': f"👥 {notification['title']}",
-            'lesson_edited': f"✏️ {notification['title']}",
-            'reminder': f"⏰ {notification['title']}",
-            'success': f"✅ {notification['title']}",
-            'info': f"ℹ️ {notification['title']}",
-            'warning': f"⚠️ {notification['title']}",
-        }
-        
-        subject = type_subjects.get(notification['type'], notification['title'])
-        
-        # Build HTML email
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; background: #f9fafb; padding: 20px; }}
-                .container {{ max-width: 600px; margin: 0 auto; background: white; border-radius: 12px; overflow: hidden; box-shadow: 0 4px 6px rgba(0,0,0,0.1); }}
-                .header {{ background: linear-gradient(135deg, #f59e0b 0%, #d97706 100%); padding: 24px; text-align: center; }}
-                .header h1 {{ color: white; margin: 0; font-size: 24px; }}
-                .content {{ padding: 32px; }}
-                .message {{ color: #374151; font-size: 16px; line-height: 1.6; }}
-                .button {{ display: inline-block; margin-top: 24px; padding: 12px 24px; background: #f59e0b; color: white; text-decoration: none; border-radius: 8px; font-weight: 600; }}
-                .footer {{ padding: 24px; text-align: center; color: #9ca3af; font-size: 12px; border-top: 1px solid #e5e7eb; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Bible Lesson Planner</h1>
-                </div>
-                <div class="content">
-                    <h2 style="color: #1f2937; margin-top: 0;">{notification['title']}</h2>
-                    <p class="message">{notification['message']}</p>
-                    {'<a href="' + notification.get('actionUrl', 'https://biblelessonplanner.com') + '" class="button">View Details</a>' if notification.get('actionUrl') else ''}
-                </div>
-                <div class="footer">
-                    <p>Bible Lesson Planner - Rooted in Scripture</p>
-                    <p>You received this email because of your notification preferences.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        response = requests.post(
-            'https://api.resend.com/emails',
-            headers={
-                'Authorization': f'Bearer {RESEND_API_KEY}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'from': 'Bible Lesson Planner <onboarding@resend.dev>',
-                'to': [recipient_email],
-                'subject': subject,
-                'html': html_content
-            }
-        )
-        
-        if response.status_code in [200, 201]:
-            print(f"[Notifications] Email sent to {recipient_email}")
-            return True
-        else:
-            print(f"[Notifications] Email failed: {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"[Notifications] Email error: {e}")
-        return False
-
 @router.get("")
 async def get_notifications(authorization: str = Header(None), limit: int = 50):
     """Get notifications for the current user"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
     notifications = await db.notifications.find(
         {"recipientId": user['id']}
@@ -149,157 +73,174 @@ async def get_notifications(authorization: str = Header(None), limit: int = 50):
     
     return {
         "notifications": [serialize_doc(n) for n in notifications],
-        "unreadCount": sum(1 for n in notifications if not n.get('read', False))
+        "unreadCount": await unread_count(user['id'])
     }
 
+@router.get("/unread-count")
+async def get_unread_count(authorization: str = Header(None)):
+    """Exact unread count, for badges"""
+    user = await get_user_for_token(parse_token(authorization))
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    return {"unreadCount": await unread_count(user['id'])}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def _notification_events(request: Request, user_id: str):
+    queue = notification_bus.subscribe(user_id)
+    try:
+        last_count = await unread_count(user_id)
+        yield _sse("unread", {"unreadCount": last_count})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                # Also picks up changes made through other server processes
+                count = await unread_count(user_id)
+                if count == last_count:
+                    yield ": ping\n\n"
+                    continue
+            else:
+                if event["type"] == "notification":
+                    yield _sse("notification", event["notification"])
+                    count = await unread_count(user_id)
+                else:
+                    count = event["unreadCount"]
+            if count != last_count:
+                last_count = count
+                yield _sse("unread", {"unreadCount": count})
+    finally:
+        notification_bus.unsubscribe(user_id, queue)
+
+@router.get("/stream")
+async def stream_notifications(request: Request, authorization: str = Header(None), token: Optional[str] = None):
+    """
+    Server-sent events: `notification` for each new notification and
+    `unread` whenever the unread count changes. EventSource can't send
+    headers, so the token may also be passed as ?token=.
+    """
+    user = await get_user_for_token(parse_token(authorization or token))
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    return StreamingResponse(
+        _notification_events(request, user['id']),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("")
 async def create_notification(
     data: NotificationCreate, 
-    background_tasks: BackgroundTasks,
     authorization: str = Header(None)
 ):
     """Create a new notification"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    sender = await get_current_user(token)
+    sender = await get_user_for_token(parse_token(authorization))
     if not sender:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Find recipient
-    recipient = None
+    recipients = []
     if data.recipientId:
-        recipient = await db.users.find_one({"id": data.recipientId})
+        recipients = await find_recipients(user_ids=[data.recipientId])
     elif data.recipientEmail:
-        recipient = await db.users.find_one({"email": data.recipientEmail})
+        recipients = await find_recipients(emails=[data.recipientEmail])
     
-    if not recipient:
+    if not recipients:
         raise HTTPException(status_code=404, detail="Recipient not found")
     
-    # Create notification
-    notification = {
-        "id": f"notif-{uuid.uuid4().hex[:12]}",
-        "type": data.type,
-        "title": data.title,
-        "message": data.message,
-        "recipientId": recipient['id'],
-        "senderId": sender['id'],
-        "senderName": sender.get('name', sender.get('email', 'Someone')),
-        "lessonId": data.lessonId,
-        "actionUrl": data.actionUrl,
-        "read": False,
-        "createdAt": datetime.now(timezone.utc),
-    }
+    notification, = await notify(
+        sender, recipients[:1], data.type, data.title, data.message,
+        lesson_id=data.lessonId, action_url=data.actionUrl, send_email=data.sendEmail,
+    )
+    
+    return {"success": True, "notification": serialize_doc(notification)}
+
+@router.post("/fan-out")
+async def fan_out_notification(data: NotificationFanOut, authorization: str = Header(None)):
+    """Notify many users (a list and/or the sender's whole team) in one request"""
+    sender = await get_user_for_token(parse_token(authorization))
+    if not sender:
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    await db.notifications.insert_one(notification)
+    user_ids = list(data.recipientIds)
+    if data.team:
+        user_ids.extend(await team_member_ids(sender['id']))
+    if len(user_ids) + len(data.recipientEmails) > MAX_FAN_OUT:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_FAN_OUT} recipients per request")
     
-    # Send email notification in background if enabled
-    if data.sendEmail:
-        # Check user's email preferences
-        email_prefs = recipient.get('emailPreferences', {})
-        should_send_email = True
-        
-        if data.type == 'lesson_shared' and not email_prefs.get('lessonShared', True):
-            should_send_email = False
-        elif data.type == 'team_invite' and not email_prefs.get('teamInvite', True):
-            should_send_email = False
-        elif data.type == 'lesson_edited' and not email_prefs.get('lessonEdited', True):
-            should_send_email = False
-        elif data.type == 'reminder' and not email_prefs.get('reminders', True):
-            should_send_email = False
-        
-        if should_send_email:
-            background_tasks.add_task(
-                send_notification_email,
-                serialize_doc(notification),
-                recipient['email'],
-                recipient.get('name', '')
-            )
+    recipients = await find_recipients(user_ids=user_ids, emails=data.recipientEmails)
+    # Nobody needs to be told about their own action
+    recipients = [r for r in recipients if r['id'] != sender['id']]
+    if not recipients:
+        raise HTTPException(status_code=404, detail="No recipients found")
     
-    return {"success": True, "notification": serialize_doc(notification)}
+    notifications = await notify(
+        sender, recipients, data.type, data.title, data.message,
+        lesson_id=data.lessonId, action_url=data.actionUrl, send_email=data.sendEmail,
+    )
+    
+    return {
+        "success": True,
+        "recipientCount": len(notifications),
+        "notificationIds": [n['id'] for n in notifications],
+    }
 
 @router.patch("/{notification_id}")
 async def update_notification(notification_id: str, data: NotificationUpdate, authorization: str = Header(None)):
     """Update a notification (mark as read)"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    update_data = {}
     if data.read is not None:
-        update_data['read'] = data.read
-    
-    if update_data:
-        await db.notifications.update_one(
-            {"id": notification_id, "recipientId": user['id']},
-            {"$set": update_data}
-        )
+        await notification_service.set_read(user['id'], notification_id, data.read)
     
     return {"success": True}
 
 @router.post("/mark-all-read")
 async def mark_all_read(authorization: str = Header(None)):
     """Mark all notifications as read"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    result = await db.notifications.update_many(
-        {"recipientId": user['id'], "read": False},
-        {"$set": {"read": True}}
-    )
+    updated = await notification_service.mark_all_read(user['id'])
     
-    return {"success": True, "updatedCount": result.modified_count}
+    return {"success": True, "updatedCount": updated}
 
 @router.delete("/{notification_id}")
 async def delete_notification(notification_id: str, authorization: str = Header(None)):
     """Delete a notification"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    await db.notifications.delete_one({"id": notification_id, "recipientId": user['id']})
+    await notification_service.delete_notification(user['id'], notification_id)
     
     return {"success": True}
 
 @router.delete("")
 async def clear_all_notifications(authorization: str = Header(None)):
     """Clear all notifications for the current user"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    result = await db.notifications.delete_many({"recipientId": user['id']})
+    deleted = await notification_service.clear_all(user['id'])
     
-    return {"success": True, "deletedCount": result.deleted_count}
+    return {"success": True, "deletedCount": deleted}
 
 @router.get("/preferences")
 async def get_email_preferences(authorization: str = Header(None)):
     """Get user's email notification preferences"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
     # Default preferences if not set
     default_prefs = {
@@ -307,22 +248,21 @@ async def get_email_preferences(authorization: str = Header(None)):
         "teamInvite": True,
         "lessonEdited": True,
         "reminders": True,
+        "digestFrequency": "instant",
     }
     
-    user_prefs = user.get('emailPreferences', default_prefs)
+    # Read fresh: the cached session user may predate a preferences update
+    stored = await db.users.find_one({"id": user['id']}, {"_id": 0, "emailPreferences": 1})
+    user_prefs = (stored or {}).get('emailPreferences') or default_prefs
     
     return {"preferences": {**default_prefs, **user_prefs}}
 
 @router.put("/preferences")
 async def update_email_preferences(data: EmailPreferences, authorization: str = Header(None)):
     """Update user's email notification preferences"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user = await get_current_user(token)
+    user = await get_user_for_token(parse_token(authorization))
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
     await db.users.update_one(
         {"id": user['id']},
@@ -7,7 +7,9 @@ import logging
 from typing import Dict, Any
 
 from models.schemas import CheckoutRequest
+from services.analytics_rollup import record_subscription
 from services.database import db
+from services.plan_breakdown import invalidate_plan_breakdown
 
 router = APIRouter(prefix="", tags=["Payments & Subscriptions"])
 logger = logging.getLogger(__name__)
@@ -590,6 +592,7 @@ async def stripe_webhook(request: Request):
                     {"$set": subscription_data},
                     upsert=True
                 )
+                await record_subscription(plan_id, subscription_data["createdAt"], dedupe_key=session.get("id"))
                 
                 logger.info(f"Subscription created/updated for user {user_id}: {plan_id}")
         
@@ -612,6 +615,10 @@ async def stripe_webhook(request: Request):
                 {"$set": {"status": "canceled", "canceledAt": datetime.now(timezone.utc).isoformat()}}
             )
         
+        if event_type in ("checkout.session.completed", "customer.subscription.updated",
+                          "customer.subscription.deleted"):
+            invalidate_plan_breakdown()
+        
         return {"received": True}
     except Exception as e:
         logger.error(f"Webhook error: {e}")
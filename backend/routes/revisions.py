@@ -0,0 +1,131 @@
+# Lesson Revision Routes - history, diff and restore
+from fastapi import APIRouter, HTTPException, Header, Query
+from datetime import datetime, timezone
+from typing import Optional
+from pymongo import ReturnDocument
+
+from services.analytics_rollup import record_lesson_edited
+from services.database import db
+from services.lesson_access import can_access_lesson
+from services.recommendations import similarity_index
+from services.revisions import (
+    TRACKED_FIELDS,
+    diff_states,
+    get_revision_state,
+    head_revision,
+    list_revisions,
+    record_revision,
+    state_to_lesson_fields,
+)
+from services.scripture import passage_ranges
+from services.search_index import search_index
+from services.session_cache import get_user_for_token, parse_token
+
+router = APIRouter(prefix="/lessons", tags=["Lesson Revisions"])
+
+async def require_lesson_access(lesson_id: str, authorization: Optional[str]) -> dict:
+    """Resolve the caller and make sure they may see this lesson's history"""
+    user = await get_user_for_token(parse_token(authorization))
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    access = await can_access_lesson(user, lesson_id)
+    if access is None:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    if not access:
+        raise HTTPException(status_code=403, detail="Not authorized to view this lesson")
+    return user
+
+async def load_revision(lesson_id: str, rev: int) -> dict:
+    state = await get_revision_state(lesson_id, rev)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"Revision {rev} not found")
+    return state
+
+@router.get("/{lesson_id}/revisions")
+async def get_lesson_revisions(
+    lesson_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    authorization: str = Header(None)
+):
+    """List revisions of a lesson, newest first"""
+    await require_lesson_access(lesson_id, authorization)
+
+    revisions = await list_revisions(lesson_id, limit, before)
+    return {
+        "lessonId": lesson_id,
+        "revisions": revisions,
+        "nextBefore": revisions[-1]["rev"] if len(revisions) == limit else None
+    }
+
+@router.get("/{lesson_id}/revisions/diff")
+async def diff_lesson_revisions(
+    lesson_id: str,
+    from_rev: int = Query(..., alias="from"),
+    to_rev: int = Query(..., alias="to"),
+    authorization: str = Header(None)
+):
+    """Compare two revisions field by field and section by section"""
+    await require_lesson_access(lesson_id, authorization)
+
+    old_state = await load_revision(lesson_id, from_rev)
+    new_state = await load_revision(lesson_id, to_rev)
+
+    return {
+        "lessonId": lesson_id,
+        "from": from_rev,
+        "to": to_rev,
+        **diff_states(old_state, new_state)
+    }
+
+@router.get("/{lesson_id}/revisions/{rev}")
+async def get_lesson_revision(lesson_id: str, rev: int, authorization: str = Header(None)):
+    """Get the full lesson content as of a revision"""
+    await require_lesson_access(lesson_id, authorization)
+
+    state = await load_revision(lesson_id, rev)
+    return {"lessonId": lesson_id, "rev": rev, "lesson": state}
+
+@router.post("/{lesson_id}/revisions/{rev}/restore")
+async def restore_lesson_revision(lesson_id: str, rev: int, authorization: str = Header(None)):
+    """Restore a lesson to a previous revision (recorded as a new revision)"""
+    user = await require_lesson_access(lesson_id, authorization)
+
+    state = await load_revision(lesson_id, rev)
+    fields = state_to_lesson_fields(state)
+
+    update = {"$set": {
+        **fields,
+        "scriptureRanges": passage_ranges(fields.get("passage")),
+        "updatedAt": datetime.now(timezone.utc).isoformat()
+    }}
+    missing = [field for field in TRACKED_FIELDS if field not in fields]
+    if missing:
+        update["$unset"] = {field: "" for field in missing}
+
+    before = await db.lessons.find_one_and_update(
+        {"id": lesson_id}, update, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if not before:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+
+    after = {k: v for k, v in before.items() if k not in missing}
+    after.update(update["$set"])
+    new_rev = await record_revision(
+        lesson_id, before, after, user["id"], source="restore", restoredFrom=rev
+    )
+    if new_rev is None:
+        # Already identical to that revision; nothing new was recorded
+        new_rev = await head_revision(lesson_id)
+    search_index.upsert(after)
+    await record_lesson_edited(lesson_id)
+    await similarity_index.update_lesson(after)
+
+    return {
+        "success": True,
+        "lessonId": lesson_id,
+        "restoredFrom": rev,
+        "rev": new_rev,
+        "lesson": after
+    }
@@ -6,6 +6,7 @@ from typing import Optional
 
 from models.schemas import TeamInvite, AcceptInvitation
 from services.database import db
+from services.lesson_access import invalidate_lesson_access
 
 router = APIRouter(prefix="/team", tags=["Team Management"])
 
@@ -106,6 +107,7 @@ async def accept_invitation(data: AcceptInvitation, authorization: str = Header(
         "joinedAt": datetime.now(timezone.utc).isoformat(),
     }
     await db.team_members.insert_one(member)
+    invalidate_lesson_access(user_id=user_id)
     
     await db.invitations.update_one(
         {"id": invitation["id"]},
@@ -123,9 +125,10 @@ async def revoke_member(member_id: str, authorization: str = Header(None)):
     if not session:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    result = await db.team_members.delete_one({"id": member_id, "ownerId": session["userId"]})
-    if result.deleted_count == 0:
+    member = await db.team_members.find_one_and_delete({"id": member_id, "ownerId": session["userId"]})
+    if not member:
         raise HTTPException(status_code=404, detail="Member not found")
+    invalidate_lesson_access(user_id=member.get("userId"))
     return {"message": "Member removed"}
 
 @router.delete("/invitations/{invitation_id}")
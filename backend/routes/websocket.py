@@ -1,63 +1,90 @@
 # WebSocket Routes for Real-Time Collaborative Editing
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from typing import Dict, Set, Optional
+from typing import Dict, Optional
 from datetime import datetime, timezone
-import json
+import time
 import asyncio
 import logging
 
+from services.analytics_rollup import record_lesson_edited
 from services.database import db
+from services.lesson_access import can_access_lesson
+from services.lesson_storage import lesson_sections
+from services.presence import PresenceRegistry
+from services.rate_limit import TokenBucket
+from services.recommendations import similarity_index
+from services.revisions import record_revision
+from services.search_index import search_index
+from services.session_cache import get_user_for_token, is_cached
+from services.ws_codec import JSON_CODEC, negotiate_codec
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["WebSocket"])
 
+# Heartbeat settings. Clients ping every 30s; a socket that has sent nothing
+# for IDLE_TIMEOUT seconds is treated as dead and evicted from its room.
+HEARTBEAT_INTERVAL = 25
+IDLE_TIMEOUT = 75
+
+# Admission control for handshakes that need a database lookup. Handshakes
+# whose token is already cached are always admitted; the rest share this
+# bucket and may wait up to ADMISSION_MAX_WAIT seconds for a slot, which
+# spreads a post-deploy reconnect storm out instead of hitting Mongo at once.
+ADMISSION_RATE = 20
+ADMISSION_BURST = 100
+ADMISSION_MAX_WAIT = 5
+admission_bucket = TokenBucket(rate=ADMISSION_RATE, burst=ADMISSION_BURST)
+
 # Connection manager for handling WebSocket connections
 class ConnectionManager:
     def __init__(self):
-        # lesson_id -> set of (websocket, user_id, user_name)
-        self.active_connections: Dict[str, Set[tuple]] = {}
-        # websocket -> (lesson_id, user_id, user_name)
-        self.connection_info: Dict[WebSocket, tuple] = {}
-        
-    async def connect(self, websocket: WebSocket, lesson_id: str, user_id: str, user_name: str):
-        await websocket.accept()
+        self.presence = PresenceRegistry()
+        # websocket -> negotiated frame codec (JSON unless the client asked for compact)
+        self.codecs: Dict[WebSocket, object] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
         
-        if lesson_id not in self.active_connections:
-            self.active_connections[lesson_id] = set()
+    async def connect(self, websocket: WebSocket, lesson_id: str, user_id: str, user_name: str,
+                      codec=JSON_CODEC, subprotocol: Optional[str] = None):
+        await websocket.accept(subprotocol=subprotocol)
         
-        connection_tuple = (websocket, user_id, user_name)
-        self.active_connections[lesson_id].add(connection_tuple)
-        self.connection_info[websocket] = (lesson_id, user_id, user_name)
+        self.codecs[websocket] = codec
+        first_tab = self.presence.add(websocket, lesson_id, user_id, user_name)
+        self._ensure_heartbeat()
         
         logger.info(f"WebSocket connected: user={user_name} lesson={lesson_id}")
         
-        # Notify others that user joined
-        await self.broadcast_presence(lesson_id, user_id, user_name, "joined")
+        if first_tab:
+            # Notify others that user joined
+            await self.broadcast_presence(lesson_id, user_id, user_name, "joined")
+        else:
+            # Same user opened another tab - only the new tab needs the roster
+            await self.send_to_user(websocket, {
+                "type": "active_users",
+                "users": self.get_active_users(lesson_id)
+            })
         
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.connection_info:
-            lesson_id, user_id, user_name = self.connection_info[websocket]
-            
-            # Remove from active connections
-            if lesson_id in self.active_connections:
-                self.active_connections[lesson_id] = {
-                    conn for conn in self.active_connections[lesson_id] 
-                    if conn[0] != websocket
-                }
-                if not self.active_connections[lesson_id]:
-                    del self.active_connections[lesson_id]
-            
-            del self.connection_info[websocket]
-            
-            logger.info(f"WebSocket disconnected: user={user_name} lesson={lesson_id}")
-            
+        entry, last_tab = self.presence.remove(websocket)
+        self.codecs.pop(websocket, None)
+        if entry is None:
+            return
+        
+        logger.info(f"WebSocket disconnected: user={entry.user_name} lesson={entry.lesson_id}")
+        
+        if last_tab:
             # Notify others that user left (fire and forget)
-            asyncio.create_task(self.broadcast_presence(lesson_id, user_id, user_name, "left"))
+            asyncio.create_task(
+                self.broadcast_presence(entry.lesson_id, entry.user_id, entry.user_name, "left")
+            )
+    
+    def touch(self, websocket: WebSocket):
+        """Mark a socket as alive after receiving a frame from it"""
+        self.presence.touch(websocket)
     
     async def broadcast_presence(self, lesson_id: str, user_id: str, user_name: str, action: str):
         """Broadcast presence update to all users in the lesson"""
-        if lesson_id not in self.active_connections:
+        if not self.presence.connection_count(lesson_id):
             return
             
         message = {
@@ -73,27 +100,21 @@ class ConnectionManager:
     
     def get_active_users(self, lesson_id: str) -> list:
         """Get list of active users in a lesson"""
-        if lesson_id not in self.active_connections:
-            return []
-        
-        users = []
-        seen_ids = set()
-        for ws, user_id, user_name in self.active_connections[lesson_id]:
-            if user_id not in seen_ids:
-                users.append({"userId": user_id, "userName": user_name})
-                seen_ids.add(user_id)
-        return users
+        return self.presence.active_users(lesson_id)
     
     async def broadcast_to_lesson(self, lesson_id: str, message: dict, exclude_websocket: WebSocket = None):
         """Broadcast message to all users in a lesson"""
-        if lesson_id not in self.active_connections:
-            return
-            
+        # Encode once per codec rather than once per recipient
+        frames = {}
         disconnected = []
-        for ws, user_id, user_name in self.active_connections[lesson_id]:
+        for ws in self.presence.sockets(lesson_id):
             if ws != exclude_websocket:
+                codec = self.codecs.get(ws, JSON_CODEC)
+                frame = frames.get(codec.name)
+                if frame is None:
+                    frame = frames[codec.name] = codec.encode(message)
                 try:
-                    await ws.send_json(message)
+                    await self._send_frame(ws, frame)
                 except Exception as e:
                     logger.error(f"Error sending to websocket: {e}")
                     disconnected.append(ws)
@@ -105,45 +126,103 @@ class ConnectionManager:
     async def send_to_user(self, websocket: WebSocket, message: dict):
         """Send message to a specific user"""
         try:
-            await websocket.send_json(message)
+            codec = self.codecs.get(websocket, JSON_CODEC)
+            await self._send_frame(websocket, codec.encode(message))
         except Exception as e:
             logger.error(f"Error sending to user: {e}")
             self.disconnect(websocket)
+    
+    async def receive(self, websocket: WebSocket) -> dict:
+        """Receive and decode the next frame from a socket"""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        
+        self.touch(websocket)
+        codec = self.codecs.get(websocket, JSON_CODEC)
+        frame = message.get("bytes") if message.get("bytes") is not None else message.get("text")
+        return codec.decode(frame)
+    
+    @staticmethod
+    async def _send_frame(websocket: WebSocket, frame):
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+    
+    def _ensure_heartbeat(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+    
+    async def _heartbeat_loop(self):
+        """Ping quiet sockets and evict the ones that stopped answering"""
+        while len(self.presence):
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            
+            for ws in self.presence.idle_since(now - IDLE_TIMEOUT):
+                logger.info("Evicting idle WebSocket connection")
+                self.disconnect(ws)
+                try:
+                    await ws.close(code=1001, reason="Idle timeout")
+                except Exception:
+                    pass
+            
+            for ws in self.presence.idle_since(now - HEARTBEAT_INTERVAL):
+                await self.send_to_user(ws, {"type": "ping"})
 
 manager = ConnectionManager()
 
-async def get_user_from_token(token: str) -> Optional[dict]:
-    """Validate token and get user"""
-    if not token:
-        return None
-    session = await db.sessions.find_one({"token": token})
-    if not session:
-        return None
-    user = await db.users.find_one({"id": session["userId"]})
-    return user
-
 @router.websocket("/ws/lesson/{lesson_id}")
 async def websocket_lesson_endpoint(
     websocket: WebSocket, 
     lesson_id: str,
-    token: str = Query(None)
+    token: str = Query(None),
+    encoding: Optional[str] = Query(None)
 ):
-    """WebSocket endpoint for real-time lesson collaboration"""
+    """WebSocket endpoint for real-time lesson collaboration
+    
+    Frames are JSON text by default. Clients can opt into compact binary
+    framing by offering the "blp.compact.v1" subprotocol or passing
+    ?encoding=compact.
+    """
+    
+    if not token:
+        await websocket.close(code=4001, reason="Unauthorized")
+        return
+    
+    # Uncached handshakes cost database reads, so they go through admission control
+    if not is_cached(token):
+        admitted = await admission_bucket.acquire(max_wait=ADMISSION_MAX_WAIT)
+        if not admitted:
+            # 1013 = Try Again Later; clients back off and reconnect
+            await websocket.close(code=1013, reason="Server busy, retry shortly")
+            return
     
     # Authenticate user
-    user = await get_user_from_token(token)
+    user = await get_user_for_token(token)
     if not user:
         await websocket.close(code=4001, reason="Unauthorized")
         return
     
+    # Access is decided once and holds for the lifetime of the connection
+    access = await can_access_lesson(user, lesson_id)
+    if access is None:
+        await websocket.close(code=4004, reason="Lesson not found")
+        return
+    if not access:
+        await websocket.close(code=4003, reason="Forbidden")
+        return
+    
     user_id = user["id"]
     user_name = user.get("name", user.get("email", "Unknown"))
     
-    await manager.connect(websocket, lesson_id, user_id, user_name)
+    codec, subprotocol = negotiate_codec(websocket.scope.get("subprotocols", []), encoding)
+    await manager.connect(websocket, lesson_id, user_id, user_name, codec, subprotocol)
     
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await manager.receive(websocket)
             
             message_type = data.get("type")
             
@@ -218,31 +297,53 @@ async def save_lesson_edit(lesson_id: str, edit_data: dict, user_id: str):
         section_index = edit_data.get("sectionIndex")
         
         if field == "content" and section_index is not None:
-            # Update section content
-            lesson = await db.lessons.find_one({"id": lesson_id})
-            if lesson:
-                sections = lesson.get("sectionsJson", "[]")
-                if isinstance(sections, str):
-                    sections = json.loads(sections)
-                
-                if 0 <= section_index < len(sections):
-                    sections[section_index]["content"] = value
-                    await db.lessons.update_one(
-                        {"id": lesson_id},
-                        {"$set": {
-                            "sectionsJson": json.dumps(sections),
-                            "updatedAt": datetime.now(timezone.utc).isoformat()
-                        }}
-                    )
+            # Update section content in place - only the edited section is written
+            if not isinstance(section_index, int) or section_index < 0:
+                return
+            now = datetime.now(timezone.utc).isoformat()
+            before = await db.lessons.find_one_and_update(
+                {
+                    "id": lesson_id,
+                    "sectionsJson": {"$type": "array"},
+                    f"sectionsJson.{section_index}": {"$type": "object"},
+                },
+                {"$set": {f"sectionsJson.{section_index}.content": value, "updatedAt": now}},
+                projection={"_id": 0}
+            )
+            if before is None:
+                # Legacy lesson with string sections - convert it on this write
+                before = await db.lessons.find_one({"id": lesson_id}, {"_id": 0})
+                if not before or not isinstance(before.get("sectionsJson"), str):
+                    return
+                sections = lesson_sections(before)
+                if section_index >= len(sections):
+                    return
+                sections[section_index] = {**sections[section_index], "content": value}
+                await db.lessons.update_one(
+                    {"id": lesson_id}, {"$set": {"sectionsJson": sections, "updatedAt": now}}
+                )
+                after = {**before, "sectionsJson": sections, "updatedAt": now}
+            else:
+                sections = list(before["sectionsJson"])
+                sections[section_index] = {**sections[section_index], "content": value}
+                after = {**before, "sectionsJson": sections, "updatedAt": now}
+            await record_revision(lesson_id, before, after, user_id, source="collaboration")
+            await record_lesson_edited(lesson_id, now)
                     
         elif field == "title":
-            await db.lessons.update_one(
-                {"id": lesson_id},
-                {"$set": {
-                    "title": value,
-                    "updatedAt": datetime.now(timezone.utc).isoformat()
-                }}
+            changes = {
+                "title": value,
+                "updatedAt": datetime.now(timezone.utc).isoformat()
+            }
+            before = await db.lessons.find_one_and_update(
+                {"id": lesson_id}, {"$set": changes}, projection={"_id": 0}
             )
+            if before:
+                after = {**before, **changes}
+                await record_revision(lesson_id, before, after, user_id, source="collaboration")
+                await record_lesson_edited(lesson_id, changes["updatedAt"])
+                search_index.upsert(after)
+                await similarity_index.update_lesson(after)
             
     except Exception as e:
         logger.error(f"Error saving lesson edit: {e}")
@@ -253,5 +354,6 @@ async def get_lesson_collaborators(lesson_id: str):
     """Get list of users currently viewing/editing a lesson"""
     return {
         "lessonId": lesson_id,
-        "activeUsers": manager.get_active_users(lesson_id)
+        "activeUsers": manager.get_active_users(lesson_id),
+        "connectionCount": manager.presence.connection_count(lesson_id)
     }
@@ -35,6 +35,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Count the user behind every authenticated request as active today.
+# Observation is in memory; the session cache resolves the token.
+from fastapi import Request
+from services.active_users import active_users
+
+
+@app.middleware("http")
+async def track_active_users(request: Request, call_next):
+    authorization = request.headers.get("authorization")
+    if authorization:
+        await active_users.observe_token(authorization)
+    return await call_next(request)
+
 # Import and include all routers
 from routes import (
     auth_router,
@@ -52,9 +65,12 @@ from routes import (
     user_router,
     notifications_router,
     series_router,
-    websocket_router
+    websocket_router,
+    revisions_router,
+    email_router
 )
 from routes.admin import router as admin_router
+from routes.admin_export import router as admin_export_router
 from routes.chatbot import router as chatbot_router
 
 # Include all routers with /api prefix
@@ -74,7 +90,10 @@ app.include_router(user_router, prefix="/api")
 app.include_router(notifications_router, prefix="/api")
 app.include_router(series_router, prefix="/api")
 app.include_router(websocket_router, prefix="/api")
+app.include_router(revisions_router, prefix="/api")
+app.include_router(email_router, prefix="/api")
 app.include_router(admin_router, prefix="/api")
+app.include_router(admin_export_router, prefix="/api")
 app.include_router(chatbot_router, prefix="/api")
 
 # Health check endpoint for Kubernetes
@@ -87,8 +106,10 @@ from fastapi import Header, HTTPException
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from services.database import db
+from services.email_service import EmailError, TransientEmailError, email_service
+from services.email_templates import render_lesson_email
+from routes.email import parse_schedule_for
 import asyncio
-import json
 
 class EmailLessonRequest(BaseModel):
     lessonId: str
@@ -96,14 +117,6 @@ class EmailLessonRequest(BaseModel):
     recipientName: Optional[str] = None
     scheduleFor: Optional[str] = None
 
-try:
-    import resend
-    resend.api_key = os.environ.get('RESEND_API_KEY')
-    SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'onboarding@resend.dev')
-except ImportError:
-    resend = None
-    SENDER_EMAIL = None
-
 @app.post("/api/email/send-lesson")
 async def send_lesson_email(request: EmailLessonRequest, authorization: str = Header(None)):
     """Send a lesson via email"""
@@ -114,105 +127,61 @@ async def send_lesson_email(request: EmailLessonRequest, authorization: str = He
     if not lesson:
         raise HTTPException(status_code=404, detail="Lesson not found")
     
-    # Parse sections
-    if isinstance(lesson.get("sectionsJson"), str):
-        try:
-            sections = json.loads(lesson.get("sectionsJson", "[]"))
-        except:
-            sections = []
-    else:
-        sections = lesson.get("sectionsJson", [])
-    
-    sections_html = ""
-    for section in sections:
-        if isinstance(section, dict):
-            sections_html += f"""
-            <tr>
-                <td style="padding: 15px; border-bottom: 1px solid #e5e7eb;">
-                    <h3 style="margin: 0 0 8px 0; color: #1E3A5F;">{section.get('icon', '📖')} {section.get('title', 'Section')}</h3>
-                    <p style="margin: 0 0 5px 0; color: #6B7280; font-size: 12px;">Duration: {section.get('duration', 'N/A')}</p>
-                    <p style="margin: 0; color: #374151;">{section.get('content', '')}</p>
-                </td>
-            </tr>
-            """
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>{lesson.get('title', 'Bible Lesson')}</title>
-    </head>
-    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; background-color: #f5f8fc;">
-        <table width="100%" cellpadding="0" cellspacing="0" style="background-color: white; border-radius: 12px; overflow: hidden; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
-            <tr>
-                <td style="background: linear-gradient(135deg, #1E3A5F 0%, #D4A017 100%); padding: 30px; text-align: center;">
-                    <h1 style="color: white; margin: 0; font-size: 24px;">{lesson.get('title', 'Bible Lesson')}</h1>
-                    <p style="color: rgba(255,255,255,0.9); margin: 10px 0 0 0;">📖 {lesson.get('passage', 'Scripture')}</p>
-                </td>
-            </tr>
-            <tr>
-                <td style="padding: 25px;">
-                    <table width="100%" cellpadding="0" cellspacing="0" style="margin-bottom: 20px;">
-                        <tr>
-                            <td style="background-color: #EBF5FF; padding: 15px; border-radius: 8px;">
-                                <p style="margin: 0; font-size: 14px;"><strong>Age Group:</strong> {lesson.get('ageGroup', 'All Ages')}</p>
-                                <p style="margin: 5px 0 0 0; font-size: 14px;"><strong>Duration:</strong> {lesson.get('duration', '45 min')}</p>
-                                <p style="margin: 5px 0 0 0; font-size: 14px;"><strong>Theme:</strong> {lesson.get('theme', 'Gods Love')}</p>
-                            </td>
-                        </tr>
-                    </table>
-                    
-                    <h2 style="color: #1E3A5F; border-bottom: 2px solid #D4A017; padding-bottom: 10px;">Memory Verse</h2>
-                    <blockquote style="background-color: #FEF3C7; padding: 15px; border-left: 4px solid #D4A017; margin: 0 0 20px 0; border-radius: 0 8px 8px 0;">
-                        <p style="margin: 0; font-style: italic; color: #374151;">"{lesson.get('memoryVerseText', 'The Lord is my shepherd.')}"</p>
-                        <p style="margin: 5px 0 0 0; font-weight: bold; color: #1E3A5F;">— {lesson.get('memoryVerseReference', 'Psalm 23:1')}</p>
-                    </blockquote>
-                    
-                    <h2 style="color: #1E3A5F; border-bottom: 2px solid #D4A017; padding-bottom: 10px;">Lesson Sections</h2>
-                    <table width="100%" cellpadding="0" cellspacing="0" style="border: 1px solid #e5e7eb; border-radius: 8px; overflow: hidden;">
-                        {sections_html}
-                    </table>
-                </td>
-            </tr>
-            <tr>
-                <td style="background-color: #F5F8FC; padding: 20px; text-align: center;">
-                    <p style="margin: 0; color: #6B7280; font-size: 12px;">Generated by Bible Lesson Planner</p>
-                </td>
-            </tr>
-        </table>
-    </body>
-    </html>
-    """
-    
-    if not resend or not resend.api_key:
+    if not email_service.configured:
         raise HTTPException(status_code=500, detail="Email service not configured")
     
-    params = {
-        "from": SENDER_EMAIL,
-        "to": [request.recipientEmail],
-        "subject": f"📖 {lesson.get('title', 'Bible Lesson')} - {lesson.get('passage', 'Lesson')}",
-        "html": html_content
-    }
+    send_at = parse_schedule_for(request.scheduleFor)
+    subject, html_content = render_lesson_email(lesson)
+    
+    if send_at:
+        # Held in the outbox until then; the worker wakes for it
+        outbox_id = await email_service.enqueue(
+            request.recipientEmail, subject, html_content, kind="lesson", send_at=send_at
+        )
+        await db.email_logs.insert_one({
+            "lessonId": request.lessonId,
+            "recipientEmail": request.recipientEmail,
+            "status": "scheduled",
+            "scheduledFor": send_at.isoformat(),
+            "outboxId": outbox_id,
+        })
+        return {
+            "status": "scheduled",
+            "message": f"Lesson will be sent to {request.recipientEmail} at {send_at.strftime('%B %d, %Y %I:%M %p UTC')}",
+            "scheduledFor": send_at.isoformat(),
+            "outboxId": outbox_id,
+        }
     
     try:
-        email = await asyncio.to_thread(resend.Emails.send, params)
-        
+        email = await email_service.send_now(request.recipientEmail, subject, html_content, kind="lesson")
+    except TransientEmailError as e:
+        # Still in the outbox; the worker keeps retrying it
+        logger.warning(f"Lesson email queued for retry: {e}")
         await db.email_logs.insert_one({
             "lessonId": request.lessonId,
             "recipientEmail": request.recipientEmail,
-            "status": "sent",
-            "emailId": email.get("id"),
+            "status": "queued",
         })
-        
         return {
-            "status": "success",
-            "message": f"Lesson sent to {request.recipientEmail}",
-            "emailId": email.get("id")
+            "status": "queued",
+            "message": f"Lesson will be sent to {request.recipientEmail} shortly",
         }
-    except Exception as e:
+    except EmailError as e:
         logger.error(f"Failed to send email: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+    
+    await db.email_logs.insert_one({
+        "lessonId": request.lessonId,
+        "recipientEmail": request.recipientEmail,
+        "status": "sent",
+        "emailId": email["providerId"],
+    })
+    
+    return {
+        "status": "success",
+        "message": f"Lesson sent to {request.recipientEmail}",
+        "emailId": email["providerId"]
+    }
 
 # Coupon validation routes (for backwards compatibility)
 from pydantic import BaseModel as PydanticBaseModel
@@ -290,9 +259,110 @@ async def startup_event():
     
     # Start the analytics scheduler
     from services.analytics_scheduler import start_scheduler
+    from services.scheduled_jobs import ensure_job_indexes
+    try:
+        await ensure_job_indexes()
+    except Exception as e:
+        logger.error(f"Error creating job run indexes: {e}")
+    # Daily notification archival and compaction, on the same job runner
+    from services.notification_retention import ensure_retention_indexes, register_retention_job
+    try:
+        await ensure_retention_indexes()
+    except Exception as e:
+        logger.error(f"Error creating notification retention indexes: {e}")
+    register_retention_job()
+    # Hourly/daily notification email digests
+    from services.notification_digest import ensure_digest_indexes, register_digest_jobs
+    try:
+        await ensure_digest_indexes()
+    except Exception as e:
+        logger.error(f"Error creating notification digest indexes: {e}")
+    register_digest_jobs()
     start_scheduler()
     logger.info("Analytics scheduler started")
     
+    # Ensure indexes used by lesson revision history
+    try:
+        from services.revisions import ensure_revision_indexes
+        await ensure_revision_indexes()
+    except Exception as e:
+        logger.error(f"Error creating revision indexes: {e}")
+    
+    # Daily analytics rollups (built from history on first start)
+    try:
+        from services.analytics_rollup import ensure_rollup_indexes, ensure_rollups_initialized
+        await ensure_rollup_indexes()
+        asyncio.create_task(ensure_rollups_initialized())
+    except Exception as e:
+        logger.error(f"Error creating analytics rollup indexes: {e}")
+    
+    # Subscription lookups by user (admin plan breakdown joins on it)
+    try:
+        from services.plan_breakdown import ensure_subscription_indexes
+        await ensure_subscription_indexes()
+    except Exception as e:
+        logger.error(f"Error creating subscription indexes: {e}")
+    
+    # Outbound email: outbox indexes and the delivery worker
+    try:
+        from services.email_service import ensure_outbox_indexes
+        await ensure_outbox_indexes()
+    except Exception as e:
+        logger.error(f"Error creating email outbox indexes: {e}")
+    try:
+        from routes.email import ensure_email_log_indexes
+        await ensure_email_log_indexes()
+    except Exception as e:
+        logger.error(f"Error creating email log indexes: {e}")
+    email_service.start()
+
+    # Compile the email templates once, so no request pays for it
+    try:
+        from services.email_templates import precompile
+        precompile()
+    except Exception as e:
+        logger.error(f"Error compiling email templates: {e}")
+
+    # Per-user notification listing and unread counting
+    try:
+        from services.notifications import ensure_notification_indexes
+        await ensure_notification_indexes()
+    except Exception as e:
+        logger.error(f"Error creating notification indexes: {e}")
+
+    # Active user sketches, flushed to the database every few seconds
+    try:
+        from services.active_users import ensure_active_user_indexes
+        await ensure_active_user_indexes()
+    except Exception as e:
+        logger.error(f"Error creating active user indexes: {e}")
+    active_users.start()
+    
+    # Scripture range index. Lessons saved before it existed are backfilled
+    # once per deployment with `python -m services.scripture`.
+    try:
+        from services.scripture import ensure_scripture_indexes
+        await ensure_scripture_indexes()
+    except Exception as e:
+        logger.error(f"Error creating scripture indexes: {e}")
+    
+    # Warm the lesson search and similarity indexes in the background and
+    # keep them refreshed
+    from services.search_index import ensure_search_indexes, search_index
+    from services.recommendations import ensure_vector_indexes, similarity_index
+    try:
+        await ensure_search_indexes()
+    except Exception as e:
+        logger.error(f"Error creating lesson search indexes: {e}")
+    try:
+        await ensure_vector_indexes()
+    except Exception as e:
+        logger.error(f"Error creating lesson vector indexes: {e}")
+    asyncio.create_task(search_index.ensure_built())
+    asyncio.create_task(similarity_index.ensure_built())
+    search_index.start()
+    similarity_index.start()
+    
     # Ensure admin user exists with proper role and password
     import hashlib
     admin_email = "hello@biblelessonplanner.com"
@@ -333,6 +403,8 @@ async def startup_event():
             "role": "admin",
             "createdAt": datetime.now(timezone.utc).isoformat(),
         })
+        from services.analytics_rollup import record_signup
+        await record_signup()
         # Also create preferences with onboarding completed
         await db.preferences.insert_one({
             "id": str(uuid.uuid4()),
@@ -364,9 +436,31 @@ async def shutdown_event():
     """Cleanup on shutdown"""
     from services.database import client
     from services.analytics_scheduler import stop_scheduler
+    from services.search_index import search_index
+    from services.recommendations import similarity_index
+    from services import google_calendar
     
     # Stop the analytics scheduler
-    stop_scheduler()
+    await stop_scheduler()
+    search_index.stop()
+    similarity_index.stop()
+    await active_users.stop()
+    await email_service.stop()
+    await google_calendar.close()
     
     client.close()
     logger.info("Database connection closed")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # permessage-deflate compresses JSON collaboration frames well; it can be
+    # switched off (WS_PER_MESSAGE_DEFLATE=false) when clients use compact
+    # binary framing and the CPU is better spent elsewhere.
+    uvicorn.run(
+        "server:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8001")),
+        ws_per_message_deflate=os.environ.get("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true",
+    )
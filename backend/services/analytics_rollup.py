@@ -0,0 +1,269 @@
+# Daily Analytics Rollups
+# Per-day counters in the analytics_daily collection, one document per UTC day:
+#   {date: "YYYY-MM-DD", signups, lessonsCreated, lessonsEdited,
+#    subscriptions, revenue, plans: {planId: n}, revenueByPlan: {planId: x},
+#    ageGroups: {ageGroup: n}}
+# Counters are $inc'd as events happen, so dashboards read one row per day
+# instead of every user/lesson document. Lessons edited are deduplicated
+# through analytics_daily_marks; active users are counted by the sketches
+# in services.active_users.
+#
+# Rebuild from source collections (idempotent):
+#   python -m services.analytics_rollup --days 90
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Union
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+# Prices used for dashboard revenue (same table the spending report has always used)
+PLAN_PRICES = {
+    "starter": 0,
+    "pro": 9.99,
+    "team": 24.99,
+}
+
+COUNTERS = ["signups", "lessonsCreated", "lessonsEdited", "subscriptions", "revenue"]
+MAPS = ["plans", "revenueByPlan", "ageGroups"]
+
+# Dedup marks only need to outlive the longest dashboard period
+MARK_RETENTION_DAYS = 120
+
+
+def day_key(when: Union[datetime, str, None] = None) -> str:
+    """UTC day ("YYYY-MM-DD") for a datetime, an ISO timestamp, or now"""
+    if when is None:
+        when = datetime.now(timezone.utc)
+    if isinstance(when, str):
+        return when[:10]
+    return when.astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+
+def day_start(when: datetime) -> datetime:
+    """Midnight UTC of the day `when` falls on"""
+    return when.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _map_key(value) -> str:
+    """Make an arbitrary value safe to use as a sub-document key"""
+    key = re.sub(r"[.$]", "_", str(value or "unknown"))
+    return key or "unknown"
+
+
+async def _inc(day: str, counters: Dict[str, float]):
+    try:
+        await db.analytics_daily.update_one({"date": day}, {"$inc": counters}, upsert=True)
+    except DuplicateKeyError:
+        # Lost the race to create the day's document; it exists now
+        await db.analytics_daily.update_one({"date": day}, {"$inc": counters})
+    except Exception as e:
+        # Analytics must never break the request that triggered it
+        logger.error(f"[Rollup] Failed to update {day}: {e}")
+
+
+async def _mark_once(day: str, kind: str, key: str) -> bool:
+    """Record (day, kind, key); True only the first time it is seen"""
+    try:
+        await db.analytics_daily_marks.insert_one({
+            "date": day,
+            "kind": kind,
+            "key": key,
+            "expiresAt": datetime.now(timezone.utc) + timedelta(days=MARK_RETENTION_DAYS),
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+    except Exception as e:
+        logger.error(f"[Rollup] Failed to record {kind} mark: {e}")
+        return False
+
+
+async def record_signup(created_at: Optional[str] = None):
+    await _inc(day_key(created_at), {"signups": 1})
+
+
+async def record_lesson_created(lesson: dict):
+    await _inc(day_key(lesson.get("createdAt")), {
+        "lessonsCreated": 1,
+        f"ageGroups.{_map_key(lesson.get('ageGroup'))}": 1,
+    })
+
+
+async def record_lesson_edited(lesson_id: str, when: Optional[str] = None):
+    day = day_key(when)
+    if await _mark_once(day, "lessonEdited", lesson_id):
+        await _inc(day, {"lessonsEdited": 1})
+
+
+async def record_subscription(
+    plan_id: Optional[str],
+    when: Optional[str] = None,
+    dedupe_key: Optional[str] = None,
+):
+    """
+    Count a new subscription. `dedupe_key` (e.g. the Stripe checkout session
+    id) makes redelivered webhooks count once, even across midnight.
+    """
+    if dedupe_key and not await _mark_once("-", "subscription", dedupe_key):
+        return
+    plan = _map_key(plan_id or "starter")
+    price = PLAN_PRICES.get(plan_id or "starter", 0)
+    await _inc(day_key(when), {
+        "subscriptions": 1,
+        "revenue": price,
+        f"plans.{plan}": 1,
+        f"revenueByPlan.{plan}": price,
+    })
+
+
+# ---- reading ---------------------------------------------------------------
+
+async def get_daily_rows(start_day: str, end_day: Optional[str] = None) -> List[dict]:
+    query = {"date": {"$gte": start_day}}
+    if end_day:
+        query["date"]["$lte"] = end_day
+    return await db.analytics_daily.find(query, {"_id": 0}).sort("date", ASCENDING).to_list(None)
+
+
+def total(rows: List[dict], field: str) -> float:
+    return sum(row.get(field, 0) for row in rows)
+
+
+def daily_series(rows: List[dict], field: str) -> Dict[str, float]:
+    """{date: value} for days with a non-zero value, like the old charts"""
+    return {row["date"]: row[field] for row in rows if row.get(field)}
+
+
+def merge_maps(rows: List[dict], field: str) -> Dict[str, float]:
+    merged: Dict[str, float] = {}
+    for row in rows:
+        for key, value in (row.get(field) or {}).items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+# ---- maintenance -----------------------------------------------------------
+
+async def ensure_rollup_indexes():
+    await db.analytics_daily.create_index([("date", ASCENDING)], unique=True)
+    await db.analytics_daily_marks.create_index(
+        [("date", ASCENDING), ("kind", ASCENDING), ("key", ASCENDING)], unique=True
+    )
+    await db.analytics_daily_marks.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+
+
+def _by_day(field: str, since: Optional[str], extra_group: Optional[str] = None) -> list:
+    match = {field: {"$type": "string"}}
+    if since:
+        match[field]["$gte"] = since
+    group_id = {"day": {"$substr": [f"${field}", 0, 10]}}
+    if extra_group:
+        group_id["key"] = f"${extra_group}"
+    return [
+        {"$match": match},
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+    ]
+
+
+async def backfill_rollups(days: Optional[int] = None) -> dict:
+    """
+    Recompute daily rollups from the source collections (all history, or the
+    last `days` days). Replaces counters for the covered days, so it is safe
+    to run repeatedly.
+    """
+    since = None
+    if days is not None:
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    rollups: Dict[str, dict] = {}
+
+    def row(day: str) -> dict:
+        if day not in rollups:
+            rollups[day] = {**{c: 0 for c in COUNTERS}, **{m: {} for m in MAPS}}
+        return rollups[day]
+
+    async for g in db.users.aggregate(_by_day("createdAt", since)):
+        row(g["_id"]["day"])["signups"] += g["count"]
+
+    async for g in db.lessons.aggregate(_by_day("createdAt", since, "ageGroup")):
+        r = row(g["_id"]["day"])
+        r["lessonsCreated"] += g["count"]
+        key = _map_key(g["_id"].get("key"))
+        r["ageGroups"][key] = r["ageGroups"].get(key, 0) + g["count"]
+
+    async for g in db.subscriptions.aggregate(_by_day("createdAt", since, "planId")):
+        r = row(g["_id"]["day"])
+        plan_id = g["_id"].get("key") or "starter"
+        plan = _map_key(plan_id)
+        price = PLAN_PRICES.get(plan_id, 0) * g["count"]
+        r["subscriptions"] += g["count"]
+        r["revenue"] += price
+        r["plans"][plan] = r["plans"].get(plan, 0) + g["count"]
+        r["revenueByPlan"][plan] = r["revenueByPlan"].get(plan, 0) + price
+
+    # Lessons edited also rebuild their marks so later edits aren't double counted
+    marks = []
+    mark_expiry = datetime.now(timezone.utc) + timedelta(days=MARK_RETENTION_DAYS)
+
+    edit_match = {"updatedAt": {"$type": "string", **({"$gte": since} if since else {})}}
+    async for lesson in db.lessons.find(edit_match, {"_id": 0, "id": 1, "updatedAt": 1}):
+        day = day_key(lesson["updatedAt"])
+        row(day)["lessonsEdited"] += 1
+        marks.append(("lessonEdited", day, lesson["id"]))
+
+    operations = [
+        UpdateOne({"date": day}, {"$set": values}, upsert=True)
+        for day, values in rollups.items()
+    ]
+    for i in range(0, len(operations), 500):
+        await db.analytics_daily.bulk_write(operations[i:i + 500], ordered=False)
+
+    mark_ops = [
+        UpdateOne(
+            {"date": day, "kind": kind, "key": key},
+            {"$setOnInsert": {"expiresAt": mark_expiry}},
+            upsert=True
+        )
+        for kind, day, key in marks
+    ]
+    for i in range(0, len(mark_ops), 1000):
+        await db.analytics_daily_marks.bulk_write(mark_ops[i:i + 1000], ordered=False)
+
+    # Active user sketches are rebuilt from the same window
+    from services.active_users import backfill_active_users
+    await backfill_active_users(since)
+
+    logger.info(f"[Rollup] Backfilled {len(rollups)} days")
+    return {"days": len(rollups), "since": since}
+
+
+async def ensure_rollups_initialized():
+    """
+    First start after rollups were introduced: build them from history.
+    The mark makes this run once across all processes.
+    """
+    if not await _mark_once("-", "backfill", "initial"):
+        return
+    try:
+        await backfill_rollups()
+    except Exception as e:
+        logger.error(f"[Rollup] Initial backfill failed: {e}")
+        await db.analytics_daily_marks.delete_one({"date": "-", "kind": "backfill", "key": "initial"})
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Rebuild analytics_daily rollups")
+    parser.add_argument("--days", type=int, default=None, help="only the last N days (default: all history)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(backfill_rollups(args.days)))
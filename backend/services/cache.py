@@ -0,0 +1,243 @@
+# In-process Caches
+# Small TTL + LRU cache with single-flight loading, shared by the services
+# that need to keep hot lookups (sessions, lesson access, ...) off MongoDB,
+# and a stale-while-revalidate variant for slow-changing reports.
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after `ttl` seconds.
+
+    get_or_load() coalesces concurrent misses for the same key into a single
+    loader call, so a burst of identical requests costs one database read.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0, name: str = "cache"):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        """Drop every entry for which predicate(key, value) is true"""
+        for key in [k for k, (_, v) in self._data.items() if predicate(k, v)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None,
+    ) -> Any:
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure doesn't log a warning
+            future.exception()
+            raise
+        else:
+            self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "maxEntries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def _lookup(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+
+class StaleWhileRevalidateCache:
+    """
+    Bounded LRU cache that keeps serving an entry after it goes stale.
+
+    Entries younger than `fresh_for` seconds are served as is. Older ones are
+    still served immediately while a single background task reloads them,
+    until they are `max_age` seconds old; after that the caller waits for a
+    (single-flight) reload.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        fresh_for: float = 60.0,
+        max_age: float = 3600.0,
+        name: str = "swr-cache",
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.fresh_for = fresh_for
+        self.max_age = max_age
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        # Bumped by invalidation so in-flight refreshes don't store old data
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        item = self._data.get(key)
+        if item is not None:
+            loaded_at, value = item
+            age = time.monotonic() - loaded_at
+            if age < self.fresh_for:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return value
+            if age < self.max_age:
+                self.stale_hits += 1
+                self._data.move_to_end(key)
+                self._refresh_in_background(key, loader)
+                return value
+            del self._data[key]
+        self.misses += 1
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            if generation == self._generation:
+                self._store(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing or key in self._inflight:
+            return
+        self._refreshing[key] = asyncio.get_running_loop().create_task(self._refresh(key, loader))
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        generation = self._generation
+        try:
+            value = await loader()
+            if generation == self._generation:
+                self._store(key, value)
+            self.refreshes += 1
+        except Exception as e:
+            # Keep serving the stale value; the next request retries
+            self.refresh_errors += 1
+            logger.error(f"[Cache] {self.name} refresh of {key!r} failed: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    def _store(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "maxEntries": self.max_entries,
+            "freshFor": self.fresh_for,
+            "maxAge": self.max_age,
+            "hits": self.hits,
+            "staleHits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refreshErrors": self.refresh_errors,
+            "refreshing": len(self._refreshing),
+            "evictions": self.evictions,
+            "hitRate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+            "oldestEntryAge": round(max((now - t for t, _ in self._data.values()), default=0.0), 1),
+        }
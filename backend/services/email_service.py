@@ -0,0 +1,479 @@
+# Outbound Email
+# Every email the app sends goes through here. Messages are written to the
+# email_outbox collection first, so a crash or provider outage can't lose
+# them, and a background worker in each process delivers them:
+#   {id, kind, from, to: [..], subject, html, status, attempts,
+#    nextAttemptAt, createdAt, sentAt, providerId, lastError}
+# status: pending -> sending -> sent | failed. Workers claim due messages
+# atomically, send them through the Resend batch API (up to 100 per call)
+# over one pooled HTTP client, and retry transient failures with
+# exponential backoff. Per-recipient token buckets keep a burst of
+# notifications from flooding one inbox.
+#
+# Scheduled email (send_at) is just a pending message whose nextAttemptAt
+# is in the future, so it survives restarts like anything else in the
+# outbox. The worker sleeps until the earliest due message rather than
+# polling, and scheduled times are kept to whole minutes so everything
+# due in the same minute goes out in one claimed batch.
+#
+# EMAIL_TRANSPORT=fake swaps in an in-memory transport for tests and local
+# development; without it (and without RESEND_API_KEY) email is skipped.
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Union
+
+import httpx
+from pymongo import ASCENDING, UpdateOne
+
+from services.cache import TTLCache
+from services.database import db
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
+EMAIL_TRANSPORT = os.environ.get('EMAIL_TRANSPORT', 'resend')
+DEFAULT_SENDER = os.environ.get('SENDER_EMAIL', 'Bible Lesson Planner <onboarding@resend.dev>')
+
+BATCH_SIZE = 100
+# Longest the worker sleeps without checking the outbox; it wakes sooner
+# when a message falls due or this process enqueues one
+IDLE_INTERVAL = 60
+CLAIM_TIMEOUT = 120
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+# Finished messages are kept this long for auditing, then expire
+RETENTION_DAYS = 30
+
+# Resend allows 2 requests/s per account, but each process only sees its own
+# sends, so the account limit is split across EMAIL_WORKER_PROCESSES (set it
+# to the number of app processes sending email)
+ACCOUNT_PROVIDER_RATE = 2
+EMAIL_WORKER_PROCESSES = max(1, int(os.environ.get('EMAIL_WORKER_PROCESSES', '1')))
+PROVIDER_RATE = ACCOUNT_PROVIDER_RATE / EMAIL_WORKER_PROCESSES
+# Per recipient: a burst of 10, then one every 12 seconds
+RECIPIENT_BURST = 10
+RECIPIENT_RATE = 1 / 12
+
+
+class EmailError(Exception):
+    """Delivery failed and retrying won't help (bad address, rejected payload)"""
+
+
+class TransientEmailError(EmailError):
+    """Delivery failed but may succeed later (rate limited, provider/network error)"""
+
+
+class ResendTransport:
+    API_URL = "https://api.resend.com"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        # One pooled client for the process: connections are reused across sends
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.API_URL,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(15.0, connect=5.0),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def _post(self, path: str, payload) -> dict:
+        try:
+            response = await self._http().post(path, json=payload)
+        except httpx.HTTPError as e:
+            raise TransientEmailError(f"{type(e).__name__}: {e}") from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientEmailError(f"{response.status_code}: {response.text}")
+        if response.status_code >= 400:
+            raise EmailError(f"{response.status_code}: {response.text}")
+        return response.json()
+
+    async def send(self, message: dict) -> str:
+        return (await self._post("/emails", message)).get("id")
+
+    async def send_batch(self, messages: List[dict]) -> List[str]:
+        result = await self._post("/emails/batch", messages)
+        return [item.get("id") for item in result.get("data", [])]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class FakeTransport:
+    """Records messages instead of sending them; can be told to fail"""
+
+    def __init__(self, fail_times: int = 0, error: type = TransientEmailError):
+        self.sent: List[dict] = []
+        self.requests = 0
+        self.fail_times = fail_times
+        self.error = error
+
+    def _maybe_fail(self):
+        self.requests += 1
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise self.error("fake failure")
+
+    async def send(self, message: dict) -> str:
+        self._maybe_fail()
+        self.sent.append(message)
+        return f"fake-{uuid.uuid4().hex[:12]}"
+
+    async def send_batch(self, messages: List[dict]) -> List[str]:
+        self._maybe_fail()
+        self.sent.extend(messages)
+        return [f"fake-{uuid.uuid4().hex[:12]}" for _ in messages]
+
+    async def close(self):
+        pass
+
+
+def _default_transport():
+    if EMAIL_TRANSPORT == "fake":
+        return FakeTransport()
+    if RESEND_API_KEY:
+        return ResendTransport(RESEND_API_KEY)
+    return None
+
+
+def _payload(doc: dict) -> dict:
+    payload = {"from": doc["from"], "to": doc["to"], "subject": doc["subject"], "html": doc["html"]}
+    if doc.get("replyTo"):
+        payload["reply_to"] = doc["replyTo"]
+    return payload
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo hands datetimes back naive (they are stored as UTC)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class EmailService:
+    def __init__(self, transport=None):
+        self.transport = transport if transport is not None else _default_transport()
+        self._provider_bucket = TokenBucket(rate=PROVIDER_RATE, burst=max(1.0, PROVIDER_RATE))
+        self._recipient_buckets = TTLCache(max_entries=10000, ttl=3600, name="email-recipients")
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.worker_id = uuid.uuid4().hex
+
+    @property
+    def configured(self) -> bool:
+        return self.transport is not None
+
+    def _new_message(
+        self,
+        to: Union[str, List[str]],
+        subject: str,
+        html: str,
+        kind: str,
+        sender: Optional[str],
+        reply_to: Optional[str],
+        send_at: Optional[datetime],
+    ) -> dict:
+        now = datetime.now(timezone.utc)
+        if send_at is not None:
+            # Minute granularity lets one claim pick up a whole minute's sends
+            send_at = _as_utc(send_at).replace(second=0, microsecond=0)
+        return {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "from": sender or DEFAULT_SENDER,
+            "to": [to] if isinstance(to, str) else list(to),
+            "subject": subject,
+            "html": html,
+            "replyTo": reply_to,
+            "status": "pending",
+            "attempts": 0,
+            "nextAttemptAt": send_at or now,
+            "createdAt": now,
+        }
+
+    async def enqueue(
+        self,
+        to: Union[str, List[str]],
+        subject: str,
+        html: str,
+        kind: str = "general",
+        sender: Optional[str] = None,
+        reply_to: Optional[str] = None,
+        send_at: Optional[datetime] = None,
+    ) -> Optional[str]:
+        """Queue an email for delivery; returns its outbox id (None if email is off)"""
+        if not self.configured:
+            logger.warning(f"[Email] Skipped {kind} email - RESEND_API_KEY not configured")
+            return None
+        message = self._new_message(to, subject, html, kind, sender, reply_to, send_at)
+        await db.email_outbox.insert_one(message)
+        self._wake.set()
+        return message["id"]
+
+    async def enqueue_many(self, messages: List[dict]) -> List[str]:
+        """Queue many emails in one write; each dict takes enqueue()'s arguments"""
+        if not self.configured:
+            logger.warning(f"[Email] Skipped {len(messages)} emails - RESEND_API_KEY not configured")
+            return []
+        docs = [
+            self._new_message(
+                m["to"], m["subject"], m["html"], m.get("kind", "general"),
+                m.get("sender"), m.get("reply_to"), m.get("send_at"),
+            )
+            for m in messages
+        ]
+        if docs:
+            await db.email_outbox.insert_many(docs, ordered=False)
+            self._wake.set()
+        return [d["id"] for d in docs]
+
+    async def send_now(
+        self,
+        to: Union[str, List[str]],
+        subject: str,
+        html: str,
+        kind: str = "general",
+        sender: Optional[str] = None,
+        reply_to: Optional[str] = None,
+    ) -> dict:
+        """
+        Deliver immediately, for callers that report the result to the user.
+        The message is still recorded in the outbox; if the provider is only
+        temporarily unavailable it stays queued and the worker retries it.
+        """
+        if not self.configured:
+            raise EmailError("Email service not configured")
+        message = self._new_message(to, subject, html, kind, sender, reply_to, None)
+        message.update({
+            "status": "sending",
+            "claimToken": self.worker_id,
+            "claimedUntil": message["createdAt"] + timedelta(seconds=CLAIM_TIMEOUT),
+        })
+        await db.email_outbox.insert_one(message)
+        if not await self._provider_bucket.acquire(max_wait=10):
+            # Over the provider rate: the worker sends it once a slot frees up
+            await db.email_outbox.bulk_write([self._deferred_op(message, 1)])
+            self._wake.set()
+            raise TransientEmailError("Email provider rate limit reached; message queued for retry")
+        try:
+            provider_id = await self.transport.send(_payload(message))
+        except EmailError as e:
+            await db.email_outbox.bulk_write([self._failure_op(message, e)])
+            raise
+        await db.email_outbox.bulk_write([self._sent_op(message, provider_id)])
+        return {"id": message["id"], "providerId": provider_id}
+
+    # ---- delivery ---------------------------------------------------------------
+
+    def _recipients_allowed(self, doc: dict) -> float:
+        """0 if every recipient has budget (and spends it), else seconds to wait"""
+        buckets = []
+        for address in doc["to"]:
+            key = address.lower()
+            bucket = self._recipient_buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate=RECIPIENT_RATE, burst=RECIPIENT_BURST)
+                self._recipient_buckets.set(key, bucket)
+            buckets.append(bucket)
+        wait = max((b.wait_time() for b in buckets), default=0.0)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket.try_acquire()
+        return 0.0
+
+    def _sent_op(self, doc: dict, provider_id: Optional[str]) -> UpdateOne:
+        now = datetime.now(timezone.utc)
+        return UpdateOne({"id": doc["id"]}, {
+            "$set": {
+                "status": "sent",
+                "sentAt": now,
+                "providerId": provider_id,
+                "expiresAt": now + timedelta(days=RETENTION_DAYS),
+            },
+            "$inc": {"attempts": 1},
+            "$unset": {"claimToken": "", "claimedUntil": ""},
+        })
+
+    def _failure_op(self, doc: dict, error: Exception) -> UpdateOne:
+        now = datetime.now(timezone.utc)
+        attempts = doc.get("attempts", 0) + 1
+        update = {"attempts": attempts, "lastError": str(error)[:500]}
+        if isinstance(error, TransientEmailError) and attempts < MAX_ATTEMPTS:
+            update.update({"status": "pending", "nextAttemptAt": now + timedelta(seconds=_backoff(attempts))})
+        else:
+            update.update({"status": "failed", "failedAt": now, "expiresAt": now + timedelta(days=RETENTION_DAYS)})
+            logger.error(f"[Email] Giving up on {doc['kind']} email to {doc['to']}: {error}")
+        return UpdateOne({"id": doc["id"]}, {"$set": update, "$unset": {"claimToken": "", "claimedUntil": ""}})
+
+    def _deferred_op(self, doc: dict, wait: float) -> UpdateOne:
+        return UpdateOne({"id": doc["id"]}, {
+            "$set": {"status": "pending", "nextAttemptAt": datetime.now(timezone.utc) + timedelta(seconds=wait)},
+            "$unset": {"claimToken": "", "claimedUntil": ""},
+        })
+
+    async def _claim_due(self) -> List[dict]:
+        now = datetime.now(timezone.utc)
+        due = {"$or": [
+            {"status": "pending", "nextAttemptAt": {"$lte": now}},
+            # Claimed by a worker that died before finishing
+            {"status": "sending", "claimedUntil": {"$lt": now}},
+        ]}
+        candidates = await db.email_outbox.find(due, {"_id": 0, "id": 1}) \
+            .sort("nextAttemptAt", ASCENDING).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not candidates:
+            return []
+        token = uuid.uuid4().hex
+        # Re-checking `due` makes the claim atomic per message across workers
+        await db.email_outbox.update_many(
+            {"id": {"$in": [c["id"] for c in candidates]}, **due},
+            {"$set": {
+                "status": "sending",
+                "claimToken": token,
+                "claimedUntil": now + timedelta(seconds=CLAIM_TIMEOUT),
+            }}
+        )
+        return await db.email_outbox.find({"claimToken": token}, {"_id": 0}).to_list(BATCH_SIZE)
+
+    async def _send_batch(self, docs: List[dict]) -> List[UpdateOne]:
+        if not await self._provider_bucket.acquire(max_wait=10):
+            return [self._deferred_op(doc, 1) for doc in docs]
+        try:
+            if len(docs) == 1:
+                ids = [await self.transport.send(_payload(docs[0]))]
+            else:
+                ids = await self.transport.send_batch([_payload(doc) for doc in docs])
+        except TransientEmailError as e:
+            return [self._failure_op(doc, e) for doc in docs]
+        except EmailError as e:
+            if len(docs) == 1:
+                return [self._failure_op(docs[0], e)]
+            # One bad message rejects the whole batch: retry them one by one
+            ops = []
+            for doc in docs:
+                ops.extend(await self._send_batch([doc]))
+            return ops
+        if len(ids) != len(docs):
+            logger.error(f"[Email] Provider returned {len(ids)} ids for a batch of {len(docs)}")
+        ops = [self._sent_op(doc, provider_id) for doc, provider_id in zip(docs, ids)]
+        # Unconfirmed messages may have gone out, so they aren't retried
+        # (a retry could deliver them twice)
+        unconfirmed = EmailError("Provider did not confirm this message in its batch response")
+        ops.extend(self._failure_op(doc, unconfirmed) for doc in docs[len(ids):])
+        return ops
+
+    async def process_due(self) -> int:
+        """Deliver one claimed batch of due messages; returns how many were claimed"""
+        docs = await self._claim_due()
+        if not docs:
+            return 0
+        ops = []
+        ready = []
+        for doc in docs:
+            wait = self._recipients_allowed(doc)
+            if wait:
+                ops.append(self._deferred_op(doc, wait))
+            else:
+                ready.append(doc)
+        if ready:
+            ops.extend(await self._send_batch(ready))
+        if ops:
+            await db.email_outbox.bulk_write(ops, ordered=False)
+        return len(docs)
+
+    async def seconds_until_due(self) -> float:
+        """How long until the earliest queued message (or stale claim) is due"""
+        pending, stale = await asyncio.gather(
+            db.email_outbox.find_one(
+                {"status": "pending"}, {"_id": 0, "nextAttemptAt": 1}, sort=[("nextAttemptAt", ASCENDING)]
+            ),
+            db.email_outbox.find_one(
+                {"status": "sending"}, {"_id": 0, "claimedUntil": 1}, sort=[("claimedUntil", ASCENDING)]
+            ),
+        )
+        due_times = []
+        if pending and pending.get("nextAttemptAt"):
+            due_times.append(_as_utc(pending["nextAttemptAt"]))
+        if stale and stale.get("claimedUntil"):
+            due_times.append(_as_utc(stale["claimedUntil"]))
+        if not due_times:
+            return IDLE_INTERVAL
+        wait = (min(due_times) - datetime.now(timezone.utc)).total_seconds()
+        return min(IDLE_INTERVAL, max(0.0, wait))
+
+    async def _worker_loop(self):
+        while True:
+            # Clear before looking, so an enqueue during the pass still wakes us
+            self._wake.clear()
+            try:
+                claimed = await self.process_due()
+                if claimed >= BATCH_SIZE:
+                    continue
+                wait = await self.seconds_until_due()
+            except Exception as e:
+                logger.error(f"[Email] Outbox worker error: {e}")
+                wait = IDLE_INTERVAL
+            if wait <= 0:
+                # Due now but claimed elsewhere or deferred; don't spin
+                wait = 1
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self.configured:
+            logger.warning("[Email] Outbox worker not started - RESEND_API_KEY not configured")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._worker_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.transport is not None:
+            await self.transport.close()
+
+    async def stats(self) -> dict:
+        counts = await db.email_outbox.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        recent_failures = await db.email_outbox.find(
+            {"status": "failed"},
+            {"_id": 0, "id": 1, "kind": 1, "to": 1, "subject": 1, "attempts": 1, "lastError": 1, "failedAt": 1}
+        ).sort("failedAt", -1).limit(10).to_list(10)
+        return {
+            "configured": self.configured,
+            "transport": type(self.transport).__name__ if self.transport else None,
+            "counts": {c["_id"]: c["count"] for c in counts},
+            "scheduled": await db.email_outbox.count_documents(
+                {"status": "pending", "nextAttemptAt": {"$gt": datetime.now(timezone.utc)}}
+            ),
+            "recentFailures": recent_failures,
+        }
+
+
+email_service = EmailService()
+
+
+async def ensure_outbox_indexes():
+    await db.email_outbox.create_index([("id", ASCENDING)], unique=True)
+    await db.email_outbox.create_index([("status", ASCENDING), ("nextAttemptAt", ASCENDING)])
+    await db.email_outbox.create_index([("claimToken", ASCENDING)], sparse=True)
+    await db.email_outbox.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
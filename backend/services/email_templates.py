@@ -0,0 +1,68 @@
+# Email Templates
+# Jinja2 templates for every outgoing email (templates/email/*.html).
+# Templates are compiled once at startup and kept for the life of the
+# process, and everything interpolated into them is HTML-escaped, so user
+# content (lesson text, names, contact messages) can't inject markup.
+# Rendered lesson emails are cached per lesson revision, since the same
+# lesson is often sent to many recipients.
+import logging
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from services.cache import TTLCache
+from services.lesson_storage import lesson_sections
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "templates" / "email"
+
+env = Environment(
+    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+    autoescape=select_autoescape(["html"]),
+    # Templates only change on deploy, so never stat the files again
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+
+# (lesson id, revision) -> (subject, html). A lesson's updatedAt changes on
+# every edit, so an edited lesson simply misses and old entries age out.
+lesson_email_cache = TTLCache(max_entries=256, ttl=3600, name="lesson_emails")
+
+
+def precompile() -> int:
+    """Compile every email template up front; returns how many were loaded"""
+    names = [n for n in env.list_templates() if n.endswith(".html")]
+    for name in names:
+        env.get_template(name)
+    logger.info(f"[Templates] Compiled {len(names)} email templates")
+    return len(names)
+
+
+def render(name: str, /, **context) -> str:
+    return env.get_template(name).render(**context)
+
+
+def render_many(name: str, contexts: Iterable[dict]) -> List[str]:
+    """Render one template for many recipients, looking it up only once"""
+    template = env.get_template(name)
+    return [template.render(**context) for context in contexts]
+
+
+def lesson_revision(lesson: dict) -> str:
+    return lesson.get("updatedAt") or lesson.get("createdAt") or ""
+
+
+def render_lesson_email(lesson: dict) -> Tuple[str, str]:
+    """Subject and HTML body for a lesson email, cached per lesson revision"""
+    key = (lesson.get("id"), lesson_revision(lesson))
+    cached = lesson_email_cache.get(key)
+    if cached is not None:
+        return cached
+
+    subject = f"📖 {lesson.get('title', 'Bible Lesson')} - {lesson.get('passage', 'Lesson')}"
+    html = render("lesson.html", lesson=lesson, sections=lesson_sections(lesson))
+    lesson_email_cache.set(key, (subject, html))
+    return subject, html
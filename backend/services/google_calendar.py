@@ -0,0 +1,206 @@
+# Google Calendar Client
+# Async access to the Google Calendar API for the calendar routes. The
+# Google client libraries are synchronous, so:
+#   - the Calendar discovery document is parsed once per process and every
+#     service object is built from it (no discovery fetch or re-parse);
+#   - each user's service object and credentials are cached in memory, the
+#     credentials only until shortly before their access token expires;
+#   - API calls and token refreshes run in worker threads, at most
+#     MAX_CONCURRENT_CALLS at a time, and one at a time per user (a
+#     service object's HTTP connection isn't thread-safe).
+# The OAuth code exchange and user-info lookup use a pooled async HTTP
+# client instead of blocking requests.
+import asyncio
+import json
+import logging
+import os
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+import httpx
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from services.cache import TTLCache
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CALENDAR_CLIENT_ID')
+GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CALENDAR_CLIENT_SECRET')
+GOOGLE_SCOPES = [
+    'https://www.googleapis.com/auth/calendar',
+    'https://www.googleapis.com/auth/userinfo.email'
+]
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+USERINFO_URI = 'https://www.googleapis.com/oauth2/v2/userinfo'
+
+MAX_CONCURRENT_CALLS = 8
+# Refresh this long before Google says the access token expires
+EXPIRY_MARGIN = timedelta(minutes=2)
+# Upper bound on how long a user's credentials/service stay cached
+CACHE_TTL = 3600
+
+_call_slots = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+# A user's lock lives only while some call holds or waits on it
+_user_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_credentials_cache = TTLCache(max_entries=2000, ttl=CACHE_TTL, name="google-credentials")
+_service_cache = TTLCache(max_entries=2000, ttl=CACHE_TTL, name="google-calendar-services")
+_discovery_doc: Optional[dict] = None
+_http: Optional[httpx.AsyncClient] = None
+
+
+def _utcnow() -> datetime:
+    # google-auth compares expiry as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _discovery_document() -> dict:
+    global _discovery_doc
+    if _discovery_doc is None:
+        _discovery_doc = json.loads(get_static_doc('calendar', 'v3'))
+    return _discovery_doc
+
+
+def _client() -> httpx.AsyncClient:
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(timeout=httpx.Timeout(15.0, connect=5.0))
+    return _http
+
+
+def _lock_for(user_id: str) -> asyncio.Lock:
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+def token_expiry(tokens: dict) -> Optional[datetime]:
+    """When stored tokens expire (naive UTC), or None if unknown"""
+    if tokens.get('expires_at'):
+        return datetime.fromisoformat(tokens['expires_at']).replace(tzinfo=None)
+    return None
+
+
+def with_expiry(tokens: dict, now: Optional[datetime] = None) -> dict:
+    """Stamp a token response (which only has expires_in) with an absolute expiry"""
+    now = now or datetime.now(timezone.utc)
+    if tokens.get('expires_in'):
+        tokens = {**tokens, 'expires_at': (now + timedelta(seconds=int(tokens['expires_in']))).isoformat()}
+    return tokens
+
+
+def _fresh(creds: Credentials) -> bool:
+    return creds.expiry is not None and creds.expiry - EXPIRY_MARGIN > _utcnow()
+
+
+def invalidate(user_id: str):
+    """Forget a user's cached credentials and service (on connect/disconnect)"""
+    _credentials_cache.invalidate(user_id)
+    _service_cache.invalidate(user_id)
+
+
+async def _load_credentials(user_id: str) -> Optional[Credentials]:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "google_calendar_tokens": 1})
+    if not user or 'google_calendar_tokens' not in user:
+        return None
+    tokens = user['google_calendar_tokens']
+    creds = Credentials(
+        token=tokens.get('access_token'),
+        refresh_token=tokens.get('refresh_token'),
+        token_uri=TOKEN_URI,
+        client_id=GOOGLE_CLIENT_ID,
+        client_secret=GOOGLE_CLIENT_SECRET,
+        scopes=GOOGLE_SCOPES,
+        expiry=token_expiry(tokens),
+    )
+    # Tokens saved without an expiry are refreshed once to learn it
+    if _fresh(creds) or not creds.refresh_token:
+        return creds
+
+    try:
+        async with _call_slots:
+            await asyncio.to_thread(creds.refresh, GoogleRequest())
+    except Exception as e:
+        logger.error(f"[GoogleCalendar] Refreshing credentials for {user_id} failed: {e}")
+        # Clear invalid tokens
+        await db.users.update_one({"id": user_id}, {"$unset": {"google_calendar_tokens": ""}})
+        return None
+    await db.users.update_one({"id": user_id}, {"$set": {
+        "google_calendar_tokens.access_token": creds.token,
+        "google_calendar_tokens.expires_at": creds.expiry.replace(tzinfo=timezone.utc).isoformat(),
+    }})
+    return creds
+
+
+async def get_credentials(user_id: str) -> Optional[Credentials]:
+    """A user's Google credentials with a usable access token, or None if not connected"""
+    creds = _credentials_cache.get(user_id)
+    if creds is not None and _fresh(creds):
+        return creds
+    async with _lock_for(user_id):
+        # Another request may have refreshed them while we waited
+        creds = _credentials_cache.get(user_id)
+        if creds is not None and _fresh(creds):
+            return creds
+        creds = await _load_credentials(user_id)
+        if creds is None:
+            invalidate(user_id)
+            return None
+        if creds.expiry is not None:
+            ttl = (creds.expiry - EXPIRY_MARGIN - _utcnow()).total_seconds()
+            _credentials_cache.set(user_id, creds, ttl=max(1.0, min(CACHE_TTL, ttl)))
+        return creds
+
+
+def _service_for(user_id: str, creds: Credentials):
+    cached = _service_cache.get(user_id)
+    if cached is not None and cached[0] is creds:
+        return cached[1]
+    service = build_from_document(_discovery_document(), credentials=creds)
+    _service_cache.set(user_id, (creds, service))
+    return service
+
+
+async def execute(user_id: str, creds: Credentials, make_request: Callable):
+    """
+    Run one Calendar API call off the event loop, e.g.
+        await execute(user_id, creds, lambda s: s.events().list(calendarId='primary'))
+    """
+    async with _lock_for(user_id):
+        service = _service_for(user_id, creds)
+        request = make_request(service)
+        async with _call_slots:
+            return await asyncio.to_thread(request.execute)
+
+
+async def exchange_code(code: str, redirect_uri: str) -> dict:
+    """Trade an OAuth authorization code for tokens (stamped with expires_at)"""
+    response = await _client().post(TOKEN_URI, data={
+        'code': code,
+        'client_id': GOOGLE_CLIENT_ID,
+        'client_secret': GOOGLE_CLIENT_SECRET,
+        'redirect_uri': redirect_uri,
+        'grant_type': 'authorization_code',
+    })
+    if response.status_code != 200:
+        raise ValueError(f"Token exchange failed ({response.status_code}): {response.text}")
+    return with_expiry(response.json())
+
+
+async def fetch_account_email(access_token: str) -> Optional[str]:
+    response = await _client().get(USERINFO_URI, headers={'Authorization': f'Bearer {access_token}'})
+    if response.status_code != 200:
+        return None
+    return response.json().get('email')
+
+
+async def close():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
@@ -0,0 +1,74 @@
+# Leader Election
+# Lease-based leadership shared through MongoDB, so work that must happen
+# once per cluster (scheduled jobs) runs in exactly one worker however many
+# replicas are up. The lease is one document in the leases collection:
+#   {_id: name, holder, expiresAt, renewedAt}
+# The holder renews it by calling try_acquire() more often than the TTL; if
+# it dies, the lease expires and another worker's next call takes it over.
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL = 45
+
+# Identifies this process for as long as it runs
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderLease:
+    def __init__(self, name: str, ttl: float = LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = INSTANCE_ID
+        self.is_leader = False
+
+    async def try_acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if ours"""
+        now = datetime.now(timezone.utc)
+        try:
+            await db.leases.update_one(
+                {
+                    "_id": self.name,
+                    "$or": [{"holder": self.holder}, {"expiresAt": {"$lt": now}}],
+                },
+                {"$set": {
+                    "holder": self.holder,
+                    "expiresAt": now + timedelta(seconds=self.ttl),
+                    "renewedAt": now,
+                }},
+                upsert=True
+            )
+            acquired = True
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else
+            acquired = False
+        except Exception as e:
+            # Can't prove we still hold it, so stop acting as leader
+            logger.error(f"[Leader] Lease {self.name} heartbeat failed: {e}")
+            acquired = False
+
+        if acquired != self.is_leader:
+            logger.info(f"[Leader] {self.holder} {'acquired' if acquired else 'lost'} lease {self.name}")
+        self.is_leader = acquired
+        return acquired
+
+    async def release(self):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        try:
+            await db.leases.delete_one({"_id": self.name, "holder": self.holder})
+        except Exception as e:
+            logger.error(f"[Leader] Failed to release lease {self.name}: {e}")
+
+    async def current_holder(self) -> Optional[dict]:
+        return await db.leases.find_one({"_id": self.name})
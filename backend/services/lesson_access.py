@@ -0,0 +1,45 @@
+# Lesson Access Checks
+# Decides whether a user may open a lesson, memoized per (user, lesson) for a
+# short time so reconnecting collaborators don't repeat the lookups.
+from typing import Optional
+
+from services.cache import TTLCache
+from services.database import db
+
+ACCESS_TTL = 300
+
+access_cache = TTLCache(max_entries=20000, ttl=ACCESS_TTL, name="lesson_access")
+
+
+async def _check_access(user: dict, lesson_id: str) -> Optional[bool]:
+    lesson = await db.lessons.find_one({"id": lesson_id}, {"_id": 0, "userId": 1})
+    if lesson is None:
+        return None
+
+    owner_id = lesson.get("userId")
+    # Lessons created without a session have no owner and stay open
+    if not owner_id or owner_id == user["id"] or user.get("role") == "admin":
+        return True
+
+    member = await db.team_members.find_one(
+        {"ownerId": owner_id, "userId": user["id"]},
+        {"_id": 0, "id": 1}
+    )
+    return member is not None
+
+
+async def can_access_lesson(user: dict, lesson_id: str) -> Optional[bool]:
+    """
+    True if the user owns the lesson, is on the owner's team, or is an admin.
+    False if the lesson exists but is off-limits, None if it doesn't exist.
+    """
+    key = (user["id"], lesson_id)
+    return await access_cache.get_or_load(key, lambda: _check_access(user, lesson_id))
+
+
+def invalidate_lesson_access(lesson_id: Optional[str] = None, user_id: Optional[str] = None):
+    """Forget memoized decisions after ownership or team membership changes"""
+    access_cache.invalidate_where(
+        lambda key, _: (lesson_id is None or key[1] == lesson_id)
+        and (user_id is None or key[0] == user_id)
+    )
@@ -0,0 +1,130 @@
+# Lesson Storage Helpers
+# Lesson sections, materials, cross references and config used to be stored
+# as JSON-encoded strings. They are now stored as native BSON arrays/objects
+# (field names unchanged), which allows projections and section-level $set.
+# Legacy string documents are still read correctly until migrated.
+#
+# One-time migration:
+#   python -m services.lesson_storage --batch-size 500
+import json
+import logging
+from typing import Any, Optional
+
+from pymongo import UpdateOne
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+# Field -> empty value used when the field is missing or unreadable
+NATIVE_FIELDS = {
+    "sectionsJson": [],
+    "materialsJson": [],
+    "crossReferencesJson": [],
+    "configJson": {},
+}
+
+
+def _decode(field: str, value: Any) -> Any:
+    default = NATIVE_FIELDS[field]
+    if value is None:
+        return type(default)()
+    if isinstance(value, str):
+        try:
+            value = json.loads(value or "null")
+        except ValueError:
+            return type(default)()
+    if not isinstance(value, type(default)):
+        return type(default)()
+    return value
+
+
+def load_json_field(lesson: Optional[dict], field: str) -> Any:
+    """Read a structured lesson field, whether stored natively or as a legacy string"""
+    return _decode(field, (lesson or {}).get(field))
+
+
+def lesson_sections(lesson: Optional[dict]) -> list:
+    return load_json_field(lesson, "sectionsJson")
+
+
+def lesson_materials(lesson: Optional[dict]) -> list:
+    return load_json_field(lesson, "materialsJson")
+
+
+def to_native(data: dict) -> dict:
+    """Convert any string-encoded structured fields in a write payload to native values"""
+    result = dict(data)
+    for field in NATIVE_FIELDS:
+        if field in result and (result[field] is None or isinstance(result[field], str)):
+            result[field] = _decode(field, result[field])
+    return result
+
+
+def normalize_lesson(lesson: Optional[dict]) -> Optional[dict]:
+    """Return a lesson with structured fields in native form (legacy docs included)"""
+    if lesson is None:
+        return None
+    if not any(isinstance(lesson.get(field), str) for field in NATIVE_FIELDS):
+        return lesson
+    return to_native(lesson)
+
+
+LEGACY_FILTER = {"$or": [{field: {"$type": "string"}} for field in NATIVE_FIELDS]}
+
+
+async def migrate_json_fields(batch_size: int = 500, dry_run: bool = False) -> dict:
+    """
+    Convert legacy string fields to native values in batches.
+    Walks the collection in _id order so each batch is one indexed range read
+    and one bulk write, and it is safe to stop and rerun at any point.
+    """
+    projection = {field: 1 for field in NATIVE_FIELDS}
+    last_id = None
+    scanned = 0
+    converted = 0
+
+    while True:
+        query = dict(LEGACY_FILTER)
+        if last_id is not None:
+            query = {"$and": [LEGACY_FILTER, {"_id": {"$gt": last_id}}]}
+
+        batch = await db.lessons.find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            updates = {
+                field: _decode(field, doc[field])
+                for field in NATIVE_FIELDS
+                if isinstance(doc.get(field), str)
+            }
+            if updates:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": updates}))
+
+        if operations and not dry_run:
+            result = await db.lessons.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        elif dry_run:
+            converted += len(operations)
+
+        scanned += len(batch)
+        last_id = batch[-1]["_id"]
+        logger.info(f"[LessonStorage] Migrated batch: scanned={scanned} converted={converted}")
+
+    return {"scanned": scanned, "converted": converted, "dryRun": dry_run}
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Convert lesson JSON string fields to native arrays")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(migrate_json_fields(args.batch_size, args.dry_run))
+    print(summary)
@@ -0,0 +1,48 @@
+# Notification Push Bus
+# In-process fan-out of notification events to the live streams
+# (GET /api/notifications/stream) of the users they concern. Each open
+# stream owns a bounded queue; a slow client that lets its queue fill up
+# just misses events, and its stream resyncs the unread count from the
+# database on its next heartbeat. Events published by other server
+# processes reach a stream the same way, through that heartbeat resync.
+import asyncio
+import logging
+from typing import Dict, Set
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+
+
+class NotificationBus:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if not queues:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id: str) -> bool:
+        return user_id in self._subscribers
+
+    def publish(self, user_id: str, event: dict):
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.debug(f"[NotificationBus] Dropped {event.get('type')} event for {user_id}")
+
+    def connection_count(self) -> int:
+        return sum(len(q) for q in self._subscribers.values())
+
+
+notification_bus = NotificationBus()
@@ -0,0 +1,167 @@
+# Notification Email Digests
+# Users who choose an hourly or daily digest (emailPreferences
+# .digestFrequency) get one summary email per period instead of one email
+# per notification. Their notification emails wait in
+# notification_email_pending:
+#   {userId, email, frequency, notificationId, type, title, message,
+#    senderName, lessonId, actionUrl, createdAt, expiresAt}
+# and a job per frequency (run once per cluster by the job runner) groups
+# each user's pending items by type and lesson, renders one email per user
+# and queues them all in the outbox in one write.
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from apscheduler.triggers.cron import CronTrigger
+from pymongo import ASCENDING
+
+from services.database import db
+from services.email_service import email_service
+from services.email_templates import render_many
+from services.scheduled_jobs import ScheduledJob, job_runner
+
+logger = logging.getLogger(__name__)
+
+INSTANT = "instant"
+FREQUENCIES = {
+    # frequency: (trigger, subject period, footer wording)
+    "hourly": (CronTrigger(minute=0, timezone='UTC'), "in the last hour", "hourly"),
+    "daily": (CronTrigger(hour=7, minute=0, timezone='UTC'), "today", "once a day"),
+}
+
+# Pending items read per round trip while flushing
+BATCH_SIZE = 2000
+# Items shown per group; the rest are summarized as "and N more"
+ITEMS_PER_GROUP = 5
+# Pending items nobody flushed (job disabled, user deleted) are dropped
+PENDING_TTL = timedelta(days=7)
+
+GROUP_LABELS = {
+    'lesson_shared': ("📚", "Lessons shared with you"),
+    'team_invite': ("👥", "Team invitations"),
+    'lesson_edited': ("✏️", "Lesson edits"),
+    'reminder': ("⏰", "Reminders"),
+    'success': ("✅", "Updates"),
+    'info': ("ℹ️", "Updates"),
+    'warning': ("⚠️", "Warnings"),
+}
+
+
+def digest_frequency(recipient: dict) -> str:
+    frequency = (recipient.get('emailPreferences') or {}).get('digestFrequency', INSTANT)
+    return frequency if frequency in FREQUENCIES else INSTANT
+
+
+async def queue_for_digest(recipients: List[dict], notifications: Dict[str, dict]):
+    """Hold notification emails for each recipient's next digest (notifications by recipient id)"""
+    now = datetime.now(timezone.utc)
+    pending = []
+    for recipient in recipients:
+        notification = notifications[recipient['id']]
+        pending.append({
+            "userId": recipient['id'],
+            "email": recipient['email'],
+            "frequency": digest_frequency(recipient),
+            "notificationId": notification['id'],
+            "type": notification['type'],
+            "title": notification['title'],
+            "message": notification['message'],
+            "senderName": notification.get('senderName'),
+            "lessonId": notification.get('lessonId'),
+            "actionUrl": notification.get('actionUrl'),
+            "createdAt": now,
+            "expiresAt": now + PENDING_TTL,
+        })
+    if pending:
+        await db.notification_email_pending.insert_many(pending, ordered=False)
+
+
+def group_items(items: List[dict]) -> List[dict]:
+    """Group one user's pending items by (type, lesson), newest first"""
+    groups: "OrderedDict[tuple, dict]" = OrderedDict()
+    for item in sorted(items, key=lambda i: i['createdAt'], reverse=True):
+        key = (item['type'], item.get('lessonId'))
+        group = groups.get(key)
+        if group is None:
+            icon, label = GROUP_LABELS.get(item['type'], ("🔔", "Notifications"))
+            group = groups[key] = {
+                "icon": icon,
+                "label": label,
+                "count": 0,
+                "items": [],
+                "actionUrl": item.get('actionUrl'),
+            }
+        group["count"] += 1
+        if len(group["items"]) < ITEMS_PER_GROUP:
+            group["items"].append(item)
+    return list(groups.values())
+
+
+async def flush_digests(frequency: str) -> dict:
+    """Send every user with pending items at this frequency their digest"""
+    _, period, frequency_label = FREQUENCIES[frequency]
+    # Only what was pending when the flush started; later items wait
+    started = datetime.now(timezone.utc)
+    query = {"frequency": frequency, "createdAt": {"$lte": started}}
+    users = emails = 0
+    while True:
+        items = await db.notification_email_pending.find(query) \
+            .sort("userId", ASCENDING).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not items:
+            break
+        if len(items) == BATCH_SIZE:
+            # Keep the last user whole for the next round (unless they alone fill it)
+            last_user = items[-1]['userId']
+            whole = [i for i in items if i['userId'] != last_user]
+            items = whole or items
+
+        by_user: "OrderedDict[str, List[dict]]" = OrderedDict()
+        for item in items:
+            by_user.setdefault(item['userId'], []).append(item)
+
+        contexts = []
+        messages = []
+        for user_items in by_user.values():
+            contexts.append({
+                "total": len(user_items),
+                "period": period,
+                "frequency_label": frequency_label,
+                "groups": group_items(user_items),
+            })
+        bodies = render_many("notification_digest.html", contexts)
+        for user_items, context, html in zip(by_user.values(), contexts, bodies):
+            total = context["total"]
+            messages.append({
+                "to": user_items[0]['email'],
+                "subject": f"🔔 {total} new notification{'s' if total != 1 else ''} {period}",
+                "html": html,
+                "kind": f"notification_digest:{frequency}",
+            })
+        await email_service.enqueue_many(messages)
+        # Queued before removal: a crash in between repeats a digest rather than losing one
+        await db.notification_email_pending.delete_many({"_id": {"$in": [i['_id'] for i in items]}})
+        users += len(by_user)
+        emails += len(items)
+
+    logger.info(f"[Digest] {frequency}: {users} digests covering {emails} notifications")
+    return {"status": "success", "digests": users, "notifications": emails}
+
+
+def register_digest_jobs():
+    for frequency, (trigger, _, _) in FREQUENCIES.items():
+        job_runner.register(ScheduledJob(
+            f"notification_digest_{frequency}",
+            f"Notification Digest ({frequency})",
+            lambda frequency=frequency: flush_digests(frequency),
+            trigger,
+            # A missed hourly slot is covered by the next one
+            catch_up=timedelta(hours=1) if frequency == "hourly" else timedelta(hours=12),
+        ))
+
+
+async def ensure_digest_indexes():
+    await db.notification_email_pending.create_index(
+        [("frequency", ASCENDING), ("userId", ASCENDING), ("createdAt", ASCENDING)]
+    )
+    await db.notification_email_pending.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
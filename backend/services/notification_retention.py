@@ -0,0 +1,153 @@
+# Notification Retention
+# Keeps the notifications collection down to a working set of recent items.
+# A daily job (run once per cluster by the job runner):
+#   - archives read notifications older than the read-retention window to
+#     notifications_archive, then stamps them with expireAt so the TTL
+#     index removes them. Nothing is deleted before it has been archived.
+#   - compacts unread notifications older than the compaction window: they
+#     are archived too, and each user gets one unread "digest" notification
+#     counting what was collapsed, by type.
+# Both windows are configurable; changing one applies on the next run.
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from apscheduler.triggers.cron import CronTrigger
+from pymongo import ASCENDING, UpdateOne
+
+from services.database import db
+from services.notifications import adjust_unread
+from services.scheduled_jobs import ScheduledJob, job_runner
+
+logger = logging.getLogger(__name__)
+
+READ_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_READ_RETENTION_DAYS', '30'))
+COMPACT_UNREAD_AFTER_DAYS = int(os.environ.get('NOTIFICATION_COMPACT_UNREAD_DAYS', '90'))
+
+BATCH_SIZE = 1000
+# Archived notifications are removed by the TTL monitor within a minute or so
+EXPIRE_AFTER_ARCHIVE = timedelta(minutes=5)
+
+DIGEST_TYPE = "digest"
+
+
+async def _archive(docs: List[dict], now: datetime):
+    """Copy notifications to the archive (idempotent, so a rerun is harmless)"""
+    ops = []
+    for doc in docs:
+        archived = {k: v for k, v in doc.items() if k not in ("_id", "expireAt")}
+        archived["archivedAt"] = now
+        ops.append(UpdateOne({"id": doc["id"]}, {"$setOnInsert": archived}, upsert=True))
+    if ops:
+        await db.notifications_archive.bulk_write(ops, ordered=False)
+
+
+async def expire_read_notifications(now: datetime) -> int:
+    """Archive read notifications past the retention window and let TTL remove them"""
+    cutoff = now - timedelta(days=READ_RETENTION_DAYS)
+    query = {
+        "read": True,
+        "expireAt": None,
+        "$or": [
+            {"readAt": {"$lt": cutoff}},
+            # Read before readAt was recorded
+            {"readAt": None, "createdAt": {"$lt": cutoff}},
+        ],
+    }
+    total = 0
+    while True:
+        docs = await db.notifications.find(query, {"_id": 0}).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not docs:
+            return total
+        await _archive(docs, now)
+        await db.notifications.update_many(
+            {"id": {"$in": [d["id"] for d in docs]}},
+            {"$set": {"expireAt": now + EXPIRE_AFTER_ARCHIVE}}
+        )
+        total += len(docs)
+
+
+async def compact_unread_notifications(now: datetime) -> dict:
+    """Fold each user's stale unread notifications into one digest notification"""
+    cutoff = now - timedelta(days=COMPACT_UNREAD_AFTER_DAYS)
+    query = {"read": False, "createdAt": {"$lt": cutoff}, "type": {"$ne": DIGEST_TYPE}}
+    compacted = 0
+    digests = set()
+    while True:
+        docs = await db.notifications.find(query, {"_id": 0}) \
+            .sort("recipientId", ASCENDING).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not docs:
+            return {"compacted": compacted, "digests": len(digests)}
+        await _archive(docs, now)
+
+        by_user = defaultdict(list)
+        for doc in docs:
+            by_user[doc["recipientId"]].append(doc)
+
+        # One digest per user per run; later batches add to it
+        ops = []
+        for user_id, user_docs in by_user.items():
+            by_type = defaultdict(int)
+            for doc in user_docs:
+                by_type[doc["type"]] += 1
+            ops.append(UpdateOne(
+                {"id": f"digest-{user_id}-{now.strftime('%Y%m%d')}"},
+                {
+                    "$setOnInsert": {
+                        "type": DIGEST_TYPE,
+                        "title": "Older notifications",
+                        "message": f"Notifications you hadn't read in {COMPACT_UNREAD_AFTER_DAYS} days were collected here.",
+                        "recipientId": user_id,
+                        "senderId": None,
+                        "senderName": "Bible Lesson Planner",
+                        "read": False,
+                        "createdAt": now,
+                    },
+                    "$inc": {
+                        "digest.total": len(user_docs),
+                        **{f"digest.byType.{t}": n for t, n in by_type.items()},
+                    },
+                    "$min": {"digest.from": min(d["createdAt"] for d in user_docs)},
+                    "$max": {"digest.to": max(d["createdAt"] for d in user_docs)},
+                },
+                upsert=True
+            ))
+        result = await db.notifications.bulk_write(ops, ordered=False)
+
+        created = {list(by_user)[i] for i in result.upserted_ids}
+        for user_id, user_docs in by_user.items():
+            # Ones read since the find are left for the read-retention pass
+            # (their read already came off the counter)
+            deleted = await db.notifications.delete_many(
+                {"id": {"$in": [d["id"] for d in user_docs]}, "read": False}
+            )
+            # The removed notifications stop counting; a new digest counts once
+            await adjust_unread(user_id, (1 if user_id in created else 0) - deleted.deleted_count)
+            digests.add(user_id)
+        compacted += len(docs)
+
+
+async def run_notification_retention() -> dict:
+    now = datetime.now(timezone.utc)
+    expired = await expire_read_notifications(now)
+    compaction = await compact_unread_notifications(now)
+    logger.info(f"[Retention] Archived {expired} read notifications, compacted {compaction['compacted']} unread")
+    return {"status": "success", "expired": expired, **compaction}
+
+
+def register_retention_job():
+    job_runner.register(ScheduledJob(
+        "notification_retention",
+        "Notification Retention",
+        run_notification_retention,
+        CronTrigger(hour=3, minute=30, timezone='UTC'),
+    ))
+
+
+async def ensure_retention_indexes():
+    await db.notifications.create_index([("expireAt", ASCENDING)], expireAfterSeconds=0)
+    await db.notifications.create_index([("read", ASCENDING), ("readAt", ASCENDING)])
+    await db.notifications_archive.create_index([("id", ASCENDING)], unique=True)
+    await db.notifications_archive.create_index([("recipientId", ASCENDING), ("createdAt", ASCENDING)])
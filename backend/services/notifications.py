@@ -0,0 +1,257 @@
+# Notification Delivery
+# Creates in-app notifications for one recipient or a whole team in bulk:
+# recipients are resolved with one query, the notifications are written
+# with one insert_many, and the emails for recipients who want them are
+# rendered once and queued in the outbox with one write (or held for the
+# recipient's digest, see services.notification_digest).
+#
+# Each user's unread count is kept in notification_counters
+#   {_id: user id, unread}
+# and adjusted with $inc by every operation that creates, reads or deletes
+# notifications, so it stays exact however many notifications there are.
+# A counter is built from the notifications themselves the first time it
+# is read. Changes are pushed to the user's open streams through the
+# notification bus.
+#
+# Read notifications are kept for a retention window after readAt, then
+# archived and removed (services.notification_retention).
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+
+from services.database import db
+from services.email_service import email_service
+from services.email_templates import render
+from services.notification_digest import INSTANT, digest_frequency, queue_for_digest
+from services.notification_bus import notification_bus
+
+logger = logging.getLogger(__name__)
+
+# Recipients per fan-out (a team, or an explicit list)
+MAX_FAN_OUT = 500
+
+# Notification type -> emailPreferences key that can switch its email off.
+# Types without a key are always emailed.
+EMAIL_PREFERENCE_KEYS = {
+    'lesson_shared': 'lessonShared',
+    'team_invite': 'teamInvite',
+    'lesson_edited': 'lessonEdited',
+    'reminder': 'reminders',
+}
+
+SUBJECT_ICONS = {
+    'lesson_shared': "📚",
+    'team_invite': "👥",
+    'lesson_edited': "✏️",
+    'reminder': "⏰",
+    'success': "✅",
+    'info': "ℹ️",
+    'warning': "⚠️",
+}
+
+# Recounts allowed while seeding a counter that keeps moving
+SEED_ATTEMPTS = 5
+
+RECIPIENT_PROJECTION = {"_id": 0, "id": 1, "email": 1, "name": 1, "emailPreferences": 1}
+
+
+def public_notification(notification: dict) -> dict:
+    """JSON-ready copy of a notification document"""
+    result = {k: v for k, v in notification.items() if k != '_id'}
+    for key, value in result.items():
+        if isinstance(value, datetime):
+            result[key] = value.isoformat()
+    return result
+
+
+# ---- unread counters ----------------------------------------------------------
+
+async def unread_count(user_id: str) -> int:
+    counter = await db.notification_counters.find_one({"_id": user_id})
+    if counter is None:
+        # First read: create the counter before counting, so $incs from
+        # concurrent writes land on it instead of being dropped. The count
+        # replaces it only if nothing moved it meanwhile; otherwise recount.
+        result = await db.notification_counters.update_one(
+            {"_id": user_id}, {"$setOnInsert": {"unread": 0}}, upsert=True
+        )
+        if result.upserted_id is not None:
+            for _ in range(SEED_ATTEMPTS):
+                before = (await db.notification_counters.find_one({"_id": user_id}))["unread"]
+                unread = await db.notifications.count_documents({"recipientId": user_id, "read": False})
+                seeded = await db.notification_counters.update_one(
+                    {"_id": user_id, "unread": before}, {"$set": {"unread": unread}}
+                )
+                if seeded.matched_count:
+                    break
+        counter = await db.notification_counters.find_one({"_id": user_id})
+    return max(0, counter.get("unread", 0))
+
+
+async def adjust_unread(user_id: str, delta: int):
+    """Apply a change to a user's unread count and push the new value"""
+    if not delta:
+        return
+    # No upsert: a missing counter is built from the notifications on first read
+    counter = await db.notification_counters.find_one_and_update(
+        {"_id": user_id}, {"$inc": {"unread": delta}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is not None:
+        notification_bus.publish(user_id, {"type": "unread", "unreadCount": max(0, counter["unread"])})
+
+
+def read_update(now: datetime) -> dict:
+    """Fields set on a notification when it is read (starts its retention clock)"""
+    return {"read": True, "readAt": now}
+
+
+async def set_read(user_id: str, notification_id: str, read: bool) -> bool:
+    """Mark one notification read or unread; False if it was already that way"""
+    if read:
+        update = {"$set": read_update(datetime.now(timezone.utc))}
+    else:
+        update = {"$set": {"read": False}, "$unset": {"readAt": ""}}
+    result = await db.notifications.update_one(
+        {"id": notification_id, "recipientId": user_id, "read": {"$ne": read}},
+        update
+    )
+    if result.modified_count:
+        await adjust_unread(user_id, -1 if read else 1)
+    return bool(result.modified_count)
+
+
+async def mark_all_read(user_id: str) -> int:
+    result = await db.notifications.update_many(
+        {"recipientId": user_id, "read": False},
+        {"$set": read_update(datetime.now(timezone.utc))}
+    )
+    await adjust_unread(user_id, -result.modified_count)
+    return result.modified_count
+
+
+async def delete_notification(user_id: str, notification_id: str) -> bool:
+    deleted = await db.notifications.find_one_and_delete(
+        {"id": notification_id, "recipientId": user_id}, {"_id": 0, "read": 1}
+    )
+    if deleted is None:
+        return False
+    if not deleted.get("read", False):
+        await adjust_unread(user_id, -1)
+    return True
+
+
+async def clear_all(user_id: str) -> int:
+    # Unread ones first, so the counter moves by exactly what was removed
+    unread = await db.notifications.delete_many({"recipientId": user_id, "read": False})
+    rest = await db.notifications.delete_many({"recipientId": user_id})
+    await adjust_unread(user_id, -unread.deleted_count)
+    return unread.deleted_count + rest.deleted_count
+
+
+# ---- delivery -----------------------------------------------------------------
+
+def wants_email(recipient: dict, notification_type: str) -> bool:
+    key = EMAIL_PREFERENCE_KEYS.get(notification_type)
+    if key is None:
+        return True
+    return (recipient.get('emailPreferences') or {}).get(key, True)
+
+
+def email_subject(notification: dict) -> str:
+    icon = SUBJECT_ICONS.get(notification['type'])
+    return f"{icon} {notification['title']}" if icon else notification['title']
+
+
+async def find_recipients(
+    user_ids: Optional[List[str]] = None,
+    emails: Optional[List[str]] = None,
+) -> List[dict]:
+    """Resolve recipients by id and/or email in a single query"""
+    clauses = []
+    if user_ids:
+        clauses.append({"id": {"$in": list(user_ids)}})
+    if emails:
+        clauses.append({"email": {"$in": [e.lower() for e in emails]}})
+    if not clauses:
+        return []
+    query = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+    return await db.users.find(query, RECIPIENT_PROJECTION).to_list(MAX_FAN_OUT)
+
+
+async def team_member_ids(owner_id: str) -> List[str]:
+    members = await db.team_members.find(
+        {"ownerId": owner_id, "userId": {"$ne": None}}, {"_id": 0, "userId": 1}
+    ).to_list(MAX_FAN_OUT)
+    return [m["userId"] for m in members]
+
+
+async def notify(
+    sender: dict,
+    recipients: List[dict],
+    type: str,
+    title: str,
+    message: str,
+    lesson_id: Optional[str] = None,
+    action_url: Optional[str] = None,
+    send_email: bool = True,
+) -> List[dict]:
+    """Create one notification per recipient; returns the new notifications"""
+    now = datetime.now(timezone.utc)
+    sender_name = sender.get('name', sender.get('email', 'Someone'))
+    unique = list({r['id']: r for r in recipients}.values())
+    notifications = [
+        {
+            "id": f"notif-{uuid.uuid4().hex[:12]}",
+            "type": type,
+            "title": title,
+            "message": message,
+            "recipientId": recipient['id'],
+            "senderId": sender['id'],
+            "senderName": sender_name,
+            "lessonId": lesson_id,
+            "actionUrl": action_url,
+            "read": False,
+            "createdAt": now,
+        }
+        for recipient in unique
+    ]
+    if not notifications:
+        return []
+    await db.notifications.insert_many(notifications, ordered=False)
+    await db.notification_counters.bulk_write(
+        [UpdateOne({"_id": n["recipientId"]}, {"$inc": {"unread": 1}}) for n in notifications],
+        ordered=False
+    )
+    for notification in notifications:
+        if notification_bus.has_subscribers(notification["recipientId"]):
+            notification_bus.publish(notification["recipientId"], {
+                "type": "notification",
+                "notification": public_notification(notification),
+            })
+
+    if send_email:
+        emailed = [r for r in unique if r.get('email') and wants_email(r, type)]
+        instant = [r for r in emailed if digest_frequency(r) == INSTANT]
+        digested = [r for r in emailed if digest_frequency(r) != INSTANT]
+        if instant:
+            # The body doesn't vary by recipient, so render it once
+            subject = email_subject(notifications[0])
+            html_content = render("notification.html", notification=notifications[0])
+            await email_service.enqueue_many([
+                {"to": r['email'], "subject": subject, "html": html_content, "kind": f"notification:{type}"}
+                for r in instant
+            ])
+        if digested:
+            await queue_for_digest(digested, {n["recipientId"]: n for n in notifications})
+
+    logger.info(f"[Notifications] {type} from {sender['id']} to {len(notifications)} recipients")
+    return notifications
+
+
+async def ensure_notification_indexes():
+    await db.notifications.create_index([("recipientId", ASCENDING), ("createdAt", DESCENDING)])
+    await db.notifications.create_index([("recipientId", ASCENDING), ("read", ASCENDING)])
+    await db.notifications.create_index([("id", ASCENDING)])
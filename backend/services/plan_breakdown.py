@@ -0,0 +1,109 @@
+# Admin Plan Breakdown
+# Users per subscription plan, MRR and the most recent users on each plan,
+# computed in a single aggregation over users (joined to their active
+# subscription) and cached briefly. Subscription writes invalidate the cache.
+import logging
+
+from pymongo import ASCENDING
+
+from services.cache import TTLCache
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+PLAN_BREAKDOWN_TTL = 60
+RECENT_USERS_PER_PLAN = 10
+
+# Define plan tiers
+PLAN_INFO = {
+    "free": {"name": "Free", "price": 0, "color": "stone"},
+    "starter": {"name": "Starter", "price": 0, "color": "stone"},
+    "pro": {"name": "Pro", "price": 9.99, "color": "amber"},
+    "team": {"name": "Team", "price": 24.99, "color": "blue"},
+    "enterprise": {"name": "Enterprise", "price": 99.99, "color": "purple"},
+}
+
+_CACHE_KEY = "plan-breakdown"
+plan_breakdown_cache = TTLCache(max_entries=1, ttl=PLAN_BREAKDOWN_TTL, name="plan-breakdown")
+
+
+def _pipeline() -> list:
+    return [
+        {"$project": {"_id": 0, "id": 1, "name": 1, "email": 1, "createdAt": 1}},
+        # Active subscription for the user (served by the subscriptions.userId index)
+        {"$lookup": {
+            "from": "subscriptions",
+            "let": {"userId": "$id"},
+            "pipeline": [
+                {"$match": {
+                    "$expr": {"$eq": ["$userId", "$$userId"]},
+                    "status": {"$in": ["active", "trialing"]},
+                }},
+                {"$project": {"_id": 0, "planId": 1}},
+                {"$limit": 1},
+            ],
+            "as": "subscription",
+        }},
+        {"$set": {"plan": {"$ifNull": [{"$first": "$subscription.planId"}, "free"]}}},
+        # Unknown plan ids count as free, as they always have
+        {"$set": {"plan": {"$cond": [{"$in": ["$plan", list(PLAN_INFO)]}, "$plan", "free"]}}},
+        {"$group": {
+            "_id": "$plan",
+            "userCount": {"$sum": 1},
+            "recentUsers": {"$topN": {
+                "n": RECENT_USERS_PER_PLAN,
+                "sortBy": {"createdAt": -1},
+                "output": {
+                    "id": "$id",
+                    "name": {"$ifNull": ["$name", "Unknown"]},
+                    "email": "$email",
+                    "createdAt": "$createdAt",
+                },
+            }},
+        }},
+    ]
+
+
+async def compute_plan_breakdown() -> dict:
+    groups = {g["_id"]: g for g in await db.users.aggregate(_pipeline()).to_list(None)}
+    total_users = sum(g["userCount"] for g in groups.values())
+
+    plan_breakdown = []
+    for plan_id, info in PLAN_INFO.items():
+        group = groups.get(plan_id, {})
+        count = group.get("userCount", 0)
+        percentage = round((count / total_users * 100), 1) if total_users > 0 else 0
+        plan_breakdown.append({
+            "planId": plan_id,
+            "planName": info["name"],
+            "price": info["price"],
+            "color": info["color"],
+            "userCount": count,
+            "percentage": percentage,
+            "monthlyRevenue": round(count * info["price"], 2),
+            "recentUsers": group.get("recentUsers", []),
+        })
+
+    # Sort by price (free first, then ascending)
+    plan_breakdown.sort(key=lambda x: (x["price"] == 0, x["price"]))
+
+    # Calculate MRR (Monthly Recurring Revenue)
+    total_mrr = sum(p["monthlyRevenue"] for p in plan_breakdown)
+
+    return {
+        "totalUsers": total_users,
+        "totalMRR": round(total_mrr, 2),
+        "breakdown": plan_breakdown,
+    }
+
+
+async def get_cached_plan_breakdown() -> dict:
+    return await plan_breakdown_cache.get_or_load(_CACHE_KEY, compute_plan_breakdown)
+
+
+def invalidate_plan_breakdown():
+    plan_breakdown_cache.invalidate(_CACHE_KEY)
+
+
+async def ensure_subscription_indexes():
+    await db.subscriptions.create_index([("userId", ASCENDING)])
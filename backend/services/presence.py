@@ -0,0 +1,109 @@
+# Collaboration Presence Registry
+# Indexes live WebSocket connections by lesson room, user and socket so that
+# joins, leaves and "who is here" lookups never scan a whole room.
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class PresenceEntry:
+    """A single WebSocket connection (one browser tab) in a lesson room"""
+    __slots__ = ("lesson_id", "user_id", "user_name", "connected_at", "last_seen")
+
+    def __init__(self, lesson_id: str, user_id: str, user_name: str):
+        self.lesson_id = lesson_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+
+
+class PresenceRegistry:
+    """
+    Membership index for lesson collaboration rooms.
+
+    - rooms:   lesson_id -> user_id -> set of sockets (one per open tab)
+    - entries: socket -> PresenceEntry
+
+    Every operation is O(1) except active_users/sockets, which are
+    proportional to the size of the answer rather than the room history.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Dict[str, Set]] = {}
+        self.entries: Dict[object, PresenceEntry] = {}
+
+    def add(self, websocket, lesson_id: str, user_id: str, user_name: str) -> bool:
+        """Register a socket. Returns True if this is the user's first tab in the room."""
+        entry = PresenceEntry(lesson_id, user_id, user_name)
+        self.entries[websocket] = entry
+
+        members = self.rooms.setdefault(lesson_id, {})
+        tabs = members.get(user_id)
+        first_tab = not tabs
+        if first_tab:
+            tabs = members[user_id] = set()
+        tabs.add(websocket)
+        return first_tab
+
+    def remove(self, websocket) -> Tuple[Optional[PresenceEntry], bool]:
+        """
+        Unregister a socket.
+        Returns (entry, last_tab) where last_tab is True when the user has no
+        other open tabs in the room. entry is None if the socket was unknown.
+        """
+        entry = self.entries.pop(websocket, None)
+        if entry is None:
+            return None, False
+
+        members = self.rooms.get(entry.lesson_id, {})
+        tabs = members.get(entry.user_id)
+        last_tab = True
+        if tabs is not None:
+            tabs.discard(websocket)
+            last_tab = not tabs
+            if last_tab:
+                del members[entry.user_id]
+        if not members:
+            self.rooms.pop(entry.lesson_id, None)
+        return entry, last_tab
+
+    def get(self, websocket) -> Optional[PresenceEntry]:
+        return self.entries.get(websocket)
+
+    def touch(self, websocket):
+        """Record activity on a socket (any inbound frame counts)"""
+        entry = self.entries.get(websocket)
+        if entry is not None:
+            entry.last_seen = time.monotonic()
+
+    def sockets(self, lesson_id: str) -> List:
+        """All sockets in a room, across every user and tab"""
+        members = self.rooms.get(lesson_id)
+        if not members:
+            return []
+        return [ws for tabs in members.values() for ws in tabs]
+
+    def active_users(self, lesson_id: str) -> List[dict]:
+        """Distinct users in a room (multi-tab users appear once)"""
+        members = self.rooms.get(lesson_id)
+        if not members:
+            return []
+        users = []
+        for user_id, tabs in members.items():
+            # Any tab carries the display name; they all belong to the same user
+            entry = self.entries[next(iter(tabs))]
+            users.append({"userId": user_id, "userName": entry.user_name, "tabs": len(tabs)})
+        return users
+
+    def connection_count(self, lesson_id: str) -> int:
+        members = self.rooms.get(lesson_id)
+        if not members:
+            return 0
+        return sum(len(tabs) for tabs in members.values())
+
+    def idle_since(self, cutoff: float) -> List:
+        """Sockets whose last activity is older than the monotonic cutoff"""
+        return [ws for ws, entry in self.entries.items() if entry.last_seen < cutoff]
+
+    def __len__(self) -> int:
+        return len(self.entries)
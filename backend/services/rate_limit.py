@@ -0,0 +1,50 @@
+# Rate Limiting
+# Token buckets used to smooth out bursts (WebSocket reconnect storms,
+# outbound email) without rejecting traffic that could simply wait a moment.
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available"""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0, max_wait: float = 0.0) -> bool:
+        """
+        Take tokens, sleeping (with jitter) up to max_wait seconds for them.
+        Returns False if they could not be obtained in time.
+        """
+        deadline = time.monotonic() + max_wait
+        while not self.try_acquire(tokens):
+            wait = self.wait_time(tokens)
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                return False
+            # Jitter spreads waiting callers out instead of waking them together
+            await asyncio.sleep(wait + random.uniform(0, min(0.25, remaining - wait)))
+        return True
@@ -0,0 +1,363 @@
+# Similar Lesson Recommendations
+# Each lesson gets a small hashed TF-IDF vector built from its title, theme,
+# description, passage (book and chapter features via services.scripture) and
+# section text. Raw term-frequency vectors are stored as float16 in the
+# lesson_vectors collection; in memory all lessons live in one float32 matrix
+# of IDF-weighted, L2-normalised rows, so "more like this" is a single
+# matrix-vector product plus argpartition.
+import asyncio
+import logging
+import math
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+from services.database import db
+from services.lesson_storage import lesson_sections
+from services.scripture import decode, parse_reference
+from services.search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = 512
+# Added to the cosine score of lessons for the same age group
+AGE_GROUP_BOOST = 0.1
+
+# The refresh query uses the lessons updatedAt/createdAt indexes created
+# with the search index (ensure_search_indexes)
+REFRESH_INTERVAL = 60
+REBUILD_INTERVAL = 30 * 60
+
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "theme": 2.0,
+    "description": 1.0,
+    "memoryVerseReference": 1.0,
+}
+SECTION_WEIGHT = 0.5
+BOOK_WEIGHT = 2.0
+CHAPTER_WEIGHT = 2.0
+
+SOURCE_PROJECTION = {
+    "_id": 0, "id": 1, "ageGroup": 1, "passage": 1, "sectionsJson": 1,
+    "createdAt": 1, "updatedAt": 1, **{field: 1 for field in FIELD_WEIGHTS},
+}
+
+
+def _bucket(feature: str):
+    """Stable (index, sign) for a feature; the sign bit halves collision bias"""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % DIMENSIONS, (1.0 if h & 0x80000000 else -1.0)
+
+
+def term_vector(lesson: dict) -> np.ndarray:
+    """Sublinear term-frequency vector for a lesson (before IDF weighting)"""
+    counts: Dict[str, float] = {}
+
+    def add(feature: str, weight: float):
+        counts[feature] = counts.get(feature, 0.0) + weight
+
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(lesson.get(field)):
+            add(token, weight)
+    for section in lesson_sections(lesson):
+        if isinstance(section, dict):
+            for token in tokenize(f"{section.get('title', '')} {section.get('content', '')}"):
+                add(token, SECTION_WEIGHT)
+    for start, end in parse_reference(lesson.get("passage") or ""):
+        book, chapter, _ = decode(start)
+        add(f"#book:{book}", BOOK_WEIGHT)
+        if chapter and decode(end)[1] == chapter:
+            add(f"#chapter:{book}:{chapter}", CHAPTER_WEIGHT)
+
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for feature, count in counts.items():
+        index, sign = _bucket(feature)
+        vector[index] += sign * (1.0 + math.log(count)) if count >= 1 else sign * count
+    return vector
+
+
+def _lesson_watermark(lesson: dict) -> str:
+    return max(lesson.get("updatedAt") or "", lesson.get("createdAt") or "")
+
+
+def _vector_doc(lesson: dict, tf: np.ndarray) -> dict:
+    """lesson_vectors fields; the raw vector is stored as float16 bytes"""
+    return {
+        "vector": tf.astype(np.float16).tobytes(),
+        "dim": DIMENSIONS,
+        "ageGroup": lesson.get("ageGroup"),
+        "sourceUpdatedAt": _lesson_watermark(lesson),
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+class SimilarityIndex:
+    """All lesson vectors in one matrix, with incremental row updates"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        # Age groups as small integer codes (0 = none) so filtering is vectorized
+        self.age_codes = np.zeros(0, dtype=np.int32)
+        self._age_code_map: Dict[str, int] = {}
+        self.tf = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.matrix = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.df = np.zeros(DIMENSIONS, dtype=np.float64)
+        self.idf = np.ones(DIMENSIONS, dtype=np.float32)
+        self.watermark = ""
+        self.built = False
+        self.built_at = 0.0
+        self._build_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---- matrix maintenance ------------------------------------------------
+
+    def _weighted(self, tf: np.ndarray) -> np.ndarray:
+        row = tf * self.idf
+        norm = np.linalg.norm(row)
+        return row / norm if norm else row
+
+    def _recompute_idf(self):
+        n = len(self.ids)
+        self.idf = (np.log((1 + n) / (1 + self.df)) + 1).astype(np.float32)
+
+    def _reweight_all(self):
+        self._recompute_idf()
+        weighted = self.tf[:len(self.ids)] * self.idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.matrix[:len(self.ids)] = weighted / norms
+
+    def _ensure_capacity(self, size: int):
+        if size <= self.tf.shape[0]:
+            return
+        capacity = max(size, self.tf.shape[0] * 2, 64)
+        for name in ("tf", "matrix"):
+            grown = np.zeros((capacity, DIMENSIONS), dtype=np.float32)
+            current = getattr(self, name)
+            grown[:current.shape[0]] = current
+            setattr(self, name, grown)
+        codes = np.zeros(capacity, dtype=np.int32)
+        codes[:self.age_codes.shape[0]] = self.age_codes
+        self.age_codes = codes
+
+    def _age_code(self, age_group: Optional[str]) -> int:
+        if not age_group:
+            return 0
+        return self._age_code_map.setdefault(age_group, len(self._age_code_map) + 1)
+
+    def put(self, lesson_id: str, tf: np.ndarray, age_group: Optional[str]):
+        """Insert or replace a lesson's vector"""
+        row = self.rows.get(lesson_id)
+        if row is None:
+            row = len(self.ids)
+            self._ensure_capacity(row + 1)
+            self.ids.append(lesson_id)
+            self.rows[lesson_id] = row
+        else:
+            self.df -= self.tf[row] != 0
+        self.age_codes[row] = self._age_code(age_group)
+        self.tf[row] = tf
+        self.df += tf != 0
+        self.matrix[row] = self._weighted(tf)
+
+    def remove(self, lesson_id: str):
+        row = self.rows.pop(lesson_id, None)
+        if row is None:
+            return
+        self.df -= self.tf[row] != 0
+        last = len(self.ids) - 1
+        if row != last:
+            # Move the last row into the hole
+            moved = self.ids[last]
+            self.tf[row] = self.tf[last]
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = moved
+            self.age_codes[row] = self.age_codes[last]
+            self.rows[moved] = row
+        self.ids.pop()
+        self.age_codes[last] = 0
+        self.tf[last] = 0
+        self.matrix[last] = 0
+
+    # ---- queries -----------------------------------------------------------
+
+    def similar(self, lesson_id: str, limit: int = 5, age_group: Optional[str] = None) -> List[tuple]:
+        """Top `limit` (lesson_id, score) pairs most similar to a lesson"""
+        row = self.rows.get(lesson_id)
+        n = len(self.ids)
+        if row is None or n < 2:
+            return []
+
+        scores = self.matrix[:n] @ self.matrix[row]
+        ages = self.age_codes[:n]
+        own_age = ages[row]
+        if own_age:
+            scores += AGE_GROUP_BOOST * (ages == own_age)
+        if age_group:
+            scores[ages != self._age_code_map.get(age_group, -1)] = -np.inf
+        scores[row] = -np.inf
+
+        k = min(limit, n - 1)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if np.isfinite(scores[i]) and scores[i] > 0]
+
+    # ---- persistence -------------------------------------------------------
+
+    async def update_lesson(self, lesson: dict):
+        """Recompute, store and index the vector for one lesson"""
+        lesson_id = lesson.get("id")
+        if not lesson_id:
+            return
+        tf = term_vector(lesson)
+        self.put(lesson_id, tf, lesson.get("ageGroup"))
+        try:
+            await db.lesson_vectors.update_one(
+                {"lessonId": lesson_id}, {"$set": _vector_doc(lesson, tf)}, upsert=True
+            )
+        except Exception as e:
+            # The next rebuild recomputes it; never fail the lesson write over this
+            logger.error(f"[Recommendations] Could not store vector for {lesson_id}: {e}")
+
+    async def delete_lesson(self, lesson_id: str):
+        self.remove(lesson_id)
+        try:
+            await db.lesson_vectors.delete_one({"lessonId": lesson_id})
+        except Exception as e:
+            logger.error(f"[Recommendations] Could not delete vector for {lesson_id}: {e}")
+
+    async def rebuild(self):
+        """
+        Load every stored vector, compute vectors for lessons that are new or
+        changed since theirs was stored, and drop vectors of deleted lessons.
+        """
+        fresh = SimilarityIndex()
+        stored = {}
+        async for doc in db.lesson_vectors.find({"dim": DIMENSIONS}, {"_id": 0}).batch_size(1000):
+            stored[doc["lessonId"]] = doc
+
+        stale = []
+        seen = set()
+        async for lesson in db.lessons.find({}, {"_id": 0, "id": 1, "ageGroup": 1, "createdAt": 1, "updatedAt": 1}).batch_size(1000):
+            lesson_id = lesson["id"]
+            seen.add(lesson_id)
+            watermark = _lesson_watermark(lesson)
+            fresh.watermark = max(fresh.watermark, watermark)
+            doc = stored.get(lesson_id)
+            if doc is None or doc.get("sourceUpdatedAt", "") < watermark:
+                stale.append(lesson_id)
+                continue
+            tf = np.frombuffer(doc["vector"], dtype=np.float16).astype(np.float32)
+            fresh.put(lesson_id, tf, lesson.get("ageGroup"))
+
+        for i in range(0, len(stale), 500):
+            batch = await db.lessons.find({"id": {"$in": stale[i:i + 500]}}, SOURCE_PROJECTION).to_list(500)
+            operations = []
+            for lesson in batch:
+                tf = term_vector(lesson)
+                fresh.put(lesson["id"], tf, lesson.get("ageGroup"))
+                operations.append(UpdateOne(
+                    {"lessonId": lesson["id"]}, {"$set": _vector_doc(lesson, tf)}, upsert=True
+                ))
+            if operations:
+                await db.lesson_vectors.bulk_write(operations, ordered=False)
+
+        orphaned = [lesson_id for lesson_id in stored if lesson_id not in seen]
+        if orphaned:
+            await db.lesson_vectors.delete_many({"lessonId": {"$in": orphaned}})
+
+        fresh._reweight_all()
+        for name in ("ids", "rows", "age_codes", "_age_code_map", "tf", "matrix", "df", "idf", "watermark"):
+            setattr(self, name, getattr(fresh, name))
+        self.built = True
+        self.built_at = time.monotonic()
+        logger.info(f"[Recommendations] Index built: {len(self.ids)} lessons ({len(stale)} vectors computed)")
+
+    async def refresh(self):
+        """Re-vector lessons created or edited since the watermark (any process)"""
+        if not self.watermark:
+            return await self.rebuild()
+        cursor = db.lessons.find(
+            {"$or": [
+                {"updatedAt": {"$gt": self.watermark}},
+                {"createdAt": {"$gt": self.watermark}},
+            ]},
+            SOURCE_PROJECTION
+        )
+        changed = False
+        async for lesson in cursor:
+            self.watermark = max(self.watermark, _lesson_watermark(lesson))
+            await self.update_lesson(lesson)
+            changed = True
+        if changed:
+            # Document frequencies moved; bring every row onto the new IDF
+            self._reweight_all()
+
+    async def ensure_built(self):
+        if self.built:
+            return
+        async with self._build_lock:
+            if not self.built:
+                await self.rebuild()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                if time.monotonic() - self.built_at >= REBUILD_INTERVAL:
+                    await self.rebuild()
+                else:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"[Recommendations] Index refresh failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+similarity_index = SimilarityIndex()
+
+
+async def ensure_vector_indexes():
+    await db.lesson_vectors.create_index([("lessonId", ASCENDING)], unique=True)
+
+
+async def similar_lessons(lesson_id: str, limit: int = 5, age_group: Optional[str] = None) -> Optional[List[dict]]:
+    """
+    Lessons most similar to `lesson_id`, best first, or None if the lesson
+    is unknown.
+    """
+    await similarity_index.ensure_built()
+    if lesson_id not in similarity_index.rows:
+        lesson = await db.lessons.find_one({"id": lesson_id}, SOURCE_PROJECTION)
+        if not lesson:
+            return None
+        await similarity_index.update_lesson(lesson)
+
+    ranked = similarity_index.similar(lesson_id, limit, age_group)
+    if not ranked:
+        return []
+    lessons = await db.lessons.find(
+        {"id": {"$in": [lesson_id for lesson_id, _ in ranked]}},
+        {"_id": 0, "id": 1, "title": 1, "passage": 1, "ageGroup": 1, "theme": 1, "duration": 1}
+    ).to_list(len(ranked))
+    by_id = {lesson["id"]: lesson for lesson in lessons}
+    return [
+        {**by_id[lesson_id], "score": round(score, 4)}
+        for lesson_id, score in ranked if lesson_id in by_id
+    ]
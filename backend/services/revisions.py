@@ -0,0 +1,255 @@
+# Lesson Revision History
+# Every content change to a lesson is stored as a revision. Most revisions are
+# compact deltas (changed top-level fields plus changed sections by index);
+# every SNAPSHOT_INTERVAL-th revision is a full snapshot, so rebuilding any
+# version reads one snapshot and at most SNAPSHOT_INTERVAL - 1 deltas.
+from datetime import datetime, timezone
+from typing import Optional
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from services.database import db
+from services.lesson_storage import to_native
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 25
+MAX_INSERT_ATTEMPTS = 3
+
+# Lesson fields that make up a version. Bookkeeping fields (favorite,
+# createdAt, updatedAt, ...) are deliberately not versioned.
+TRACKED_FIELDS = [
+    "title",
+    "passage",
+    "ageGroup",
+    "duration",
+    "format",
+    "theme",
+    "memoryVerseText",
+    "memoryVerseReference",
+    "objectives",
+    "sectionsJson",
+    "materialsJson",
+    "crossReferencesJson",
+    "configJson",
+    "description",
+]
+SECTIONS_FIELD = "sectionsJson"
+
+
+def extract_state(lesson: dict) -> dict:
+    """The versioned part of a lesson, with structured fields in native form"""
+    return to_native({field: lesson[field] for field in TRACKED_FIELDS if field in lesson})
+
+
+def compute_delta(before: dict, after: dict) -> Optional[dict]:
+    """Describe how to turn state `before` into state `after`, or None if equal"""
+    changes = {}
+    removed = []
+    for field in TRACKED_FIELDS:
+        if field == SECTIONS_FIELD:
+            continue
+        if field in after:
+            if before.get(field) != after[field] or field not in before:
+                changes[field] = after[field]
+        elif field in before:
+            removed.append(field)
+
+    sections_delta = None
+    old_sections = before.get(SECTIONS_FIELD, [])
+    new_sections = after.get(SECTIONS_FIELD, [])
+    if old_sections != new_sections:
+        sections_delta = {
+            "length": len(new_sections),
+            # BSON keys must be strings
+            "set": {
+                str(i): section
+                for i, section in enumerate(new_sections)
+                if i >= len(old_sections) or old_sections[i] != section
+            },
+        }
+
+    if not changes and not removed and sections_delta is None:
+        return None
+    return {"changes": changes, "removed": removed, "sections": sections_delta}
+
+
+def apply_delta(state: dict, revision: dict) -> dict:
+    state = dict(state)
+    state.update(revision.get("changes") or {})
+    for field in revision.get("removed") or []:
+        state.pop(field, None)
+
+    sections_delta = revision.get("sections")
+    if sections_delta is not None:
+        sections = list(state.get(SECTIONS_FIELD, []))[:sections_delta["length"]]
+        sections.extend([None] * (sections_delta["length"] - len(sections)))
+        for index, section in sections_delta["set"].items():
+            sections[int(index)] = section
+        state[SECTIONS_FIELD] = sections
+    return state
+
+
+def _summary(delta: dict) -> dict:
+    """Cheap-to-list description of what a revision touched"""
+    fields = list(delta["changes"]) + delta["removed"]
+    section_indexes = []
+    if delta["sections"] is not None:
+        fields.append(SECTIONS_FIELD)
+        section_indexes = sorted(int(i) for i in delta["sections"]["set"])
+    return {"fields": fields, "sectionIndexes": section_indexes}
+
+
+async def ensure_revision_indexes():
+    await db.lesson_revisions.create_index(
+        [("lessonId", ASCENDING), ("rev", DESCENDING)], unique=True
+    )
+    await db.lesson_revisions.create_index(
+        [("lessonId", ASCENDING), ("kind", ASCENDING), ("rev", DESCENDING)]
+    )
+
+
+async def head_revision(lesson_id: str) -> int:
+    """Latest revision number of a lesson (0 if it has no history yet)"""
+    head = await db.lesson_revisions.find_one(
+        {"lessonId": lesson_id}, {"_id": 0, "rev": 1}, sort=[("rev", DESCENDING)]
+    )
+    return head["rev"] if head else 0
+
+
+def _base_doc(lesson_id: str, rev: int, user_id: Optional[str], source: str) -> dict:
+    return {
+        "lessonId": lesson_id,
+        "rev": rev,
+        "userId": user_id,
+        "source": source,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def record_initial_revision(lesson: dict, user_id: Optional[str] = None, source: str = "create"):
+    """Store revision 1 (a snapshot) for a newly created lesson"""
+    doc = _base_doc(lesson["id"], 1, user_id, source)
+    doc.update({"kind": "snapshot", "state": extract_state(lesson), "fields": [], "sectionIndexes": []})
+    try:
+        await db.lesson_revisions.insert_one(doc)
+    except DuplicateKeyError:
+        pass
+
+
+async def record_revision(
+    lesson_id: str,
+    before: dict,
+    after: dict,
+    user_id: Optional[str] = None,
+    source: str = "update",
+    **extra
+) -> Optional[int]:
+    """
+    Record the change from lesson document `before` to `after`.
+    Returns the new revision number, or None if no versioned field changed.
+    """
+    before_state = extract_state(before)
+    after_state = extract_state(after)
+    delta = compute_delta(before_state, after_state)
+    if delta is None:
+        return None
+
+    for _ in range(MAX_INSERT_ATTEMPTS):
+        head = await head_revision(lesson_id)
+        if head == 0:
+            # Lesson predates revision history - baseline it first
+            await record_initial_revision({"id": lesson_id, **before}, source="baseline")
+            head = 1
+
+        rev = head + 1
+        doc = _base_doc(lesson_id, rev, user_id, source)
+        doc.update(_summary(delta))
+        doc.update(extra)
+        if (rev - 1) % SNAPSHOT_INTERVAL == 0:
+            doc.update({"kind": "snapshot", "state": after_state})
+        else:
+            doc.update({"kind": "delta", **delta})
+
+        try:
+            await db.lesson_revisions.insert_one(doc)
+            return rev
+        except DuplicateKeyError:
+            # Another writer took this revision number; retry on the new head
+            continue
+
+    logger.error(f"Could not record revision for lesson {lesson_id}")
+    return None
+
+
+async def delete_revisions(lesson_id: str) -> int:
+    """Drop a deleted lesson's history"""
+    result = await db.lesson_revisions.delete_many({"lessonId": lesson_id})
+    return result.deleted_count
+
+
+async def get_revision_state(lesson_id: str, rev: int) -> Optional[dict]:
+    """Rebuild the lesson state at `rev` from the nearest snapshot"""
+    snapshot = await db.lesson_revisions.find_one(
+        {"lessonId": lesson_id, "kind": "snapshot", "rev": {"$lte": rev}},
+        {"_id": 0, "rev": 1, "state": 1},
+        sort=[("rev", DESCENDING)]
+    )
+    if not snapshot:
+        return None
+
+    state = snapshot["state"]
+    if snapshot["rev"] == rev:
+        return state
+
+    deltas = db.lesson_revisions.find(
+        {"lessonId": lesson_id, "rev": {"$gt": snapshot["rev"], "$lte": rev}},
+        {"_id": 0, "rev": 1, "kind": 1, "state": 1, "changes": 1, "removed": 1, "sections": 1}
+    ).sort("rev", ASCENDING)
+
+    found = snapshot["rev"]
+    async for revision in deltas:
+        state = revision["state"] if revision["kind"] == "snapshot" else apply_delta(state, revision)
+        found = revision["rev"]
+    return state if found == rev else None
+
+
+async def list_revisions(lesson_id: str, limit: int = 50, before: Optional[int] = None) -> list:
+    query = {"lessonId": lesson_id}
+    if before is not None:
+        query["rev"] = {"$lt": before}
+    cursor = db.lesson_revisions.find(
+        query,
+        {"_id": 0, "rev": 1, "kind": 1, "source": 1, "userId": 1, "createdAt": 1,
+         "fields": 1, "sectionIndexes": 1, "restoredFrom": 1}
+    ).sort("rev", DESCENDING).limit(limit)
+    return await cursor.to_list(limit)
+
+
+def diff_states(old: dict, new: dict) -> dict:
+    fields = {}
+    for field in TRACKED_FIELDS:
+        if field == SECTIONS_FIELD:
+            continue
+        if old.get(field) != new.get(field):
+            fields[field] = {"from": old.get(field), "to": new.get(field)}
+
+    sections = []
+    old_sections = old.get(SECTIONS_FIELD, [])
+    new_sections = new.get(SECTIONS_FIELD, [])
+    for i in range(max(len(old_sections), len(new_sections))):
+        if i >= len(old_sections):
+            sections.append({"index": i, "change": "added", "to": new_sections[i]})
+        elif i >= len(new_sections):
+            sections.append({"index": i, "change": "removed", "from": old_sections[i]})
+        elif old_sections[i] != new_sections[i]:
+            sections.append({"index": i, "change": "modified", "from": old_sections[i], "to": new_sections[i]})
+
+    return {"fields": fields, "sections": sections}
+
+
+def state_to_lesson_fields(state: dict) -> dict:
+    """Convert a revision state back into lesson document fields"""
+    return to_native(state)
@@ -0,0 +1,194 @@
+# Scheduled Jobs
+# Cron-style jobs that run once per cluster. Every worker runs the ticker,
+# but only the holder of the "scheduler" lease (services.leader) fires jobs,
+# and each fire time is claimed in the scheduled_jobs collection before it
+# runs, so a leadership hand-over can't run the same slot twice:
+#   {_id: job id, name, lastFireAt, claimedBy, claimedAt, lastStatus,
+#    lastFinishedAt, lastDurationMs, nextRunAt}
+# A fire time missed while no leader was up (deploys, crashes) is caught up
+# on the next tick, as long as it is within the job's catch-up window.
+# Every run is also logged to job_runs.
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from services.database import db
+from services.leader import LeaderLease
+
+logger = logging.getLogger(__name__)
+
+TICK_INTERVAL = 15
+JOB_RUN_RETENTION_DAYS = 90
+DEFAULT_CATCH_UP = timedelta(hours=12)
+
+
+class ScheduledJob:
+    def __init__(
+        self,
+        job_id: str,
+        name: str,
+        func: Callable[[], Awaitable[Optional[dict]]],
+        trigger,
+        catch_up: timedelta = DEFAULT_CATCH_UP,
+    ):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.catch_up = catch_up
+
+    def latest_fire_time(self, now: datetime) -> Optional[datetime]:
+        """Most recent fire time at or before now, within the catch-up window"""
+        latest = None
+        fire = self.trigger.get_next_fire_time(None, now - self.catch_up)
+        while fire is not None and fire <= now:
+            latest = fire
+            fire = self.trigger.get_next_fire_time(fire, fire + timedelta(microseconds=1))
+        return latest
+
+    def next_fire_time(self, now: datetime) -> Optional[datetime]:
+        return self.trigger.get_next_fire_time(None, now + timedelta(microseconds=1))
+
+
+async def record_job_run(job: str, started: datetime, status: str, error: Optional[str] = None, **details):
+    """Keep a history of scheduled job runs (duration and outcome)"""
+    finished = datetime.now(timezone.utc)
+    try:
+        await db.job_runs.insert_one({
+            "job": job,
+            "status": status,
+            "startedAt": started.isoformat(),
+            "finishedAt": finished.isoformat(),
+            "durationMs": round((finished - started).total_seconds() * 1000),
+            "error": error,
+            "details": details,
+            "expiresAt": finished + timedelta(days=JOB_RUN_RETENTION_DAYS),
+        })
+    except Exception as e:
+        logger.error(f"[Jobs] Failed to record {job} run: {e}")
+
+
+class JobRunner:
+    def __init__(self):
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.lease = LeaderLease("scheduler")
+        self._initialized: set = set()
+        self._running: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, job: ScheduledJob):
+        self.jobs[job.id] = job
+
+    async def _initialize(self, job: ScheduledJob, now: datetime):
+        """
+        First sighting of a job in the store: treat its latest slot as done,
+        so deploying a new job doesn't fire it immediately.
+        """
+        await db.scheduled_jobs.update_one(
+            {"_id": job.id},
+            {"$setOnInsert": {
+                "name": job.name,
+                "lastFireAt": job.latest_fire_time(now),
+                "nextRunAt": job.next_fire_time(now),
+            }},
+            upsert=True
+        )
+        self._initialized.add(job.id)
+
+    async def _claim(self, job: ScheduledJob, fire_at: datetime, now: datetime) -> bool:
+        """Mark this fire time as taken; True if we got it"""
+        try:
+            result = await db.scheduled_jobs.update_one(
+                {
+                    "_id": job.id,
+                    "$or": [{"lastFireAt": {"$lt": fire_at}}, {"lastFireAt": None}],
+                },
+                {"$set": {
+                    "name": job.name,
+                    "lastFireAt": fire_at,
+                    "claimedBy": self.lease.holder,
+                    "claimedAt": now,
+                    "nextRunAt": job.next_fire_time(now),
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return result.modified_count == 1 or result.upserted_id is not None
+
+    async def _run(self, job: ScheduledJob, fire_at: datetime):
+        started = datetime.now(timezone.utc)
+        logger.info(f"[Jobs] Running {job.id} for {fire_at.isoformat()}")
+        try:
+            result = await job.func() or {}
+            status = result.pop("status", "success")
+            error = None
+        except Exception as e:
+            logger.error(f"[Jobs] {job.id} failed: {e}")
+            result, status, error = {}, "failed", str(e)
+
+        await record_job_run(job.id, started, status, error=error, fireAt=fire_at.isoformat(), **result)
+        finished = datetime.now(timezone.utc)
+        try:
+            await db.scheduled_jobs.update_one({"_id": job.id}, {"$set": {
+                "lastStatus": status,
+                "lastError": error,
+                "lastFinishedAt": finished,
+                "lastDurationMs": round((finished - started).total_seconds() * 1000),
+            }})
+        except Exception as e:
+            logger.error(f"[Jobs] Failed to update {job.id} state: {e}")
+
+    async def tick(self):
+        if not self.lease.is_leader:
+            return
+        now = datetime.now(timezone.utc)
+        for job in self.jobs.values():
+            if job.id in self._running:
+                continue
+            try:
+                if job.id not in self._initialized:
+                    await self._initialize(job, now)
+                fire_at = job.latest_fire_time(now)
+                if fire_at is None or not await self._claim(job, fire_at, now):
+                    continue
+            except Exception as e:
+                logger.error(f"[Jobs] Failed to schedule {job.id}: {e}")
+                continue
+            task = asyncio.get_running_loop().create_task(self._run(job, fire_at))
+            self._running[job.id] = task
+            task.add_done_callback(lambda _, job_id=job.id: self._running.pop(job_id, None))
+
+    # ---- ticker ----------------------------------------------------------------
+
+    async def _tick_loop(self):
+        while True:
+            try:
+                await self.lease.try_acquire()
+                await self.tick()
+            except Exception as e:
+                logger.error(f"[Jobs] Tick failed: {e}")
+            await asyncio.sleep(TICK_INTERVAL)
+
+    def start(self):
+        # The tick loop doubles as the lease heartbeat (TICK_INTERVAL < LEASE_TTL)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._tick_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.lease.release()
+
+
+job_runner = JobRunner()
+
+
+async def ensure_job_indexes():
+    await db.job_runs.create_index([("job", ASCENDING), ("startedAt", DESCENDING)])
+    await db.job_runs.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
@@ -0,0 +1,326 @@
+# Scripture References
+# Parses free-text passages ("John 3:16-18", "Gen 1", "1 Cor. 13",
+# "Exodus 14–15; Ps 23") into canonical verse ranges. Each position is encoded
+# as a single integer  book * 1_000_000 + chapter * 1_000 + verse  so a range
+# is a plain (start, end) pair and "does this lesson cover Romans 8:28?" is an
+# interval-overlap query that MongoDB can answer from an index.
+#
+# Ranges never cross a book boundary, which lets overlap queries bound the
+# index scan to a single book.
+#
+# Backfill existing lessons (a one-time migration, like
+# services.lesson_storage; startup doesn't run it):
+#   python -m services.scripture --batch-size 500
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+BOOK_FACTOR = 1_000_000
+CHAPTER_FACTOR = 1_000
+MAX_CHAPTER = 999
+MAX_VERSE = 999
+
+# Canonical order (Protestant canon) with common abbreviations. Any unique
+# prefix of at least three letters of a canonical name is also accepted.
+BOOKS: List[Tuple[str, List[str]]] = [
+    ("Genesis", ["gn", "ge", "gen"]),
+    ("Exodus", ["ex", "exo", "exod"]),
+    ("Leviticus", ["lv", "le", "lev"]),
+    ("Numbers", ["nm", "nu", "num"]),
+    ("Deuteronomy", ["dt", "deut"]),
+    ("Joshua", ["jos", "josh"]),
+    ("Judges", ["jdg", "jdgs", "judg"]),
+    ("Ruth", ["ru", "rth"]),
+    ("1 Samuel", ["1sa", "1sm", "1sam"]),
+    ("2 Samuel", ["2sa", "2sm", "2sam"]),
+    ("1 Kings", ["1ki", "1kgs", "1kg"]),
+    ("2 Kings", ["2ki", "2kgs", "2kg"]),
+    ("1 Chronicles", ["1ch", "1chr", "1chron"]),
+    ("2 Chronicles", ["2ch", "2chr", "2chron"]),
+    ("Ezra", ["ezr"]),
+    ("Nehemiah", ["ne", "neh"]),
+    ("Esther", ["es", "est", "esth"]),
+    ("Job", ["jb"]),
+    ("Psalms", ["ps", "psa", "pss", "psalm", "psm"]),
+    ("Proverbs", ["pr", "prv", "prov"]),
+    ("Ecclesiastes", ["ec", "ecc", "eccl", "qoh"]),
+    ("Song of Solomon", ["sos", "song", "songofsongs", "canticles", "cant"]),
+    ("Isaiah", ["is", "isa"]),
+    ("Jeremiah", ["je", "jer", "jr"]),
+    ("Lamentations", ["la", "lam"]),
+    ("Ezekiel", ["ezk", "eze", "ezek"]),
+    ("Daniel", ["dn", "da", "dan"]),
+    ("Hosea", ["ho", "hos"]),
+    ("Joel", ["jl", "joe"]),
+    ("Amos", ["am"]),
+    ("Obadiah", ["ob", "oba", "obad"]),
+    ("Jonah", ["jnh", "jon"]),
+    ("Micah", ["mi", "mic"]),
+    ("Nahum", ["na", "nah"]),
+    ("Habakkuk", ["hb", "hab"]),
+    ("Zephaniah", ["zp", "zep", "zeph"]),
+    ("Haggai", ["hg", "hag"]),
+    ("Zechariah", ["zc", "zec", "zech"]),
+    ("Malachi", ["ml", "mal"]),
+    ("Matthew", ["mt", "mat", "matt"]),
+    ("Mark", ["mk", "mr", "mrk"]),
+    ("Luke", ["lk", "luk"]),
+    ("John", ["jn", "jhn", "joh"]),
+    ("Acts", ["ac", "act"]),
+    ("Romans", ["ro", "rm", "rom"]),
+    ("1 Corinthians", ["1co", "1cor"]),
+    ("2 Corinthians", ["2co", "2cor"]),
+    ("Galatians", ["ga", "gal"]),
+    ("Ephesians", ["eph", "ephes"]),
+    ("Philippians", ["php", "phil", "pp"]),
+    ("Colossians", ["col"]),
+    ("1 Thessalonians", ["1th", "1thes", "1thess"]),
+    ("2 Thessalonians", ["2th", "2thes", "2thess"]),
+    ("1 Timothy", ["1ti", "1tm", "1tim"]),
+    ("2 Timothy", ["2ti", "2tm", "2tim"]),
+    ("Titus", ["ti", "tit"]),
+    ("Philemon", ["phm", "phlm", "philem"]),
+    ("Hebrews", ["he", "heb"]),
+    ("James", ["jas", "jm"]),
+    ("1 Peter", ["1pe", "1pt", "1pet"]),
+    ("2 Peter", ["2pe", "2pt", "2pet"]),
+    ("1 John", ["1jn", "1jo", "1jhn"]),
+    ("2 John", ["2jn", "2jo", "2jhn"]),
+    ("3 John", ["3jn", "3jo", "3jhn"]),
+    ("Jude", ["jud", "jd"]),
+    ("Revelation", ["re", "rev", "rv", "revelations"]),
+]
+
+# Books with a single chapter: "Jude 3" means verse 3
+SINGLE_CHAPTER_BOOKS = {"Obadiah", "Philemon", "2 John", "3 John", "Jude"}
+
+_NUMBER_PREFIXES = {
+    "1": "1", "i": "1", "first": "1", "1st": "1",
+    "2": "2", "ii": "2", "second": "2", "2nd": "2",
+    "3": "3", "iii": "3", "third": "3", "3rd": "3",
+}
+
+
+def _key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+BOOK_NUMBERS: Dict[str, int] = {name: i + 1 for i, (name, _) in enumerate(BOOKS)}
+BOOK_NAMES: Dict[int, str] = {number: name for name, number in BOOK_NUMBERS.items()}
+_CANONICAL_KEYS: Dict[str, int] = {_key(name): BOOK_NUMBERS[name] for name, _ in BOOKS}
+_ALIASES: Dict[str, int] = dict(_CANONICAL_KEYS)
+for _name, _aliases in BOOKS:
+    for _alias in _aliases:
+        _ALIASES[_alias] = BOOK_NUMBERS[_name]
+
+_BOOK_RE = re.compile(
+    r"^(?:(?P<num>[1-3](?:st|nd|rd)?|iii|ii|i|first|second|third)\s*(?=[a-z]))?"
+    r"(?P<name>[a-z]+(?:\s+of\s+[a-z]+)?)\s*"
+)
+_LOCATION_RE = re.compile(
+    r"^(?P<c1>\d+)(?::(?P<v1>\d+))?(?:-(?P<c2>\d+)(?::(?P<v2>\d+))?)?$"
+)
+
+
+def encode(book: int, chapter: int, verse: int) -> int:
+    return book * BOOK_FACTOR + chapter * CHAPTER_FACTOR + verse
+
+
+def decode(position: int) -> Tuple[int, int, int]:
+    return (
+        position // BOOK_FACTOR,
+        position % BOOK_FACTOR // CHAPTER_FACTOR,
+        position % CHAPTER_FACTOR,
+    )
+
+
+def resolve_book(text: str) -> Optional[int]:
+    """Book number for a name or abbreviation ("1 Cor", "Ps", "song of songs")"""
+    match = re.match(r"^\s*(\S+)\s+(.+)$", text.lower())
+    key = _key(text)
+    if match and match.group(1).rstrip(".") in _NUMBER_PREFIXES:
+        key = _NUMBER_PREFIXES[match.group(1).rstrip(".")] + _key(match.group(2))
+    if key in _ALIASES:
+        return _ALIASES[key]
+    if len(key.lstrip("123")) >= 3:
+        candidates = {number for name, number in _CANONICAL_KEYS.items() if name.startswith(key)}
+        if len(candidates) == 1:
+            return candidates.pop()
+    return None
+
+
+def _normalize(text: str) -> str:
+    text = re.sub(r"\([^)]*\)|\[[^\]]*\]", " ", text.lower())    # "(Christmas)", "[NIV]"
+    text = re.sub(r"[‐-―]", "-", text)          # en/em dashes
+    text = re.sub(r"(?<=\d)\.(?=\d)", ":", text)           # "3.16" -> "3:16"
+    text = re.sub(r"\bv{1,2}\.?\s*(?=\d)", "", text)       # "vv. 1-3" -> "1-3"
+    text = text.replace(".", " ")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _whole_book(book: int) -> Tuple[int, int]:
+    return encode(book, 0, 0), encode(book, MAX_CHAPTER, MAX_VERSE)
+
+
+def parse_reference(text: str) -> List[Tuple[int, int]]:
+    """
+    Parse a passage into a list of (start, end) positions. Pieces that can't
+    be understood are skipped, so a partly valid passage still gets ranges.
+    """
+    if not text or not isinstance(text, str):
+        return []
+
+    ranges: List[Tuple[int, int]] = []
+    book: Optional[int] = None
+    chapter: Optional[int] = None
+    in_verses = False   # whether a bare number continues a verse list
+
+    for part in _normalize(text).split(";"):
+        in_verses = False
+        for piece in part.split(","):
+            piece = piece.strip()
+            if not piece:
+                continue
+
+            # A piece starting with a name ("Ps", "1 Cor") names a book;
+            # otherwise it is a location in the current book
+            book_match = _BOOK_RE.match(piece)
+            if book_match:
+                candidate = resolve_book(book_match.group(0).strip())
+                if candidate is None:
+                    book = None
+                    continue
+                book, chapter, in_verses = candidate, None, False
+                piece = piece[book_match.end():].strip()
+                if not piece:
+                    ranges.append(_whole_book(book))
+                    continue
+
+            if book is None:
+                continue
+            # Drop anything after the numbers ("16a", "NIV")
+            location = _LOCATION_RE.match(re.sub(r"[^\d:\-].*$", "", piece.replace(" ", "")).rstrip(":-"))
+            if not location:
+                continue
+
+            c1, v1, c2, v2 = (int(g) if g else None for g in location.group("c1", "v1", "c2", "v2"))
+
+            if BOOK_NAMES[book] in SINGLE_CHAPTER_BOOKS and v1 is None:
+                # "Jude 3-7" - numbers are verses in chapter 1
+                c1, v1, c2, v2 = 1, c1, (1 if c2 is not None else None), c2
+            elif in_verses and v1 is None:
+                # "John 3:16, 18-20" - bare numbers continue the verse list
+                c1, v1, c2, v2 = chapter, c1, (chapter if c2 is not None else None), c2
+
+            if v1 is None:
+                # Whole chapter(s): "Exodus 14-15"
+                end_chapter = c2 if c2 is not None else c1
+                start, end = encode(book, c1, 0), encode(book, end_chapter, MAX_VERSE)
+                chapter, in_verses = end_chapter, False
+            elif c2 is None:
+                start = end = encode(book, c1, v1)
+                chapter, in_verses = c1, True
+            elif v2 is None:
+                # "John 3:16-18" - the number after the dash is a verse
+                start, end = encode(book, c1, v1), encode(book, c1, c2)
+                chapter, in_verses = c1, True
+            else:
+                start, end = encode(book, c1, v1), encode(book, c2, v2)
+                chapter, in_verses = c2, True
+
+            if c1 > MAX_CHAPTER or (v1 or 0) > MAX_VERSE or end < start:
+                continue
+            ranges.append((start, end))
+
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_range(start: int, end: int) -> str:
+    """Human readable form of an encoded range"""
+    book, c1, v1 = decode(start)
+    _, c2, v2 = decode(end)
+    name = BOOK_NAMES.get(book, "?")
+    if c1 == 0 and c2 == MAX_CHAPTER:
+        return name
+    if v1 == 0 and v2 == MAX_VERSE:
+        return f"{name} {c1}" if c1 == c2 else f"{name} {c1}-{c2}"
+    if c1 == c2:
+        return f"{name} {c1}:{v1}" if v1 == v2 else f"{name} {c1}:{v1}-{v2}"
+    return f"{name} {c1}:{v1}-{c2}:{v2}"
+
+
+def passage_ranges(passage: Optional[str]) -> List[dict]:
+    """The scriptureRanges value stored on a lesson"""
+    return [{"start": start, "end": end} for start, end in parse_reference(passage or "")]
+
+
+def overlap_query(ranges: List[Tuple[int, int]]) -> dict:
+    """
+    Mongo filter for lessons with a stored range overlapping any of `ranges`.
+    The lower bound on start is implied by ranges never crossing a book, and
+    keeps the index scan inside the queried book.
+    """
+    clauses = []
+    for start, end in ranges:
+        book_start = start - start % BOOK_FACTOR
+        clauses.append({"scriptureRanges": {"$elemMatch": {
+            "start": {"$gte": book_start, "$lte": end},
+            "end": {"$gte": start},
+        }}})
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+async def ensure_scripture_indexes():
+    await db.lessons.create_index(
+        [("scriptureRanges.start", ASCENDING), ("scriptureRanges.end", ASCENDING)]
+    )
+
+
+async def backfill_scripture_ranges(batch_size: int = 500) -> dict:
+    """Compute scriptureRanges for lessons that don't have them yet"""
+    query = {"scriptureRanges": {"$exists": False}}
+    last_id = None
+    scanned = 0
+
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        batch = await db.lessons.find(batch_query, {"passage": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        await db.lessons.bulk_write([
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"scriptureRanges": passage_ranges(doc.get("passage"))}})
+            for doc in batch
+        ], ordered=False)
+        scanned += len(batch)
+        last_id = batch[-1]["_id"]
+        logger.info(f"[Scripture] Backfilled {scanned} lessons")
+
+    return {"updated": scanned}
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Compute scriptureRanges for existing lessons")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(backfill_scripture_ranges(args.batch_size)))
@@ -0,0 +1,329 @@
+# Lesson Search Index
+# In-process inverted index over lesson titles, passages, topics and themes.
+# Replaces unanchored $regex scans: a search is a few dict lookups plus a
+# bisect over the sorted vocabulary for prefix matches, with edit-distance
+# fallback for typos.
+#
+# The index is updated directly on lesson writes in this process. Writes made
+# by other processes are picked up by a periodic refresh of lessons whose
+# updatedAt/createdAt is past the last watermark, and a slower full rebuild
+# drops lessons deleted elsewhere.
+import asyncio
+import logging
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 30          # seconds between watermark refreshes
+REBUILD_INTERVAL = 30 * 60     # seconds between full rebuilds
+
+# Field -> weight applied to each term occurrence
+FIELD_WEIGHTS = {
+    "title": 5.0,
+    "passage": 4.0,
+    "memoryVerseReference": 3.0,
+    "theme": 3.0,
+    "topic": 3.0,
+    "description": 1.0,
+}
+
+# Match quality multipliers
+EXACT_BOOST = 1.0
+PREFIX_BOOST = 0.6
+FUZZY_BOOST = 0.4
+
+MIN_FUZZY_LENGTH = 4
+MAX_PREFIX_EXPANSIONS = 50
+
+STOPWORDS = {"a", "an", "and", "the", "of", "to", "in", "on", "for", "is", "it", "with"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Only what the index needs is read from MongoDB
+INDEX_PROJECTION = {
+    "_id": 0, "id": 1, "userId": 1, "ageGroup": 1, "createdAt": 1, "updatedAt": 1,
+    **{field: 1 for field in FIELD_WEIGHTS},
+}
+
+
+def tokenize(text) -> List[str]:
+    if not text:
+        return []
+    if not isinstance(text, str):
+        text = str(text)
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein (optimal string alignment) distance, so a swapped
+    pair of letters counts as one edit; gives up early once it exceeds `limit`
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            )
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before_previous[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+def _lesson_watermark(lesson: dict) -> str:
+    return max(lesson.get("updatedAt") or "", lesson.get("createdAt") or "")
+
+
+class SearchIndex:
+    """Weighted inverted index of lessons, keyed by lesson id"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.doc_terms: Dict[str, Dict[str, float]] = {}
+        self.doc_meta: Dict[str, dict] = {}
+        self._vocabulary: Optional[List[str]] = None
+        self.watermark = ""
+        # Bumped whenever search results could change; used as a cache key
+        self.version = 0
+        self.built = False
+        self.built_at = 0.0
+        self._build_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- maintenance -------------------------------------------------------
+
+    def upsert(self, lesson: dict, advance_watermark: bool = False):
+        """
+        Index (or re-index) a lesson document. Only documents read back from
+        MongoDB advance the watermark, so a local write can't hide an older
+        write from another process.
+        """
+        lesson_id = lesson.get("id")
+        if not lesson_id:
+            return
+        if advance_watermark:
+            self.watermark = max(self.watermark, _lesson_watermark(lesson))
+
+        terms: Dict[str, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(lesson.get(field)):
+                terms[token] += weight
+        # Kept so typeahead can answer without a database round trip
+        meta = {
+            "id": lesson_id,
+            "title": lesson.get("title"),
+            "passage": lesson.get("passage"),
+            "ageGroup": lesson.get("ageGroup"),
+            "userId": lesson.get("userId"),
+        }
+        if self.doc_terms.get(lesson_id) == terms and self.doc_meta.get(lesson_id) == meta:
+            return
+
+        self.remove(lesson_id)
+        for term, weight in terms.items():
+            self.postings[term][lesson_id] = weight
+        self.doc_terms[lesson_id] = dict(terms)
+        self.doc_meta[lesson_id] = meta
+        self._vocabulary = None
+        self.version += 1
+
+    def remove(self, lesson_id: str):
+        if self.doc_meta.pop(lesson_id, None) is None:
+            return
+        terms = self.doc_terms.pop(lesson_id, {})
+        self.version += 1
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(lesson_id, None)
+                if not docs:
+                    del self.postings[term]
+        self._vocabulary = None
+
+    async def rebuild(self):
+        """Rebuild the whole index from MongoDB"""
+        fresh = SearchIndex()
+        cursor = db.lessons.find({}, INDEX_PROJECTION).batch_size(1000)
+        async for lesson in cursor:
+            fresh.upsert(lesson, advance_watermark=True)
+
+        self.postings = fresh.postings
+        self.doc_terms = fresh.doc_terms
+        self.doc_meta = fresh.doc_meta
+        self.watermark = fresh.watermark
+        self._vocabulary = None
+        self.version += 1
+        self.built = True
+        self.built_at = time.monotonic()
+        logger.info(f"[Search] Index built: {len(self.doc_terms)} lessons, {len(self.postings)} terms")
+
+    async def refresh(self):
+        """Pick up lessons created or updated elsewhere since the watermark"""
+        if not self.watermark:
+            return await self.rebuild()
+        cursor = db.lessons.find(
+            {"$or": [
+                {"updatedAt": {"$gte": self.watermark}},
+                {"createdAt": {"$gte": self.watermark}},
+            ]},
+            INDEX_PROJECTION
+        )
+        async for lesson in cursor:
+            self.upsert(lesson, advance_watermark=True)
+
+    async def ensure_built(self):
+        if self.built:
+            return
+        async with self._build_lock:
+            if not self.built:
+                await self.rebuild()
+
+    # ---- querying ----------------------------------------------------------
+
+    def _vocab(self) -> List[str]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        return self._vocabulary
+
+    def _expand(self, token: str, allow_prefix: bool) -> Dict[str, float]:
+        """Index terms a query token matches, with their match boost"""
+        matches: Dict[str, float] = {}
+        if token in self.postings:
+            matches[token] = EXACT_BOOST
+
+        if allow_prefix:
+            vocab = self._vocab()
+            i = bisect_left(vocab, token)
+            while i < len(vocab) and vocab[i].startswith(token) and len(matches) < MAX_PREFIX_EXPANSIONS:
+                matches.setdefault(vocab[i], PREFIX_BOOST)
+                i += 1
+
+        if not matches and len(token) >= MIN_FUZZY_LENGTH:
+            limit = 1 if len(token) < 8 else 2
+            for term in self.postings:
+                # Typos rarely hit the first letter; checking it keeps this cheap
+                if term[0] == token[0] and edit_distance(token, term, limit) <= limit:
+                    matches[term] = FUZZY_BOOST
+        return matches
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        age_group: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> List[str]:
+        """Return lesson ids ranked by relevance. Every query token must match."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        total_docs = max(len(self.doc_terms), 1)
+        scores: Optional[Dict[str, float]] = None
+
+        for position, token in enumerate(tokens):
+            # Only the token being typed (the last one) is prefix-matched
+            expansions = self._expand(token, allow_prefix=position == len(tokens) - 1)
+            token_scores: Dict[str, float] = defaultdict(float)
+            for term, boost in expansions.items():
+                docs = self.postings[term]
+                idf = math.log(1 + total_docs / len(docs))
+                for lesson_id, weight in docs.items():
+                    token_scores[lesson_id] = max(token_scores[lesson_id], weight * idf * boost)
+
+            if scores is None:
+                scores = dict(token_scores)
+            else:
+                scores = {
+                    lesson_id: score + token_scores[lesson_id]
+                    for lesson_id, score in scores.items()
+                    if lesson_id in token_scores
+                }
+            if not scores:
+                return []
+
+        if age_group or user_id:
+            scores = {
+                lesson_id: score for lesson_id, score in scores.items()
+                if (not age_group or self.doc_meta[lesson_id].get("ageGroup") == age_group)
+                and (not user_id or self.doc_meta[lesson_id].get("userId") == user_id)
+            }
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [lesson_id for lesson_id, _ in ranked[:limit]]
+
+    def stats(self) -> dict:
+        return {
+            "built": self.built,
+            "lessons": len(self.doc_terms),
+            "terms": len(self.postings),
+            "version": self.version,
+            "watermark": self.watermark,
+        }
+
+    # ---- background refresh ------------------------------------------------
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                if time.monotonic() - self.built_at >= REBUILD_INTERVAL:
+                    await self.rebuild()
+                else:
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"[Search] Index refresh failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+search_index = SearchIndex()
+
+
+async def ensure_search_indexes():
+    # The watermark refresh queries these in every process (this index and
+    # the similarity index)
+    await db.lessons.create_index([("updatedAt", ASCENDING)])
+    await db.lessons.create_index([("createdAt", ASCENDING)])
+
+
+async def search_lessons(
+    query: str,
+    limit: int = 10,
+    age_group: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> List[dict]:
+    """Search the index and load the matching lessons in rank order"""
+    await search_index.ensure_built()
+    ids = search_index.search(query, limit, age_group, user_id)
+    if not ids:
+        return []
+    lessons = await db.lessons.find({"id": {"$in": ids}}, {"_id": 0}).to_list(len(ids))
+    by_id = {lesson["id"]: lesson for lesson in lessons}
+    return [by_id[lesson_id] for lesson_id in ids if lesson_id in by_id]
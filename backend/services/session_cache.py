@@ -0,0 +1,57 @@
+# Validated Session Cache
+# Resolves bearer tokens to users with a short-lived in-process cache, so
+# repeated validations (WebSocket reconnects, chatty clients) skip the
+# sessions + users round trips.
+from typing import Optional
+
+from services.cache import TTLCache
+from services.database import db
+
+SESSION_TTL = 60
+# Unknown tokens are cached briefly too, so a storm of bad reconnects
+# can't turn into a storm of database reads.
+INVALID_TOKEN_TTL = 10
+
+# Fields never needed to identify a user and not worth holding in memory
+USER_PROJECTION = {"_id": 0, "passwordHash": 0, "google_calendar_tokens": 0}
+
+session_cache = TTLCache(max_entries=10000, ttl=SESSION_TTL, name="sessions")
+
+
+def parse_token(authorization: Optional[str]) -> Optional[str]:
+    """Accept either a raw token or an 'Authorization: Bearer <token>' value"""
+    if not authorization:
+        return None
+    return authorization.replace("Bearer ", "") if authorization.startswith("Bearer ") else authorization
+
+
+async def _load_user(token: str) -> Optional[dict]:
+    session = await db.sessions.find_one({"token": token}, {"_id": 0, "userId": 1})
+    if not session:
+        return None
+    return await db.users.find_one({"id": session["userId"]}, USER_PROJECTION)
+
+
+async def get_user_for_token(token: Optional[str]) -> Optional[dict]:
+    """Validate a session token and return its user (cached)"""
+    if not token:
+        return None
+    user = await session_cache.get_or_load(token, lambda: _load_user(token))
+    if user is None:
+        # Shorten the lifetime of the negative entry
+        session_cache.set(token, None, ttl=INVALID_TOKEN_TTL)
+    return user
+
+
+def is_cached(token: Optional[str]) -> bool:
+    """True when validating this token will not touch the database"""
+    return bool(token) and token in session_cache
+
+
+def invalidate_token(token: str):
+    session_cache.invalidate(token)
+
+
+def invalidate_user(user_id: str):
+    """Drop every cached session for a user (role change, deletion, ...)"""
+    session_cache.invalidate_where(lambda token, user: bool(user) and user.get("id") == user_id)
@@ -0,0 +1,86 @@
+# Lesson Typeahead
+# Search-as-you-type suggestions. Results are minimal (id, title, passage,
+# ageGroup), answered from the in-process search index and cached per
+# normalized prefix + scope. The cache key includes the index version, so any
+# lesson write makes older entries unreachable instead of serving stale hits.
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from services.cache import TTLCache
+from services.search_index import search_index, tokenize
+
+logger = logging.getLogger(__name__)
+
+TYPEAHEAD_TTL = 30
+TYPEAHEAD_LIMIT = 8
+DISCONNECT_POLL_INTERVAL = 0.1
+
+RESULT_FIELDS = ("id", "title", "passage", "ageGroup")
+
+typeahead_cache = TTLCache(max_entries=5000, ttl=TYPEAHEAD_TTL, name="typeahead")
+
+
+def normalize_prefix(query: str) -> str:
+    """Case, punctuation and spacing don't change suggestions"""
+    return " ".join(tokenize(query))
+
+
+def _suggest(prefix: str, limit: int, age_group: Optional[str], user_id: Optional[str]) -> List[dict]:
+    ids = search_index.search(prefix, limit, age_group, user_id)
+    results = []
+    for lesson_id in ids:
+        meta = search_index.doc_meta.get(lesson_id)
+        if meta:
+            results.append({field: meta.get(field) for field in RESULT_FIELDS})
+    return results
+
+
+async def _wait_unless_disconnected(
+    awaitable: Awaitable,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+) -> bool:
+    """
+    Wait for a shared operation, giving up (without cancelling it, since
+    other requests may be waiting too) if the client goes away.
+    Returns False when abandoned.
+    """
+    task = asyncio.ensure_future(awaitable)
+    if is_disconnected is None:
+        await asyncio.shield(task)
+        return True
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            task.result()
+            return True
+        if await is_disconnected():
+            return False
+
+
+async def suggest_lessons(
+    query: str,
+    limit: int = TYPEAHEAD_LIMIT,
+    age_group: Optional[str] = None,
+    user_id: Optional[str] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> Optional[List[dict]]:
+    """
+    Suggestions for a partially typed query, or None if the client
+    disconnected before they were ready.
+    """
+    prefix = normalize_prefix(query)
+    if len(prefix) < 2:
+        return []
+
+    if not search_index.built:
+        # First requests after startup share the (single) index build
+        if not await _wait_unless_disconnected(search_index.ensure_built(), is_disconnected):
+            return None
+
+    key = (prefix, age_group, user_id, limit, search_index.version)
+    results = typeahead_cache.get(key)
+    if results is None:
+        results = _suggest(prefix, limit, age_group, user_id)
+        typeahead_cache.set(key, results)
+    return results
@@ -0,0 +1,167 @@
+# Collaboration WebSocket Frame Codecs
+# JSON text frames stay the default. Clients that offer the "blp.compact.v1"
+# subprotocol (or connect with ?encoding=compact) get MessagePack frames with
+# short keys, and cursor frames use a fixed 27-byte binary layout.
+import json
+import struct
+import uuid
+from typing import Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_SUBPROTOCOL = "blp.json.v1"
+COMPACT_SUBPROTOCOL = "blp.compact.v1"
+
+# Long key -> short key used in compact frames
+SHORT_KEYS = {
+    "type": "t",
+    "userId": "u",
+    "userName": "n",
+    "timestamp": "ts",
+    "sectionIndex": "s",
+    "position": "p",
+    "isTyping": "k",
+    "field": "f",
+    "value": "v",
+    "persist": "ps",
+    "action": "a",
+    "activeUsers": "au",
+    "users": "us",
+    "tabs": "tb",
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+# Message type -> small integer used in compact frames
+TYPE_CODES = {
+    "cursor": 1,
+    "typing": 2,
+    "edit": 3,
+    "section_focus": 4,
+    "presence": 5,
+    "active_users": 6,
+    "ping": 7,
+    "pong": 8,
+    "get_active_users": 9,
+}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# Fixed cursor layouts (little endian). A leading 0x01 byte can never start a
+# valid compact message (those are always MessagePack maps), so it doubles as
+# the frame tag.
+CURSOR_TAG = 0x01
+# server -> client: tag, user uuid (16 bytes), x, y, sectionIndex (-1 = none)
+CURSOR_OUT = struct.Struct("<B16sffh")
+# client -> server: tag, x, y, sectionIndex
+CURSOR_IN = struct.Struct("<Bffh")
+
+Frame = Union[str, bytes]
+
+
+# Envelope keys holding lists of protocol objects (presence entries) whose
+# own keys are shortened too. Everything else, "value" in particular, is
+# user data and passes through untouched.
+NESTED_KEYS = {"users", "activeUsers"}
+
+
+def _translate(message: dict, keys: dict) -> dict:
+    """Rename the envelope keys of a message (unknown keys are kept as-is)"""
+    translated = {}
+    for key, value in message.items():
+        renamed = keys.get(key, key)
+        # The long name is the original when encoding, the result when decoding
+        if (key in NESTED_KEYS or renamed in NESTED_KEYS) and isinstance(value, list):
+            value = [
+                {keys.get(k, k): v for k, v in item.items()} if isinstance(item, dict) else item
+                for item in value
+            ]
+        translated[renamed] = value
+    return translated
+
+
+class JsonCodec:
+    """Default codec - plain JSON text frames, identical to send_json/receive_json"""
+    name = "json"
+    subprotocol = JSON_SUBPROTOCOL
+
+    def encode(self, message: dict) -> Frame:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, frame: Frame) -> dict:
+        if isinstance(frame, bytes):
+            frame = frame.decode("utf-8")
+        return json.loads(frame)
+
+
+class CompactCodec:
+    """MessagePack frames with short keys and integer message types"""
+    name = "compact"
+    subprotocol = COMPACT_SUBPROTOCOL
+
+    def encode(self, message: dict) -> Frame:
+        if message.get("type") == "cursor":
+            frame = self._encode_cursor(message)
+            if frame is not None:
+                return frame
+
+        compact = _translate(message, SHORT_KEYS)
+        if "t" in compact:
+            compact["t"] = TYPE_CODES.get(compact["t"], compact["t"])
+        return msgpack.packb(compact, use_bin_type=True)
+
+    def decode(self, frame: Frame) -> dict:
+        if isinstance(frame, str):
+            # Compact clients may still send the occasional JSON text frame
+            return json.loads(frame)
+
+        if frame and frame[0] == CURSOR_TAG and len(frame) == CURSOR_IN.size:
+            _, x, y, section_index = CURSOR_IN.unpack(frame)
+            return {
+                "type": "cursor",
+                "position": {"x": x, "y": y},
+                "sectionIndex": None if section_index < 0 else section_index,
+            }
+
+        message = _translate(msgpack.unpackb(frame, raw=False), LONG_KEYS)
+        if isinstance(message.get("type"), int):
+            message["type"] = TYPE_NAMES.get(message["type"], message["type"])
+        return message
+
+    def _encode_cursor(self, message: dict) -> Optional[bytes]:
+        """Pack a cursor broadcast into the fixed layout, or None if it doesn't fit"""
+        position = message.get("position") or {}
+        section_index = message.get("sectionIndex")
+        try:
+            user_bytes = uuid.UUID(str(message.get("userId"))).bytes
+            return CURSOR_OUT.pack(
+                CURSOR_TAG,
+                user_bytes,
+                float(position.get("x", 0)),
+                float(position.get("y", 0)),
+                -1 if section_index is None else int(section_index),
+            )
+        except (ValueError, TypeError, AttributeError, struct.error):
+            return None
+
+
+JSON_CODEC = JsonCodec()
+COMPACT_CODEC = CompactCodec() if msgpack else None
+
+
+def negotiate_codec(offered_subprotocols: list, encoding: Optional[str] = None) -> Tuple[object, Optional[str]]:
+    """
+    Pick a codec for a new connection.
+    Returns (codec, subprotocol) where subprotocol is the value to echo back
+    in the handshake (None if the client did not offer one).
+    """
+    offered = offered_subprotocols or []
+    if COMPACT_CODEC is not None:
+        if COMPACT_SUBPROTOCOL in offered:
+            return COMPACT_CODEC, COMPACT_SUBPROTOCOL
+        if encoding == COMPACT_CODEC.name:
+            return COMPACT_CODEC, None
+    if JSON_SUBPROTOCOL in offered:
+        return JSON_CODEC, JSON_SUBPROTOCOL
+    return JSON_CODEC, None
@@ -157,6 +157,10 @@ class TestAnalyticsEndpoint:
         assert "totalLessons" in metrics
         assert "activeUsers" in metrics
         assert isinstance(metrics["totalUsers"], int)
+        
+        # Approximate DAU/WAU/MAU from the day sketches
+        assert metrics["dau"] <= metrics["wau"] <= metrics["mau"]
+        assert metrics["dau"] >= 1, "The admin's own request should count as active"
         assert isinstance(metrics["totalLessons"], int)
         
         # Verify charts structure
@@ -178,6 +182,45 @@ class TestAnalyticsEndpoint:
             data = response.json()
             assert data["period"] == period
 
+    def test_analytics_counts_new_signup(self, admin_token):
+        """A signup is reflected in the daily rollups once the report cache is refreshed"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        # Rebuilding drops cached dashboard reports
+        requests.post(f"{BASE_URL}/api/admin/analytics/rollups/rebuild?days=1", headers=headers)
+        before = requests.get(f"{BASE_URL}/api/admin/analytics?period=24h", headers=headers).json()
+
+        import uuid
+        requests.post(
+            f"{BASE_URL}/api/auth/signup",
+            json={"email": f"rollup_{uuid.uuid4().hex[:8]}@example.com", "password": "TestPass123", "name": "Rollup Test"}
+        )
+
+        requests.post(f"{BASE_URL}/api/admin/analytics/rollups/rebuild?days=1", headers=headers)
+        after = requests.get(f"{BASE_URL}/api/admin/analytics?period=24h", headers=headers).json()
+        assert after["metrics"]["newSignups"] == before["metrics"]["newSignups"] + 1
+
+    def test_analytics_served_from_cache(self, admin_token):
+        """Repeated dashboard loads are cache hits"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        first = requests.get(f"{BASE_URL}/api/admin/analytics?period=90d", headers=headers)
+        second = requests.get(f"{BASE_URL}/api/admin/analytics?period=90d", headers=headers)
+        assert first.json() == second.json()
+
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/cache", headers=headers)
+        assert response.status_code == 200
+        stats = next(c for c in response.json()["caches"] if c["name"] == "admin-reports")
+        assert stats["hits"] + stats["staleHits"] >= 1
+        assert stats["entries"] <= stats["maxEntries"]
+
+    def test_rollup_rebuild(self, admin_token):
+        """Rollups can be rebuilt from source data"""
+        response = requests.post(
+            f"{BASE_URL}/api/admin/analytics/rollups/rebuild?days=7",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        assert response.json()["success"] is True
+
 
 class TestUsersEndpoint:
     """Test /api/admin/users endpoint"""
@@ -310,5 +353,122 @@ class TestLessonsStatsEndpoint:
             assert response.json()["period"] == period
 
 
+class TestPlanBreakdownEndpoint:
+    """Test /api/admin/plan-breakdown endpoint"""
+
+    def test_plan_breakdown_structure(self, admin_token):
+        """Plan breakdown should cover every user and sum to the MRR"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/plan-breakdown",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+
+        assert "totalUsers" in data
+        assert "totalMRR" in data
+        breakdown = data["breakdown"]
+        assert {p["planId"] for p in breakdown} == {"free", "starter", "pro", "team", "enterprise"}
+        assert sum(p["userCount"] for p in breakdown) == data["totalUsers"]
+        assert round(sum(p["monthlyRevenue"] for p in breakdown), 2) == data["totalMRR"]
+        for plan in breakdown:
+            assert len(plan["recentUsers"]) <= 10
+
+
+class TestJobRunsEndpoint:
+    """Test /api/admin/job-runs endpoint"""
+
+    def test_job_runs_structure(self, admin_token):
+        """Job history lists runs newest first"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/job-runs?job=daily_analytics",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        runs = response.json()["runs"]
+        assert isinstance(runs, list)
+        for run in runs:
+            assert run["job"] == "daily_analytics"
+            assert "status" in run
+            assert "durationMs" in run
+        started = [run["startedAt"] for run in runs]
+        assert started == sorted(started, reverse=True)
+
+
+class TestScheduledJobsEndpoint:
+    """Test /api/admin/scheduled-jobs endpoint"""
+
+    def test_scheduled_jobs_have_a_leader(self, admin_token):
+        """One worker holds the scheduler lease and the daily job is registered"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/scheduled-jobs",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["leader"], "Expected a worker to hold the scheduler lease"
+        daily = next(j for j in data["jobs"] if j["id"] == "daily_analytics")
+        assert daily["nextRunAt"]
+
+
+class TestEmailOutboxEndpoint:
+    """Test /api/admin/email-outbox endpoint"""
+
+    def test_email_outbox_stats(self, admin_token):
+        """Outbox stats report per-status counts and recent failures"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/email-outbox",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert "configured" in data
+        assert isinstance(data["counts"], dict)
+        assert isinstance(data["recentFailures"], list)
+
+
+class TestAdminExport:
+    """Test /api/admin/export/{dataset} streaming exports"""
+
+    def test_export_users_csv(self, admin_token):
+        """Users export streams CSV without secrets"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/users",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert "attachment" in response.headers["content-disposition"]
+        lines = response.text.splitlines()
+        assert lines[0] == "id,email,name,role,createdAt"
+        assert any(ADMIN_EMAIL in line for line in lines[1:])
+        assert "passwordHash" not in response.text
+
+    def test_export_analytics_ndjson(self, admin_token):
+        """Rollups export as one JSON object per line"""
+        import json
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/analytics?format=ndjson",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 200
+        for line in response.text.splitlines():
+            assert "date" in json.loads(line)
+
+    def test_export_rejects_unknown_dataset(self, admin_token):
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/passwords",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        assert response.status_code == 404
+
+    def test_export_requires_admin(self, regular_user_token):
+        response = requests.get(
+            f"{BASE_URL}/api/admin/export/users",
+            headers={"Authorization": f"Bearer {regular_user_token}"}
+        )
+        assert response.status_code == 403
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,120 @@
+"""
+Lesson Revision History Tests
+Tests listing, diffing and restoring lesson revisions
+"""
+import pytest
+import requests
+import os
+import json
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://claude-ai-features.preview.emergentagent.com').rstrip('/') + "/api"
+
+TEST_PASSWORD = "TestPass123!"
+
+LESSON_DATA = {
+    "title": "TEST_Revisions Lesson",
+    "passage": "Psalm 23",
+    "ageGroup": "Elementary (6-10)",
+    "duration": "45 min",
+    "format": "Interactive",
+    "theme": "The Good Shepherd",
+    "memoryVerseText": "The Lord is my shepherd",
+    "memoryVerseReference": "Psalm 23:1",
+    "objectives": ["Learn that God cares for us"],
+    "sectionsJson": json.dumps([
+        {"title": "Opening", "duration": "5 min", "content": "Prayer"},
+        {"title": "Story", "duration": "15 min", "content": "David the shepherd"}
+    ]),
+    "materialsJson": '[{"item":"Bible","category":"essential"}]'
+}
+
+@pytest.fixture(scope="module")
+def headers():
+    """Sign up a fresh user for revision tests"""
+    email = f"revisions_test_{uuid.uuid4().hex[:8]}@example.com"
+    response = requests.post(f"{BASE_URL}/auth/signup", json={
+        "email": email,
+        "password": TEST_PASSWORD
+    })
+    if response.status_code != 200:
+        pytest.skip(f"Signup failed: {response.status_code} - {response.text}")
+    token = response.json()["token"]
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+@pytest.fixture(scope="module")
+def lesson_id(headers):
+    """Create a lesson and edit it twice"""
+    response = requests.post(f"{BASE_URL}/lessons", json=LESSON_DATA, headers=headers)
+    assert response.status_code == 200
+    lesson_id = response.json()["id"]
+    
+    sections = json.loads(LESSON_DATA["sectionsJson"])
+    sections[1]["content"] = "David and Goliath"
+    requests.put(f"{BASE_URL}/lessons/{lesson_id}", json={"sectionsJson": json.dumps(sections)}, headers=headers)
+    requests.put(f"{BASE_URL}/lessons/{lesson_id}", json={"title": "TEST_Revisions Lesson v3"}, headers=headers)
+    
+    yield lesson_id
+    requests.delete(f"{BASE_URL}/lessons/{lesson_id}", headers=headers)
+
+
+class TestLessonRevisions:
+    """Revision history API tests"""
+    
+    def test_list_revisions(self, headers, lesson_id):
+        """Test GET /lessons/{id}/revisions returns newest first"""
+        response = requests.get(f"{BASE_URL}/lessons/{lesson_id}/revisions", headers=headers)
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        
+        revisions = response.json()["revisions"]
+        assert [r["rev"] for r in revisions] == [3, 2, 1]
+        assert revisions[0]["fields"] == ["title"]
+        assert revisions[1]["sectionIndexes"] == [1]
+        print("✓ Revisions listed newest first with change summaries")
+    
+    def test_get_revision(self, headers, lesson_id):
+        """Test GET /lessons/{id}/revisions/{rev} rebuilds old content"""
+        response = requests.get(f"{BASE_URL}/lessons/{lesson_id}/revisions/1", headers=headers)
+        assert response.status_code == 200
+        
+        lesson = response.json()["lesson"]
+        assert lesson["title"] == LESSON_DATA["title"]
+        assert lesson["sectionsJson"][1]["content"] == "David the shepherd"
+        print("✓ Revision 1 rebuilt with original content")
+    
+    def test_diff_revisions(self, headers, lesson_id):
+        """Test GET /lessons/{id}/revisions/diff reports field and section changes"""
+        response = requests.get(f"{BASE_URL}/lessons/{lesson_id}/revisions/diff?from=1&to=3", headers=headers)
+        assert response.status_code == 200
+        
+        data = response.json()
+        assert data["fields"]["title"]["to"] == "TEST_Revisions Lesson v3"
+        assert data["sections"] == [{
+            "index": 1,
+            "change": "modified",
+            "from": {"title": "Story", "duration": "15 min", "content": "David the shepherd"},
+            "to": {"title": "Story", "duration": "15 min", "content": "David and Goliath"}
+        }]
+        print("✓ Diff shows title and section 1 changes")
+    
+    def test_restore_revision(self, headers, lesson_id):
+        """Test POST /lessons/{id}/revisions/{rev}/restore creates a new revision"""
+        response = requests.post(f"{BASE_URL}/lessons/{lesson_id}/revisions/1/restore", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["rev"] == 4
+        
+        lesson = requests.get(f"{BASE_URL}/lessons/{lesson_id}").json()
+        assert lesson["title"] == LESSON_DATA["title"]
+        print("✓ Lesson restored to revision 1 as revision 4")
+    
+    def test_revisions_require_auth(self, lesson_id):
+        """Test revision history is not public"""
+        response = requests.get(f"{BASE_URL}/lessons/{lesson_id}/revisions")
+        assert response.status_code == 401
+        print("✓ Revision history requires authentication")
+    
+    def test_unknown_revision(self, headers, lesson_id):
+        """Test requesting a revision that doesn't exist"""
+        response = requests.get(f"{BASE_URL}/lessons/{lesson_id}/revisions/999", headers=headers)
+        assert response.status_code == 404
+        print("✓ Unknown revision returns 404")
@@ -80,6 +80,127 @@ class TestLessonSearch:
                 assert field in result, f"Missing required field: {field}"
         print("✓ Search results have correct structure")
 
+    def test_search_prefix_typo_and_filters(self):
+        """Newly created lessons are found by prefix, with typos, and respect filters"""
+        lesson = requests.post(f"{BASE_URL}/api/lessons", json={
+            "title": "TEST_Zacchaeus Climbs the Sycamore",
+            "passage": "Luke 19:1-10",
+            "ageGroup": "Preschool (3-5)",
+            "duration": "30 min",
+            "format": "Interactive",
+            "theme": "Repentance",
+            "memoryVerseText": "For the Son of Man came to seek and to save the lost.",
+            "memoryVerseReference": "Luke 19:10",
+            "objectives": [],
+            "sectionsJson": [],
+            "materialsJson": []
+        }).json()
+
+        for query in ["zacch", "zaccheus sycamore"]:
+            response = requests.get(f"{BASE_URL}/api/lessons/search", params={"q": query})
+            assert response.status_code == 200
+            assert lesson["id"] in [l["id"] for l in response.json()], f"'{query}' did not match"
+
+        response = requests.get(f"{BASE_URL}/api/lessons/search", params={"q": "zacch", "ageGroup": "Adult"})
+        assert lesson["id"] not in [l["id"] for l in response.json()]
+
+        requests.delete(f"{BASE_URL}/api/lessons/{lesson['id']}")
+        response = requests.get(f"{BASE_URL}/api/lessons/search", params={"q": "zacch"})
+        assert lesson["id"] not in [l["id"] for l in response.json()]
+        print("✓ Search matches prefixes and typos, filters by age group, drops deleted lessons")
+
+    def test_typeahead_minimal_results(self):
+        """Typeahead returns only the fields the dropdown needs"""
+        response = requests.get(f"{BASE_URL}/api/lessons/typeahead", params={"q": "Te"})
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        for result in data:
+            assert set(result) == {"id", "title", "passage", "ageGroup"}
+
+        response = requests.get(f"{BASE_URL}/api/lessons/typeahead", params={"q": "te", "scope": "mine"})
+        assert response.status_code == 401, "scope=mine requires authentication"
+        print(f"✓ Typeahead returned {len(data)} minimal results")
+
+
+class TestScriptureSearch:
+    """Test verse-range lookup of lessons by scripture reference"""
+
+    def test_lessons_overlapping_reference(self):
+        """A lesson on an abbreviated passage is found by an overlapping reference"""
+        lesson = requests.post(f"{BASE_URL}/api/lessons", json={
+            "title": "TEST_Crossing the Red Sea",
+            "passage": "Ex. 14:10-31",
+            "ageGroup": "Elementary (6-10)",
+            "duration": "45 min",
+            "format": "Interactive",
+            "theme": "Trust",
+            "memoryVerseText": "The Lord will fight for you; you need only to be still.",
+            "memoryVerseReference": "Exodus 14:14",
+            "objectives": [],
+            "sectionsJson": [],
+            "materialsJson": []
+        }).json()
+
+        response = requests.get(f"{BASE_URL}/api/lessons/by-scripture", params={"ref": "Exodus 14–15"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["ranges"] == ["Exodus 14-15"]
+        assert lesson["id"] in [l["id"] for l in data["lessons"]]
+
+        response = requests.get(f"{BASE_URL}/api/lessons/by-scripture", params={"ref": "Exodus 14:1-9"})
+        assert lesson["id"] not in [l["id"] for l in response.json()["lessons"]]
+
+        requests.delete(f"{BASE_URL}/api/lessons/{lesson['id']}")
+        print("✓ Scripture lookup matches overlapping ranges only")
+
+    def test_unparseable_reference(self):
+        """A reference that isn't scripture is rejected"""
+        response = requests.get(f"{BASE_URL}/api/lessons/by-scripture", params={"ref": "not a verse"})
+        assert response.status_code == 400
+        print("✓ Unparseable reference returns 400")
+
+
+class TestSimilarLessons:
+    """Test "more like this" recommendations"""
+
+    def test_similar_lessons_ranked(self):
+        """A lesson on the same passage and theme ranks above an unrelated one"""
+        def create(title, passage, theme):
+            return requests.post(f"{BASE_URL}/api/lessons", json={
+                "title": title,
+                "passage": passage,
+                "ageGroup": "Elementary (6-10)",
+                "duration": "30 min",
+                "format": "Interactive",
+                "theme": theme,
+                "memoryVerseText": "",
+                "memoryVerseReference": "",
+                "objectives": [],
+                "sectionsJson": [],
+                "materialsJson": []
+            }).json()
+
+        base = create("TEST_Daniel and the Lions", "Daniel 6", "Faithfulness")
+        related = create("TEST_Daniel in the Lions Den", "Dan 6:10-23", "Faithfulness in prayer")
+        unrelated = create("TEST_Feeding the Five Thousand", "John 6:1-14", "Provision")
+
+        response = requests.get(f"{BASE_URL}/api/lessons/{base['id']}/similar", params={"limit": 20})
+        assert response.status_code == 200
+        ranked = [l["id"] for l in response.json()["similar"]]
+        assert related["id"] in ranked
+        if unrelated["id"] in ranked:
+            assert ranked.index(related["id"]) < ranked.index(unrelated["id"])
+
+        for lesson in (base, related, unrelated):
+            requests.delete(f"{BASE_URL}/api/lessons/{lesson['id']}")
+        print("✓ Similar lessons ranked by content")
+
+    def test_similar_unknown_lesson(self):
+        response = requests.get(f"{BASE_URL}/api/lessons/nonexistent-lesson-id/similar")
+        assert response.status_code == 404
+        print("✓ Unknown lesson returns 404")
+
 
 class TestPrintView:
     """Test print-friendly lesson view"""
@@ -296,5 +417,148 @@ class TestExistingFeaturesStillWork:
         print(f"✓ Auth signin works for: {data['user'].get('email')}")
 
 
+class TestScheduledLessonEmail:
+    """Test lesson emails scheduled for later delivery"""
+    
+    @pytest.fixture
+    def auth_token(self):
+        """Get auth token for authenticated requests"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/signin",
+            json={"email": TEST_EMAIL, "password": TEST_PASSWORD}
+        )
+        if response.status_code != 200:
+            pytest.skip("Authentication failed")
+        return response.json().get("token")
+    
+    def _send(self, auth_token, schedule_for):
+        return requests.post(
+            f"{BASE_URL}/api/email/send-lesson",
+            json={"lessonId": TEST_LESSON_ID, "recipientEmail": TEST_EMAIL, "scheduleFor": schedule_for},
+            headers={"Authorization": f"Bearer {auth_token}"}
+        )
+    
+    def test_schedule_lesson_email(self, auth_token):
+        """A future scheduleFor queues the email instead of sending it"""
+        from datetime import datetime, timedelta, timezone
+        when = datetime.now(timezone.utc) + timedelta(days=2)
+        response = self._send(auth_token, when.isoformat())
+        if response.status_code == 500:
+            pytest.skip("Email service not configured")
+        assert response.status_code == 200, f"Scheduling failed: {response.text}"
+        data = response.json()
+        assert data["status"] == "scheduled"
+        assert data["scheduledFor"] == when.replace(second=0, microsecond=0).isoformat()
+        assert data.get("outboxId")
+        print(f"✓ Lesson email scheduled for {data['scheduledFor']}")
+    
+    def test_invalid_schedule_rejected(self, auth_token):
+        """An unparseable scheduleFor is a 400"""
+        response = self._send(auth_token, "next sunday")
+        if response.status_code == 500:
+            pytest.skip("Email service not configured")
+        assert response.status_code == 400
+        print("✓ Invalid scheduleFor rejected")
+
+
+class TestBulkLessonEmail:
+    """Test sending a lesson to several recipients at once"""
+    
+    @pytest.fixture
+    def auth_token(self):
+        """Get auth token for authenticated requests"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/signin",
+            json={"email": TEST_EMAIL, "password": TEST_PASSWORD}
+        )
+        if response.status_code != 200:
+            pytest.skip("Authentication failed")
+        return response.json().get("token")
+    
+    def test_bulk_requires_auth(self):
+        """Bulk send requires authentication"""
+        response = requests.post(
+            f"{BASE_URL}/api/email/send-lesson/bulk",
+            json={"lessonId": TEST_LESSON_ID, "recipients": [TEST_EMAIL]}
+        )
+        assert response.status_code == 401
+        print("✓ Bulk send requires authentication")
+    
+    def test_bulk_send_and_poll(self, auth_token):
+        """Duplicate recipients are merged and the batch status is pollable"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.post(
+            f"{BASE_URL}/api/email/send-lesson/bulk",
+            json={"lessonId": TEST_LESSON_ID, "recipients": [TEST_EMAIL, TEST_EMAIL.upper()]},
+            headers=headers
+        )
+        if response.status_code in (403, 500):
+            pytest.skip("Lesson not sendable by test user or email not configured")
+        assert response.status_code == 200, f"Bulk send failed: {response.text}"
+        data = response.json()
+        assert data["recipientCount"] == 1
+        
+        status = requests.get(f"{BASE_URL}/api/email/batches/{data['batchId']}", headers=headers)
+        assert status.status_code == 200
+        batch = status.json()
+        assert len(batch["recipients"]) == 1
+        assert sum(batch["counts"].values()) == 1
+        print(f"✓ Bulk batch status: {batch['counts']}")
+
+
+class TestNotificationFanOut:
+    """Test notifying several users in one request"""
+    
+    def test_fan_out_requires_auth(self):
+        """Fan-out requires authentication"""
+        response = requests.post(
+            f"{BASE_URL}/api/notifications/fan-out",
+            json={"type": "info", "title": "Hello", "message": "Hi team", "team": True}
+        )
+        assert response.status_code == 401
+        print("✓ Fan-out requires authentication")
+    
+    def test_fan_out_without_recipients(self):
+        """Fan-out to nobody is a 404, not an empty success"""
+        signin = requests.post(
+            f"{BASE_URL}/api/auth/signin",
+            json={"email": TEST_EMAIL, "password": TEST_PASSWORD}
+        )
+        if signin.status_code != 200:
+            pytest.skip("Authentication failed")
+        response = requests.post(
+            f"{BASE_URL}/api/notifications/fan-out",
+            json={"type": "info", "title": "Hello", "message": "Hi", "recipientIds": ["no-such-user"]},
+            headers={"Authorization": f"Bearer {signin.json().get('token')}"}
+        )
+        assert response.status_code == 404
+        print("✓ Fan-out with no matching recipients returns 404")
+
+
+class TestNotificationUnreadCount:
+    """Test the maintained unread counter"""
+    
+    def test_unread_count_requires_auth(self):
+        """Unread count requires authentication"""
+        response = requests.get(f"{BASE_URL}/api/notifications/unread-count")
+        assert response.status_code == 401
+        print("✓ Unread count requires authentication")
+    
+    def test_unread_count_matches_listing(self):
+        """The badge count and the listing agree"""
+        signin = requests.post(
+            f"{BASE_URL}/api/auth/signin",
+            json={"email": TEST_EMAIL, "password": TEST_PASSWORD}
+        )
+        if signin.status_code != 200:
+            pytest.skip("Authentication failed")
+        headers = {"Authorization": f"Bearer {signin.json().get('token')}"}
+        count = requests.get(f"{BASE_URL}/api/notifications/unread-count", headers=headers)
+        listing = requests.get(f"{BASE_URL}/api/notifications", headers=headers)
+        assert count.status_code == 200 and listing.status_code == 200
+        assert count.json()["unreadCount"] == listing.json()["unreadCount"]
+        print(f"✓ Unread count: {count.json()['unreadCount']}")
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])
@@ -45,6 +45,7 @@ export function SearchBar({ isMobile = false }: { isMobile?: boolean }) {
   const [isLoading, setIsLoading] = useState(false)
   const inputRef = useRef<HTMLInputElement>(null)
   const containerRef = useRef<HTMLDivElement>(null)
+  const abortRef = useRef<AbortController | null>(null)
   const navigate = useNavigate()
 
   // Close dropdown when clicking outside
@@ -60,8 +61,11 @@ export function SearchBar({ isMobile = false }: { isMobile?: boolean }) {
 
   // Search logic
   const performSearch = useCallback(async (searchQuery: string) => {
+    // A newer keystroke supersedes any request still in flight
+    abortRef.current?.abort()
     if (searchQuery.length < 2) {
       setResults([])
+      setIsLoading(false)
       return
     }
 
@@ -94,8 +98,13 @@ export function SearchBar({ isMobile = false }: { isMobile?: boolean }) {
 
     // Try to fetch lessons from API
     let lessonMatches: SearchResult[] = []
+    const controller = new AbortController()
+    abortRef.current = controller
     try {
-      const response = await fetch(`${import.meta.env.VITE_API_URL}/lessons/search?q=${encodeURIComponent(searchQuery)}`)
+      const response = await fetch(
+        `${import.meta.env.VITE_API_URL}/lessons/typeahead?q=${encodeURIComponent(searchQuery)}&limit=4`,
+        { signal: controller.signal }
+      )
       if (response.ok) {
         const lessons = await response.json()
         lessonMatches = lessons.slice(0, 4).map((lesson: any) => ({
@@ -107,6 +116,7 @@ export function SearchBar({ isMobile = false }: { isMobile?: boolean }) {
         }))
       }
     } catch (err) {
+      if (controller.signal.aborted) return
       // Silent fail for API search
     }
 